@@ -1,8 +1,30 @@
 # app.py
 import os
+import json
+import math
 import logging
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_file
 from meta import PostToFacebookPage
+from cache import token_cache, ig_account_cache, media_probe_cache
+import transport
+from jobs import job_queue
+from poller import reel_poller
+from ratelimit import rate_governor
+from bulk import run_bulk
+import metrics
+from idempotency import idempotency_store, fingerprint, scope
+from checkpoints import checkpoint_store
+from hashtags import DEFAULT_COMMENT, HASHTAG_EDGES
+from registry import poster_registry
+from scheduler import publish_scheduler, parse_publish_at
+import prepared
+from prepared import prepared_containers, prepare_arguments
+from media_index import media_index
+import breaker
+from breaker import CircuitOpenError, circuit_breakers
+from callbacks import callback_dispatcher, check_callback_url
+from webhooks import webhook_receiver
+from staging import staging_area
 from functools import wraps
 
 logging.basicConfig(level=logging.INFO)
@@ -10,8 +32,20 @@ app = Flask(__name__)
 
 API_KEY = os.getenv("FLASK_API_KEY")
 
+def start_background():
+    """
+    Start this process's job workers, publish scheduler and callback
+    dispatcher, so jobs queued or scheduled before it started and their
+    pending callbacks are picked up. Called once the serving process is up
+    (gunicorn.conf.py, the ASGI lifespan, __main__) rather than at import,
+    so tools and a preloading master can import the app without threads.
+    """
+    job_queue.start()
+    publish_scheduler.start()
+    callback_dispatcher.start()
+
 def build_poster_from_headers():
-    """Build PostToFacebookPage instance using headers"""
+    """Get the registry's PostToFacebookPage instance for the request headers"""
     app_id = request.headers.get("X-APP-ID")
     app_secret = request.headers.get("X-APP-SECRET")
     page_id = request.headers.get("X-PAGE-ID")
@@ -22,9 +56,100 @@ def build_poster_from_headers():
             "error": "Missing one of required headers: X-APP-ID, X-APP-SECRET, X-PAGE-ID, X-ACCESS-TOKEN"
         }), 400
 
-    poster = PostToFacebookPage(app_id, app_secret, page_id, token)
+    poster = poster_registry.get(PostToFacebookPage, app_id, app_secret, page_id, token)
     return poster, None, None
 
+def deferred(payload):
+    """True when a publish request asks to run in the background"""
+    return bool(payload.get('async') or payload.get('callback_url')) or payload.get('publish_at') is not None
+
+def enqueue_publish(poster, method, kwargs, payload):
+    """
+    Queue a publish for the background workers, or schedule it when the
+    payload has a publish_at, and answer 202 with the job ID. The outcome
+    is POSTed to the payload's callback_url, if any, once the job has run.
+    """
+    publish_at = payload.get('publish_at')
+    callback_url = payload.get('callback_url')
+    try:
+        if callback_url is not None:
+            check_callback_url(callback_url)
+        if publish_at is not None:
+            publish_at = parse_publish_at(publish_at)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if publish_at is None:
+        job_id = job_queue.enqueue(poster, method, kwargs, callback_url=callback_url)
+        return jsonify({'job_id': job_id, 'status': 'queued', 'status_url': f'/jobs/{job_id}'}), 202
+
+    job_id, run_at = publish_scheduler.schedule(poster, method, kwargs, publish_at, callback_url)
+    return jsonify({
+        'job_id': job_id,
+        'status': 'scheduled',
+        'publish_at': publish_at,
+        'run_at': run_at,
+        'status_url': f'/jobs/{job_id}',
+    }), 202
+
+def unavailable(error):
+    """503 for a request that failed because a Graph circuit breaker is open"""
+    response = jsonify({
+        'error': str(error),
+        'endpoint_class': error.endpoint_class,
+        'retry_after': round(error.retry_after, 1),
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(math.ceil(error.retry_after))
+    return response
+
+def circuit_response(response):
+    """Replace a failed response with a 503 when an open breaker caused it"""
+    if response.status_code == 503 or not response.is_json:
+        return response
+    error = breaker.rejection_for(response.status_code, response.get_json(silent=True))
+    return response if error is None else unavailable(error)
+
+@app.before_request
+def watch_circuits():
+    g.rejections, g.circuit_token = breaker.start_watch()
+
+@app.after_request
+def fail_fast(response):
+    return circuit_response(response)
+
+@app.teardown_request
+def end_watch(exc):
+    if 'circuit_token' in g:
+        breaker.end_watch(g.circuit_token)
+
+@app.errorhandler(CircuitOpenError)
+def circuit_open(error):
+    return unavailable(error)
+
+@app.before_request
+def start_timings():
+    """Collect a per-call timing breakdown when the caller asks for one"""
+    if request.headers.get("X-DEBUG-TIMINGS") or request.args.get('timings'):
+        g.timings, g.timings_token = transport.start_trace()
+
+@app.after_request
+def attach_timings(response):
+    if 'timings' in g and response.is_json:
+        data = response.get_json()
+        if isinstance(data, dict):
+            data['timings'] = {
+                'graph_calls': g.timings,
+                'graph_ms': round(sum(step['duration_ms'] for step in g.timings), 1),
+            }
+            response.set_data(json.dumps(data))
+    return response
+
+@app.teardown_request
+def end_timings(exc):
+    if 'timings_token' in g:
+        transport.end_trace(g.timings_token)
+
 def require_api_key(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -34,14 +159,150 @@ def require_api_key(f):
         return f(*args, **kwargs)
     return decorated
 
+def idempotent(f):
+    """
+    Honour an Idempotency-Key header: a duplicate of an in-flight publish is
+    answered 409 right away and a duplicate of a finished one gets the stored
+    response back. Keys are scoped to the app, page and route.
+    Server errors are not stored so that the caller can retry them.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return f(*args, **kwargs)
+
+        scoped_key = scope(request.headers.get('X-APP-ID'), request.headers.get('X-PAGE-ID'), request.path, key)
+        state, stored = idempotency_store.begin(scoped_key, fingerprint(request.get_data()))
+        if state == 'mismatch':
+            return jsonify({'error': 'Idempotency-Key was already used with a different request'}), 422
+        if state == 'in_progress':
+            return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409, {'Retry-After': '5'}
+        if stored is not None:
+            body, status = stored
+            return Response(body, status=status, mimetype='application/json', headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = circuit_response(app.make_response(f(*args, **kwargs)))
+        except Exception:
+            idempotency_store.abandon(scoped_key)
+            raise
+        if response.status_code >= 500:
+            idempotency_store.abandon(scoped_key)
+        else:
+            idempotency_store.complete(scoped_key, response.get_data(as_text=True), response.status_code)
+        return response
+    return decorated
+
 @app.route('/health', methods=['GET'])
 @require_api_key
 def health():
-    "This function tests if the server is running"
-    return jsonify({'status': 'ok'})
+    "This function tests if the server is running, and reports Graph circuit breakers"
+    return jsonify({
+        'status': 'degraded' if circuit_breakers.any_open() else 'ok',
+        'circuit_breakers': circuit_breakers.states(),
+    })
+
+@app.route('/stats', methods=['GET'])
+@require_api_key
+def stats():
+    "Process-local cache, connection pool and rate budget counters"
+    return jsonify({
+        'token_cache': token_cache.stats(),
+        'ig_account_cache': ig_account_cache.stats(),
+        'media_probe_cache': media_probe_cache.stats(),
+        'media_index': media_index.stats(),
+        'http_pools': transport.pool_stats(),
+        'hedged_requests': transport.hedge_stats(),
+        'reel_poller': {'pending': reel_poller.pending()},
+        'rate_limits': rate_governor.stats(),
+        'checkpoints': checkpoint_store.stats(),
+        'poster_registry': poster_registry.stats(),
+        'scheduler': dict(publish_scheduler.stats(), jobs=job_queue.counts()),
+        'prepared_containers': prepared_containers.stats(),
+        'webhooks': webhook_receiver.stats(),
+        'callbacks': callback_dispatcher.stats(),
+        'staging': staging_area.stats(),
+    })
+
+@app.route('/admin/tenants', methods=['GET'])
+@require_api_key
+def admin_tenants():
+    "Pages with a loaded poster, most recently used first, and their cache state"
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+    except ValueError:
+        return jsonify({'error': 'offset and limit must be integers'}), 400
+    return jsonify({
+        'registry': poster_registry.stats(),
+        'tenants': poster_registry.tenants(offset, limit),
+    })
+
+@app.route('/metrics', methods=['GET'])
+@require_api_key
+def prometheus_metrics():
+    "Outbound Graph call histograms in Prometheus text format"
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@require_api_key
+def get_job(job_id):
+    "Status, per-step timings and Graph IDs of a queued publish"
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'job not found'}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+@require_api_key
+def cancel_job(job_id):
+    "Cancel a scheduled publish that has not been released to the workers yet"
+    if not job_queue.cancel(job_id):
+        job = job_queue.get(job_id)
+        if not job:
+            return jsonify({'error': 'job not found'}), 404
+        return jsonify({'error': f"job is already {job['status']}"}), 409
+    return jsonify(job_queue.get(job_id))
+
+@app.route('/webhooks', methods=['GET'])
+def webhook_verify():
+    "Meta's subscription handshake: echo hub.challenge when hub.verify_token matches"
+    challenge = webhook_receiver.verify(request.args)
+    if challenge is None:
+        return jsonify({'error': 'Verification failed'}), 403
+    return Response(challenge, mimetype='text/plain')
+
+@app.route('/webhooks', methods=['POST'])
+def webhook_event():
+    """
+    Meta webhook deliveries, authenticated by X-Hub-Signature-256 instead of
+    the API key. Media and video status changes wake the reel poller.
+    """
+    body = request.get_data()
+    if not webhook_receiver.authentic(body, request.headers.get("X-Hub-Signature-256")):
+        return jsonify({'error': 'Invalid signature'}), 403
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return jsonify({'error': 'Invalid JSON'}), 400
+    return jsonify(webhook_receiver.consume(payload))
+
+@app.route('/staged/<name>', methods=['GET'])
+def staged_reel(name):
+    """
+    Staged reels for Graph to fetch, with Range support. Names are content
+    hashes, so there is no API key Graph could not send anyway.
+    """
+    path = staging_area.path(name)
+    if path is None:
+        return jsonify({'error': 'not found'}), 404
+    staging_area.touch(name)
+    return send_file(path, mimetype='video/mp4', conditional=True, max_age=3600)
 
 @app.route('/fb/post-images', methods=['POST'])
 @require_api_key
+@idempotent
 def fb_post_images():
     poster, err_resp, code = build_poster_from_headers()
     if err_resp: return err_resp, code
@@ -51,6 +312,9 @@ def fb_post_images():
     if not posts or not isinstance(posts, list):
         return jsonify({'error': 'posts list is required'}), 400
 
+    if deferred(payload):
+        return enqueue_publish(poster, 'fb_post_images', {'posts': posts}, payload)
+
     try:
         results = poster.fb_post_images(posts)
         return jsonify({'results': results}), 200
@@ -60,6 +324,7 @@ def fb_post_images():
 
 @app.route('/fb/upload-reel', methods=['POST'])
 @require_api_key
+@idempotent
 def fb_upload_reel():
     poster, err_resp, code = build_poster_from_headers()
     if err_resp: return err_resp, code
@@ -71,15 +336,19 @@ def fb_upload_reel():
     if not video_url:
         return jsonify({'error': 'video_url required'}), 400
 
+    if deferred(payload):
+        return enqueue_publish(poster, 'fb_upload_reel', {'video_url': video_url, 'caption': caption}, payload)
+
     try:
-        success = poster.fb_upload_reel(video_url, caption)
-        return jsonify({'success': bool(success)}), (200 if success else 500)
+        result = poster.fb_upload_reel(video_url, caption)
+        return jsonify(result), (200 if result['success'] else 500)
     except Exception as e:
         logging.exception("upload_reel failed")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/ig/post-carousel', methods=['POST'])
 @require_api_key
+@idempotent
 def ig_post_carousel():
     poster, err_resp, code = build_poster_from_headers()
     if err_resp: return err_resp, code
@@ -89,6 +358,9 @@ def ig_post_carousel():
     if not posts:
         return jsonify({'error': 'posts list required'}), 400
 
+    if deferred(payload):
+        return enqueue_publish(poster, 'ig_post_carousel', {'posts': posts}, payload)
+
     try:
         result = poster.ig_post_carousel(posts)
         return jsonify(result)
@@ -98,6 +370,7 @@ def ig_post_carousel():
     
 @app.route('/ig/post-image', methods=['POST'])
 @require_api_key
+@idempotent
 def ig_post_image():
     poster, err_resp, code = build_poster_from_headers()
     if err_resp: return err_resp, code
@@ -108,6 +381,9 @@ def ig_post_image():
     if not image_url:
         return jsonify({'error': 'Image url required'}), 400
 
+    if deferred(payload):
+        return enqueue_publish(poster, 'ig_post_image', {'image_url': image_url, 'caption': caption}, payload)
+
     try:
         result = poster.ig_post_image(image_url, caption)
         return jsonify(result)
@@ -118,6 +394,7 @@ def ig_post_image():
 
 @app.route('/ig/upload-reel', methods=['POST'])
 @require_api_key
+@idempotent
 def ig_upload_reel():
     poster, err_resp, code = build_poster_from_headers()
     if err_resp: return err_resp, code
@@ -129,12 +406,133 @@ def ig_upload_reel():
     if not video_url:
         return jsonify({'error': 'video_url required'}), 400
 
+    # A callback reports the published reel, not the container
+    wait = bool(payload.get('wait', True) or payload.get('callback_url'))
+
+    if deferred(payload):
+        return enqueue_publish(poster, 'ig_upload_reel', {'video_url': video_url, 'video_caption': caption, 'wait': wait}, payload)
+
     try:
-        result = poster.ig_upload_reel(video_url, caption)
+        result = poster.ig_upload_reel(video_url, caption, wait=wait)
         return jsonify(result)
     except Exception as e:
         logging.exception("ig_post failed")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/ig/prepare', methods=['POST'])
+@require_api_key
+@idempotent
+def ig_prepare():
+    """
+    Create the containers of an Instagram publish without publishing it and
+    return a handle for /ig/commit. Reels are returned once processed.
+    """
+    poster, err_resp, code = build_poster_from_headers()
+    if err_resp: return err_resp, code
+
+    payload = request.get_json() or {}
+    try:
+        method, kwargs = prepare_arguments(payload)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        result = prepared.prepare(poster, method, kwargs)
+        return jsonify(result), 409 if 'open_handle' in result else 200
+    except Exception as e:
+        logging.exception("ig prepare failed")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/ig/prepare/<handle>', methods=['GET'])
+@require_api_key
+def get_prepared(handle):
+    "Status, container ID and expiry of a prepared publish"
+    entry = prepared_containers.get(handle)
+    if not entry or entry['page_id'] != request.headers.get("X-PAGE-ID"):
+        return jsonify({'error': 'handle not found'}), 404
+    return jsonify(entry)
+
+@app.route('/ig/commit', methods=['POST'])
+@require_api_key
+@idempotent
+def ig_commit():
+    """
+    Publish a prepared container with a single media_publish call,
+    recreating it first if it expired.
+    """
+    poster, err_resp, code = build_poster_from_headers()
+    if err_resp: return err_resp, code
+
+    payload = request.get_json() or {}
+    handle = payload.get('handle')
+    if not handle:
+        return jsonify({'error': 'handle required'}), 400
+
+    try:
+        result, entry = prepared.commit(poster, handle)
+    except Exception as e:
+        logging.exception("ig commit failed")
+        return jsonify({'error': str(e)}), 500
+    if result is None:
+        if not entry or entry['page_id'] != poster.page_id or entry['app_id'] != poster.app_id:
+            return jsonify({'error': 'handle not found'}), 404
+        return jsonify({'error': f"handle is already {entry['status']}", 'media_id': entry['media_id']}), 409
+    return jsonify(result)
+
+@app.route('/ig/hashtag-engage', methods=['POST'])
+@require_api_key
+@idempotent
+def ig_hashtag_engage():
+    """
+    Comment on top/recent media of a hashtag, skipping media this Instagram
+    account already commented on.
+    """
+    poster, err_resp, code = build_poster_from_headers()
+    if err_resp: return err_resp, code
+
+    payload = request.get_json() or {}
+    hashtag = payload.get('hashtag')
+    message = payload.get('message') or DEFAULT_COMMENT
+    edges = payload.get('edges') or list(HASHTAG_EDGES)
+
+    if not hashtag:
+        return jsonify({'error': 'hashtag required'}), 400
+    if not isinstance(edges, list) or not set(edges) <= set(HASHTAG_EDGES):
+        return jsonify({'error': f"edges must be a subset of {', '.join(HASHTAG_EDGES)}"}), 400
+    try:
+        limit = int(payload.get('limit', 5))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'limit must be an integer'}), 400
+    if not 1 <= limit <= 50:
+        return jsonify({'error': 'limit must be between 1 and 50'}), 400
+
+    try:
+        result = poster.post_comments_about_hashtag(hashtag, message, limit=limit, edges=edges)
+        return jsonify(result)
+    except Exception as e:
+        logging.exception("hashtag engage failed")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/bulk/publish', methods=['POST'])
+@require_api_key
+def bulk_publish():
+    """
+    Publish many jobs across many pages, streaming one NDJSON result line per
+    job as it completes. Page credentials may be given per job or as headers.
+    """
+    payload = request.get_json() or {}
+    jobs = payload.get('jobs')
+    if not jobs or not isinstance(jobs, list):
+        return jsonify({'error': 'jobs list is required'}), 400
+
+    defaults = {
+        'app_id': request.headers.get("X-APP-ID"),
+        'app_secret': request.headers.get("X-APP-SECRET"),
+        'page_id': request.headers.get("X-PAGE-ID"),
+        'access_token': request.headers.get("X-ACCESS-TOKEN"),
+    }
+    return Response(run_bulk(jobs, defaults), mimetype='application/x-ndjson')
+
 if __name__ == '__main__':
+    start_background()
     app.run(host='0.0.0.0', port=int(os.getenv('PORT', 4000)))
\ No newline at end of file
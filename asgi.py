@@ -0,0 +1,325 @@
+# asgi.py
+"""
+ASGI entry point: `uvicorn asgi:app`.
+
+The publish routes are served natively by AsyncPostToFacebookPage so a single
+process can keep hundreds of publishes in flight. Every other route of the
+Flask app (stats, jobs, bulk publish, ...) is mounted unchanged behind it.
+"""
+import json
+import logging
+import math
+from contextlib import asynccontextmanager
+from functools import wraps
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+
+import app as flask_module
+import breaker
+import transport
+from breaker import CircuitOpenError
+from callbacks import check_callback_url
+from idempotency import idempotency_store, fingerprint, scope
+from jobs import job_queue
+from meta_async import AsyncPostToFacebookPage, close_client
+from registry import poster_registry
+from scheduler import publish_scheduler, parse_publish_at
+
+
+def build_poster_from_headers(request):
+    """Get the registry's AsyncPostToFacebookPage instance for the request headers"""
+    app_id = request.headers.get("X-APP-ID")
+    app_secret = request.headers.get("X-APP-SECRET")
+    page_id = request.headers.get("X-PAGE-ID")
+    token = request.headers.get("X-ACCESS-TOKEN")
+
+    if not all([app_id, app_secret, page_id, token]):
+        return None, JSONResponse({
+            "error": "Missing one of required headers: X-APP-ID, X-APP-SECRET, X-PAGE-ID, X-ACCESS-TOKEN"
+        }, 400)
+
+    return poster_registry.get(AsyncPostToFacebookPage, app_id, app_secret, page_id, token), None
+
+
+def require_api_key(f):
+    @wraps(f)
+    async def decorated(request):
+        key = request.headers.get("X-API-KEY")
+        if not key or key != flask_module.API_KEY:
+            return JSONResponse({"error": "Unauthorized"}, 401)
+        return await f(request)
+    return decorated
+
+
+def unavailable(error):
+    return JSONResponse({
+        'error': str(error),
+        'endpoint_class': error.endpoint_class,
+        'retry_after': round(error.retry_after, 1),
+    }, 503, headers={'Retry-After': str(math.ceil(error.retry_after))})
+
+
+def circuit_response(response):
+    """Replace a failed response with a 503 when an open breaker caused it"""
+    if response.status_code == 503 or response.media_type != 'application/json':
+        return response
+    error = breaker.rejection_for(response.status_code, json.loads(response.body or b'null'))
+    return response if error is None else unavailable(error)
+
+
+def fail_fast(f):
+    """Async counterpart of the Flask app's circuit breaker hooks"""
+    @wraps(f)
+    async def decorated(request):
+        _, token = breaker.start_watch()
+        try:
+            return circuit_response(await f(request))
+        except CircuitOpenError as e:
+            return unavailable(e)
+        finally:
+            breaker.end_watch(token)
+    return decorated
+
+
+def timed(f):
+    """
+    Async counterpart of the Flask app's timing hooks: with X-DEBUG-TIMINGS
+    (or ?timings=1) the JSON answer gets the Graph calls the request made.
+    """
+    @wraps(f)
+    async def decorated(request):
+        if not (request.headers.get("X-DEBUG-TIMINGS") or request.query_params.get('timings')):
+            return await f(request)
+
+        timings, token = transport.start_trace()
+        try:
+            response = await f(request)
+        finally:
+            transport.end_trace(token)
+        if response.media_type != 'application/json':
+            return response
+        data = json.loads(response.body or b'null')
+        if not isinstance(data, dict):
+            return response
+        data['timings'] = {
+            'graph_calls': timings,
+            'graph_ms': round(sum(step['duration_ms'] for step in timings), 1),
+        }
+        return JSONResponse(data, response.status_code, {
+            key: value for key, value in response.headers.items() if key not in ('content-length', 'content-type')
+        })
+    return decorated
+
+
+def idempotent(f):
+    """Async counterpart of app.idempotent, sharing the same store"""
+    @wraps(f)
+    async def decorated(request):
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return await f(request)
+
+        scoped_key = scope(request.headers.get('X-APP-ID'), request.headers.get('X-PAGE-ID'), request.url.path, key)
+        state, stored = idempotency_store.begin(scoped_key, fingerprint(await request.body()))
+        if state == 'mismatch':
+            return JSONResponse({'error': 'Idempotency-Key was already used with a different request'}, 422)
+        if state == 'in_progress':
+            return JSONResponse({'error': 'A request with this Idempotency-Key is still in progress'}, 409, {'Retry-After': '5'})
+        if stored is not None:
+            body, status = stored
+            return Response(body, status, media_type='application/json', headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = circuit_response(await f(request))
+        except Exception:
+            idempotency_store.abandon(scoped_key)
+            raise
+        if response.status_code >= 500:
+            idempotency_store.abandon(scoped_key)
+        else:
+            idempotency_store.complete(scoped_key, response.body.decode(), response.status_code)
+        return response
+    return decorated
+
+
+async def read_json(request):
+    try:
+        payload = await request.json()
+    except ValueError:
+        return {}
+    return payload if isinstance(payload, dict) else {}
+
+
+def deferred(payload):
+    return bool(payload.get('async') or payload.get('callback_url')) or payload.get('publish_at') is not None
+
+
+def enqueue_publish(poster, method, kwargs, payload):
+    publish_at = payload.get('publish_at')
+    callback_url = payload.get('callback_url')
+    try:
+        if callback_url is not None:
+            check_callback_url(callback_url)
+        if publish_at is not None:
+            publish_at = parse_publish_at(publish_at)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, 400)
+
+    if publish_at is None:
+        job_id = job_queue.enqueue(poster, method, kwargs, callback_url=callback_url)
+        return JSONResponse({'job_id': job_id, 'status': 'queued', 'status_url': f'/jobs/{job_id}'}, 202)
+
+    job_id, run_at = publish_scheduler.schedule(poster, method, kwargs, publish_at, callback_url)
+    return JSONResponse({
+        'job_id': job_id,
+        'status': 'scheduled',
+        'publish_at': publish_at,
+        'run_at': run_at,
+        'status_url': f'/jobs/{job_id}',
+    }, 202)
+
+
+@timed
+@fail_fast
+@require_api_key
+@idempotent
+async def fb_post_images(request):
+    poster, err_resp = build_poster_from_headers(request)
+    if err_resp: return err_resp
+
+    payload = await read_json(request)
+    posts = payload.get('posts')
+    if not posts or not isinstance(posts, list):
+        return JSONResponse({'error': 'posts list is required'}, 400)
+
+    if deferred(payload):
+        return enqueue_publish(poster, 'fb_post_images', {'posts': posts}, payload)
+
+    try:
+        results = await poster.fb_post_images(posts)
+        return JSONResponse({'results': results})
+    except Exception as e:
+        logging.exception("fb_post_images failed")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+@timed
+@fail_fast
+@require_api_key
+@idempotent
+async def fb_upload_reel(request):
+    poster, err_resp = build_poster_from_headers(request)
+    if err_resp: return err_resp
+
+    payload = await read_json(request)
+    video_url = payload.get('video_url')
+    caption = payload.get('caption', '')
+    if not video_url:
+        return JSONResponse({'error': 'video_url required'}, 400)
+
+    if deferred(payload):
+        return enqueue_publish(poster, 'fb_upload_reel', {'video_url': video_url, 'caption': caption}, payload)
+
+    try:
+        result = await poster.fb_upload_reel(video_url, caption)
+        return JSONResponse(result, 200 if result['success'] else 500)
+    except Exception as e:
+        logging.exception("upload_reel failed")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+@timed
+@fail_fast
+@require_api_key
+@idempotent
+async def ig_post_carousel(request):
+    poster, err_resp = build_poster_from_headers(request)
+    if err_resp: return err_resp
+
+    payload = await read_json(request)
+    posts = payload.get('posts')
+    if not posts:
+        return JSONResponse({'error': 'posts list required'}, 400)
+
+    if deferred(payload):
+        return enqueue_publish(poster, 'ig_post_carousel', {'posts': posts}, payload)
+
+    try:
+        return JSONResponse(await poster.ig_post_carousel(posts))
+    except Exception as e:
+        logging.exception("carousel failed")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+@timed
+@fail_fast
+@require_api_key
+@idempotent
+async def ig_post_image(request):
+    poster, err_resp = build_poster_from_headers(request)
+    if err_resp: return err_resp
+
+    payload = await read_json(request)
+    image_url = payload.get('image_url')
+    caption = payload.get('caption', '')
+    if not image_url:
+        return JSONResponse({'error': 'Image url required'}, 400)
+
+    if deferred(payload):
+        return enqueue_publish(poster, 'ig_post_image', {'image_url': image_url, 'caption': caption}, payload)
+
+    try:
+        return JSONResponse(await poster.ig_post_image(image_url, caption))
+    except Exception as e:
+        logging.exception("ig_post_image failed")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+@timed
+@fail_fast
+@require_api_key
+@idempotent
+async def ig_upload_reel(request):
+    poster, err_resp = build_poster_from_headers(request)
+    if err_resp: return err_resp
+
+    payload = await read_json(request)
+    video_url = payload.get('video_url')
+    caption = payload.get('caption', '')
+    if not video_url:
+        return JSONResponse({'error': 'video_url required'}, 400)
+
+    # A callback reports the published reel, not the container
+    wait = bool(payload.get('wait', True) or payload.get('callback_url'))
+
+    if deferred(payload):
+        return enqueue_publish(poster, 'ig_upload_reel', {'video_url': video_url, 'video_caption': caption, 'wait': wait}, payload)
+
+    try:
+        return JSONResponse(await poster.ig_upload_reel(video_url, caption, wait=wait))
+    except Exception as e:
+        logging.exception("ig_post failed")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    flask_module.start_background()
+    yield
+    await close_client()
+
+
+app = Starlette(
+    routes=[
+        Route('/fb/post-images', fb_post_images, methods=['POST']),
+        Route('/fb/upload-reel', fb_upload_reel, methods=['POST']),
+        Route('/ig/post-carousel', ig_post_carousel, methods=['POST']),
+        Route('/ig/post-image', ig_post_image, methods=['POST']),
+        Route('/ig/upload-reel', ig_upload_reel, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_module.app)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,113 @@
+import json
+import re
+from urllib.parse import quote
+
+import transport
+from transport import GRAPH_URL
+
+# Graph rejects batches with more than 50 sub-requests
+MAX_BATCH_SIZE = 50
+
+_REFERENCE = re.compile(r"\{result=([^:}]+):")
+
+
+class BatchError(Exception):
+    """Raised when the batch request as a whole fails."""
+
+
+class GraphBatch():
+    """
+    Collects Graph sub-requests and sends them as `batch=` POSTs.
+
+    Sub-requests may be named and referenced by later ones through `depends_on`
+    and JSONPath expressions such as `{result=container:$.id}`. Such references
+    only work within one HTTP request, so a batch larger than MAX_BATCH_SIZE
+    is split into chunks and a reference that would cross a chunk raises
+    ValueError.
+    """
+
+    def __init__(self, access_token, base_url=GRAPH_URL + "/", budget=None):
+        self.access_token = access_token
+        self.base_url = base_url
+        self.budget = budget
+        self._requests = []
+
+    def add(self, method, relative_url, body=None, name=None, depends_on=None):
+        """
+        Queue a sub-request and return its index in the results of execute().
+        """
+        request = {'method': method, 'relative_url': relative_url}
+        if body:
+            request['body'] = self._encode_body(body)
+        if name:
+            request['name'] = name
+            # Graph drops the response of referenced requests unless told otherwise
+            request['omit_response_on_success'] = False
+        if depends_on:
+            request['depends_on'] = depends_on
+        self._requests.append(request)
+        return len(self._requests) - 1
+
+    def __len__(self):
+        return len(self._requests)
+
+    def execute(self):
+        """
+        Send the queued sub-requests and return one result per add() call, in
+        order. Each result is a dict with 'code' and the parsed 'body', or None
+        when Graph skipped the sub-request (e.g. its dependency failed).
+        """
+        results = []
+        for start in range(0, len(self._requests), MAX_BATCH_SIZE):
+            chunk = self._requests[start:start + MAX_BATCH_SIZE]
+            self._check_references(chunk)
+            results.extend(self._send(chunk))
+        self._requests = []
+        return results
+
+    def _send(self, chunk):
+        response = transport.post(self.base_url, data={
+            'access_token': self.access_token,
+            'batch': json.dumps(chunk),
+            'include_headers': 'false',
+        }, budget=self.budget)
+        try:
+            data = response.json()
+        except ValueError:
+            raise BatchError(response.text)
+        if response.status_code != 200 or not isinstance(data, list):
+            raise BatchError(data)
+
+        results = []
+        for item in data:
+            if item is None:
+                results.append(None)
+                continue
+            try:
+                body = json.loads(item.get('body') or 'null')
+            except ValueError:
+                body = item.get('body')
+            results.append({'code': item.get('code'), 'body': body})
+        return results
+
+    @staticmethod
+    def _encode_body(body):
+        # JSONPath references must reach Graph unescaped
+        return '&'.join(
+            f"{quote(str(key), safe='[]')}="
+            f"{value if _REFERENCE.search(str(value)) else quote(str(value), safe='')}"
+            for key, value in body.items()
+        )
+
+    @staticmethod
+    def _check_references(chunk):
+        names = set()
+        for request in chunk:
+            references = set(_REFERENCE.findall(request.get('body', '') + request['relative_url']))
+            if request.get('depends_on'):
+                references.add(request['depends_on'])
+            missing = references - names
+            if missing:
+                raise ValueError(f"Batch references {sorted(missing)} outside of its chunk")
+            if 'name' in request:
+                names.add(request['name'])
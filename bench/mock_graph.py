@@ -0,0 +1,392 @@
+"""
+Local Graph API simulator for load tests.
+
+Implements the endpoints PostToFacebookPage uses (oauth exchange, page
+token, /photos, /feed, /media, /media_publish, video_reels, rupload, status
+polling, hashtag search and edges, comments and batch requests) plus
+/__media/ sample files with Range support for pre-flight probes and reel
+relays. State is in memory and IDs are numeric like Graph's.
+
+    python bench/mock_graph.py --port 8900 --latency-ms 80 --error-rate 0.01
+
+and run the service with META_GRAPH_URL=http://127.0.0.1:8900.
+
+With --webhook-url (and --webhook-secret, the app secret deliveries are
+signed with) a signed Instagram media webhook is POSTed when a reel
+container finishes processing. /__callbacks is a sink for the service's
+callback_url deliveries: POST stores the events (failing a
+--callback-error-rate share of batches with 500), GET lists them,
+optionally filtered with ?job_id=.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import itertools
+import json
+import random
+import struct
+import threading
+import time
+from collections import Counter, deque
+from urllib.parse import parse_qsl, urlsplit
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+CONFIG = {
+    'latency_ms': 50.0,
+    'jitter_ms': 20.0,
+    # Extra latency per MiB of request body, for rupload chunks
+    'upload_ms_per_mb': 10.0,
+    'error_rate': 0.0,
+    'throttle_rate': 0.0,
+    # Calls per app per rolling minute before answering with code 4
+    'app_call_limit': 0,
+    'processing_ms': 2000.0,
+    'video_bytes': 2 * 1024 * 1024,
+    'webhook_url': '',
+    'webhook_secret': '',
+    'callback_error_rate': 0.0,
+}
+
+_ids = itertools.count(17841400000000000)
+_lock = threading.Lock()
+_containers = {}
+_uploads = {}
+_app_calls = {}
+_stats = Counter()
+_callbacks = []
+
+
+def next_id():
+    return str(next(_ids))
+
+
+def graph_error(code, message, status=400, subcode=None):
+    error = {'message': message, 'type': 'OAuthException', 'code': code, 'fbtrace_id': 'mock'}
+    if subcode:
+        error['error_subcode'] = subcode
+    return status, {'error': error}
+
+
+def handle(method, path, params, body=b'', headers=None):
+    """
+    Route one Graph request. Returns (status, json_body).
+    """
+    segments = [segment for segment in path.split('/') if segment]
+    if segments and segments[0].startswith('v') and segments[0][1:].replace('.', '').isdigit():
+        segments = segments[1:]
+
+    if segments[:1] == ['rupload']:
+        return rupload(segments[-1], body, headers or {})
+    if not segments:
+        if method == 'POST' and 'batch' in params:
+            return 200, run_batch(params)
+        if 'ids' in params:
+            return 200, {object_id: object_status(object_id) for object_id in params['ids'].split(',')}
+        return graph_error(100, "Unsupported request")
+    if segments == ['oauth', 'access_token']:
+        return 200, {'access_token': f"LL{next_id()}", 'token_type': 'bearer', 'expires_in': 5184000}
+    if segments == ['ig_hashtag_search']:
+        return 200, {'data': [{'id': str(int(hashlib.md5(params.get('q', '').encode()).hexdigest()[:14], 16))}]}
+
+    object_id = segments[0]
+    edge = segments[1] if len(segments) > 1 else None
+    if edge is None and method == 'GET':
+        fields = params.get('fields', '')
+        # Only containers and upload sessions are asked for a status; unknown ones read as ERROR
+        if 'status' in fields:
+            return 200, object_status(object_id)
+        data = {'id': object_id}
+        if 'access_token' in fields:
+            data['access_token'] = f"PAGE{object_id}"
+        if 'instagram_business_account' in fields:
+            data['instagram_business_account'] = {'id': f"1784{object_id[-12:]}"}
+        return 200, data
+
+    if edge == 'photos' and method == 'POST':
+        return 200, {'id': next_id()}
+    if edge == 'feed' and method == 'POST':
+        return 200, {'id': f"{object_id}_{next_id()}"}
+    if edge == 'comments' and method == 'POST':
+        return 200, {'id': next_id()}
+    if edge == 'media' and method == 'POST':
+        creation_id = next_id()
+        video = params.get('media_type') == 'REELS'
+        with _lock:
+            _containers[creation_id] = time.time() + (CONFIG['processing_ms'] / 1000 if video else 0)
+        if video and CONFIG['webhook_url']:
+            asyncio.get_running_loop().call_later(
+                CONFIG['processing_ms'] / 1000, asyncio.ensure_future, send_webhook(object_id, creation_id),
+            )
+        return 200, {'id': creation_id}
+    if edge == 'media_publish' and method == 'POST':
+        ready_at = _containers.get(params.get('creation_id'))
+        if ready_at is None:
+            return graph_error(100, "Invalid creation_id")
+        if ready_at > time.time():
+            return graph_error(9007, "Media ID is not available", subcode=2207027)
+        return 200, {'id': next_id()}
+    if edge == 'video_reels' and method == 'POST':
+        if params.get('upload_phase') == 'start':
+            video_id = next_id()
+            with _lock:
+                _uploads[video_id] = 0
+            return 200, {'video_id': video_id, 'upload_url': f"{CONFIG['base_url']}/rupload/v22.0/{video_id}"}
+        return 200, {'success': True}
+    if edge in ('recent_media', 'top_media'):
+        return 200, hashtag_page(object_id, edge, params)
+    return graph_error(100, f"Unsupported {method} request on {path}")
+
+
+def object_status(object_id):
+    if object_id in _uploads:
+        return {'id': object_id, 'status': {'uploading_phase': {'bytes_transferred': _uploads[object_id]}}}
+    ready_at = _containers.get(object_id)
+    if ready_at is None:
+        return {'id': object_id, 'status_code': 'ERROR', 'status': 'Unknown container'}
+    return {'id': object_id, 'status_code': 'FINISHED' if ready_at <= time.time() else 'IN_PROGRESS'}
+
+
+async def send_webhook(account_id, creation_id):
+    """
+    Tell the service a reel container finished, signed like Meta's deliveries.
+    """
+    body = json.dumps({'object': 'instagram', 'entry': [{
+        'id': account_id, 'time': int(time.time()),
+        'changes': [{'field': 'media', 'value': {'id': creation_id, 'status_code': 'FINISHED'}}],
+    }]}).encode()
+    digest = hmac.new(CONFIG['webhook_secret'].encode(), body, hashlib.sha256).hexdigest()
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            await client.post(CONFIG['webhook_url'], content=body, headers={
+                'Content-Type': 'application/json', 'X-Hub-Signature-256': f"sha256={digest}",
+            })
+        _stats['webhooks_sent'] += 1
+    except httpx.HTTPError:
+        _stats['webhooks_failed'] += 1
+
+
+def rupload(video_id, body, headers):
+    if video_id not in _uploads:
+        return graph_error(100, "Unknown upload session")
+    offset = int(headers.get('offset', 0))
+    with _lock:
+        if offset != _uploads[video_id]:
+            return 400, {'debug_info': {'message': f"Expected offset {_uploads[video_id]}"}}
+        _uploads[video_id] = offset + len(body)
+    return 200, {'success': True}
+
+
+def hashtag_page(hashtag_id, edge, params):
+    page = int(params.get('after') or 0)
+    limit = min(int(params.get('limit', 25)), 50)
+    data = [
+        {'id': f"{hashtag_id[:6]}{page:04d}{i:03d}{edge[0]}", 'like_count': random.randint(0, 500),
+         'permalink': f"https://www.instagram.com/p/mock{page}{i}/"}
+        for i in range(limit)
+    ]
+    paging = {'cursors': {'before': str(page), 'after': str(page + 1)}}
+    if page < 4:
+        paging['next'] = 'mock'
+    return {'data': data, 'paging': paging}
+
+
+def run_batch(params):
+    requests = json.loads(params['batch'])
+    named = {}
+    responses = []
+    for item in requests:
+        dependency = named.get(item.get('depends_on'), {})
+        if 'error' in dependency:
+            responses.append(None)
+            continue
+        relative_url = _resolve(item.get('relative_url', ''), named)
+        parts = urlsplit('/' + relative_url.lstrip('/'))
+        sub_params = dict(parse_qsl(parts.query))
+        sub_params.update(dict(parse_qsl(_resolve(item.get('body', ''), named))))
+        status, data = handle(item.get('method', 'GET'), parts.path, sub_params)
+        if item.get('name'):
+            named[item['name']] = data
+        responses.append({'code': status, 'headers': [], 'body': json.dumps(data)})
+    return responses
+
+
+def _resolve(text, named):
+    # Only the {result=name:$.field} form the service sends
+    while '{result=' in text:
+        start = text.index('{result=')
+        end = text.index('}', start)
+        name, path = text[start + 8:end].split(':', 1)
+        value = (named.get(name) or {}).get(path.split('.')[-1], '')
+        text = text[:start] + str(value) + text[end + 1:]
+    return text
+
+
+def usage_headers(app_id):
+    """
+    X-App-Usage from a rolling one-minute call count. Returns (headers, throttled).
+    """
+    limit = CONFIG['app_call_limit']
+    if not limit:
+        return {'X-App-Usage': json.dumps({'call_count': 1, 'total_time': 1, 'total_cputime': 1})}, False
+    now = time.time()
+    with _lock:
+        calls = _app_calls.setdefault(app_id, deque())
+        calls.append(now)
+        while calls and calls[0] < now - 60:
+            calls.popleft()
+        usage = min(int(len(calls) * 100 / limit), 100)
+    return {'X-App-Usage': json.dumps({'call_count': usage, 'total_time': usage // 2, 'total_cputime': usage // 2})}, usage >= 100
+
+
+async def graph(request):
+    body = await request.body()
+    params = dict(request.query_params)
+    content_type = request.headers.get('content-type', '')
+    if content_type.startswith('application/x-www-form-urlencoded'):
+        params.update(dict(parse_qsl(body.decode())))
+    elif content_type.startswith('application/json') and body:
+        params.update(json.loads(body))
+
+    delay = CONFIG['latency_ms'] + random.uniform(-CONFIG['jitter_ms'], CONFIG['jitter_ms'])
+    delay += CONFIG['upload_ms_per_mb'] * len(body) / (1024 * 1024)
+    await asyncio.sleep(max(delay, 0) / 1000)
+
+    token = params.get('access_token') or request.headers.get('authorization', '').replace('OAuth ', '')
+    headers, throttled = usage_headers(params.get('client_id') or token[:12])
+    path = request.url.path
+    _stats[f"{request.method} {path.split('/')[-1] if path.count('/') > 1 else path}"] += 1
+
+    roll = random.random()
+    if throttled or roll < CONFIG['throttle_rate']:
+        _stats['throttled'] += 1
+        status, data = graph_error(4, "Application request limit reached")
+        headers['Retry-After'] = '1'
+    elif roll < CONFIG['throttle_rate'] + CONFIG['error_rate']:
+        _stats['errors'] += 1
+        status, data = graph_error(2, "An unexpected error has occurred. Please retry your request later.", 500)
+    else:
+        status, data = handle(request.method, path, params, body, request.headers)
+    return JSONResponse(data, status, headers=headers)
+
+
+async def media(request):
+    """
+    Sample files for pre-flight probes and reel relays, with Range support.
+    """
+    data = SAMPLES[request.path_params['name']]
+    etag = f'"{request.path_params["name"]}-{len(data)}"'
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers={'ETag': etag})
+    byte_range = request.headers.get('range')
+    if not byte_range:
+        return Response(data, headers={'ETag': etag, 'Accept-Ranges': 'bytes'})
+    start, _, end = byte_range.replace('bytes=', '').partition('-')
+    start = int(start)
+    if start >= len(data):
+        return Response(status_code=416, headers={'Content-Range': f"bytes */{len(data)}"})
+    end = min(int(end) if end else len(data) - 1, len(data) - 1)
+    return Response(data[start:end + 1], 206, headers={
+        'ETag': etag, 'Content-Range': f"bytes {start}-{end}/{len(data)}",
+    })
+
+
+async def stats(request):
+    return JSONResponse(dict(_stats))
+
+
+async def callbacks(request):
+    if request.method == 'GET':
+        job_id = request.query_params.get('job_id')
+        return JSONResponse({'events': [event for event in _callbacks if not job_id or event.get('job_id') == job_id]})
+    if random.random() < CONFIG['callback_error_rate']:
+        _stats['callback_errors'] += 1
+        return JSONResponse({'error': 'injected failure'}, 500)
+    events = (await request.json()).get('events', [])
+    _stats['callback_batches'] += 1
+    _stats['callback_events'] += len(events)
+    _callbacks.extend(events)
+    return JSONResponse({'received': len(events)})
+
+
+def _box(kind, body):
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def sample_jpeg(width, height):
+    return (b'\xff\xd8' + b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+            + b'\xff\xc0' + struct.pack('>HBHHB', 17, 8, height, width, 3) + b'\x01\x22\x00\x02\x11\x01\x03\x11\x01'
+            + b'\x00' * 2048 + b'\xff\xd9')
+
+
+def sample_mp4(width, height, seconds, size, faststart=True):
+    """
+    An H.264/AAC MP4 skeleton: real ftyp/moov metadata and `size` bytes of
+    padding as mdat, with moov in front of mdat unless faststart is False.
+    """
+    timescale = 1000
+    duration = int(seconds * timescale)
+    matrix = struct.pack('>9i', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    mvhd = _box(b'mvhd', struct.pack('>IIIII', 0, 0, 0, timescale, duration) + b'\x00' * 80)
+    tkhd = _box(b'tkhd', struct.pack('>IIIIII', 3, 0, 0, 1, 0, duration) + b'\x00' * 16 + matrix
+                + struct.pack('>II', width << 16, height << 16))
+
+    def trak(handler, codec, samples, chunk_offset, header=b''):
+        mdhd = _box(b'mdhd', struct.pack('>IIIII', 0, 0, 0, timescale, duration) + b'\x00' * 4)
+        hdlr = _box(b'hdlr', b'\x00' * 8 + handler + b'\x00' * 13)
+        stsd = _box(b'stsd', struct.pack('>II', 0, 1) + struct.pack('>I4s', 16, codec) + b'\x00' * 8)
+        stsz = _box(b'stsz', struct.pack('>III', 0, 0, samples))
+        stco = _box(b'stco', struct.pack('>III', 0, 1, chunk_offset))
+        return _box(b'trak', header + _box(b'mdia', mdhd + hdlr + _box(b'minf', _box(b'stbl', stsd + stsz + stco))))
+
+    def moov(chunk_offset):
+        return _box(b'moov', mvhd + trak(b'vide', b'avc1', int(30 * seconds), chunk_offset, tkhd)
+                    + trak(b'soun', b'mp4a', int(43 * seconds), chunk_offset))
+
+    ftyp = _box(b'ftyp', b'isom\x00\x00\x02\x00isomiso2avc1mp41')
+    mdat_size = max(size - len(ftyp) - len(moov(0)) - 8, 0)
+    mdat = struct.pack('>I4s', 8 + mdat_size, b'mdat') + b'\x00' * mdat_size
+    if not faststart:
+        return ftyp + mdat + moov(len(ftyp) + 8)
+    return ftyp + moov(len(ftyp) + len(moov(0)) + 8) + mdat
+
+
+SAMPLES = {}
+
+
+def build_app(base_url):
+    CONFIG['base_url'] = base_url.rstrip('/')
+    SAMPLES.update({
+        'square.jpg': sample_jpeg(1080, 1080),
+        'portrait.jpg': sample_jpeg(1080, 1350),
+        'reel.mp4': sample_mp4(1080, 1920, 15, CONFIG['video_bytes']),
+        'reel-moov-last.mp4': sample_mp4(1080, 1920, 15, CONFIG['video_bytes'], faststart=False),
+    })
+    return Starlette(routes=[
+        Route('/__stats', stats),
+        Route('/__callbacks', callbacks, methods=['GET', 'POST']),
+        Route('/__media/{name}', media),
+        Route('/{path:path}', graph, methods=['GET', 'POST']),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    for key, value in CONFIG.items():
+        parser.add_argument('--' + key.replace('_', '-'), type=type(value), default=value)
+    args = parser.parse_args()
+    for key in CONFIG:
+        CONFIG[key] = getattr(args, key)
+    app = build_app(f"http://{args.host}:{args.port}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning', access_log=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""
+Load-test harness: starts the Graph simulator and the service against it,
+drives every app.py route at a fixed concurrency and reports latency
+percentiles, throughput and the service's memory.
+
+    python bench/run.py --requests 200 --concurrency 20 --pages 50
+    python bench/run.py --routes ig_post_image,bulk_publish --server wsgi -- --latency-ms 120 --error-rate 0.02
+
+Arguments after `--` are passed to bench/mock_graph.py.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_KEY = "bench"
+APP_ID = "100000000000001"
+WEBHOOK_SECRET = "bench-secret"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def page_headers(n, pages):
+    return {
+        'X-API-KEY': API_KEY,
+        'X-APP-ID': APP_ID,
+        'X-APP-SECRET': 'bench-secret',
+        'X-PAGE-ID': str(200000000000000 + n % pages),
+        'X-ACCESS-TOKEN': f"bench-user-token-{n % pages}",
+    }
+
+
+def scenarios(graph_url):
+    """
+    route name -> function(n) returning (method, path, json body or None).
+    """
+    media_url = f"{graph_url}/__media"
+    image = f"{media_url}/portrait.jpg"
+    square = f"{media_url}/square.jpg"
+    reel = f"{media_url}/reel.mp4"
+    posts = lambda n: [{'image_url': url, 'caption': f"bench {n}"} for url in (image, square, image)]
+    return {
+        'health': lambda n: ('GET', '/health', None),
+        'stats': lambda n: ('GET', '/stats', None),
+        'metrics': lambda n: ('GET', '/metrics', None),
+        'admin_tenants': lambda n: ('GET', '/admin/tenants', None),
+        'fb_post_images': lambda n: ('POST', '/fb/post-images', {'posts': posts(n)}),
+        'fb_upload_reel': lambda n: ('POST', '/fb/upload-reel', {'video_url': reel, 'caption': f"bench {n}"}),
+        'ig_post_carousel': lambda n: ('POST', '/ig/post-carousel', {'posts': posts(n)}),
+        'ig_post_image': lambda n: ('POST', '/ig/post-image', {'image_url': image, 'caption': f"bench {n}"}),
+        'ig_upload_reel': lambda n: ('POST', '/ig/upload-reel', {'video_url': reel, 'caption': f"bench {n}"}),
+        'ig_hashtag_engage': lambda n: ('POST', '/ig/hashtag-engage', {'hashtag': f"bench{n}", 'limit': 5}),
+        'bulk_publish': lambda n: ('POST', '/bulk/publish', {'jobs': [
+            {'type': 'ig_post_image', 'image_url': image, 'caption': f"bench {n}.{i}"} for i in range(10)
+        ]}),
+        'async_job': lambda n: ('POST', '/ig/post-image', {'image_url': image, 'caption': f"bench {n}", 'async': True}),
+        'callback_job': lambda n: ('POST', '/ig/upload-reel', {
+            'video_url': reel, 'caption': f"bench {n}", 'callback_url': f"{graph_url}/__callbacks",
+        }),
+    }
+
+
+def succeeded(route, response):
+    if response.status_code >= 400:
+        return False
+    if route == 'bulk_publish':
+        return all(json.loads(line)['success'] for line in response.text.splitlines() if line)
+    if response.headers.get('content-type', '').startswith('application/json'):
+        body = response.json()
+        if isinstance(body, dict) and 'success' in body:
+            return bool(body['success'])
+    return True
+
+
+async def wait_for_job(client, response, timeout=120):
+    status_url = response.json()['status_url']
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = (await client.get(status_url, headers={'X-API-KEY': API_KEY})).json()
+        if job.get('status') in ('succeeded', 'failed'):
+            return job['status'] == 'succeeded'
+        await asyncio.sleep(0.05)
+    return False
+
+
+async def wait_for_callback(client, response, graph_url, timeout=120):
+    job_id = response.json()['job_id']
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        events = (await client.get(f"{graph_url}/__callbacks", params={'job_id': job_id})).json()['events']
+        if events:
+            return events[0]['type'] == 'publish.succeeded'
+        await asyncio.sleep(0.05)
+    return False
+
+
+async def run_route(client, route, build, requests, concurrency, pages, graph_url):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one(n):
+        nonlocal failures
+        method, path, body = build(n)
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body, headers=page_headers(n, pages))
+                ok = succeeded(route, response)
+                if ok and route == 'async_job':
+                    ok = await wait_for_job(client, response)
+                elif ok and route == 'callback_job':
+                    ok = await wait_for_callback(client, response, graph_url)
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'route': route,
+        'requests': requests,
+        'failures': failures,
+        'throughput_rps': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p90_ms': round(percentile(latencies, 90) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'max_ms': round(latencies[-1] * 1000, 1),
+    }
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    index = min(int(round(pct / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def memory(pid):
+    """
+    Current and peak RSS of a process in MiB, from /proc (Linux only).
+    """
+    usage = {}
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    usage['rss_mb' if line.startswith('VmRSS') else 'peak_rss_mb'] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return usage
+
+
+def wait_until_up(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"{process.args[0]} exited with {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise SystemExit(f"Timed out waiting for {url}")
+
+
+def start_processes(args, mock_args, workdir):
+    mock_port, service_port = free_port(), free_port()
+    graph_url = f"http://127.0.0.1:{mock_port}"
+    # The simulator signs a webhook to the service when a reel finishes processing
+    webhook_args = ['--webhook-url', f"http://127.0.0.1:{service_port}/webhooks", '--webhook-secret', WEBHOOK_SECRET]
+    mock = subprocess.Popen(
+        [sys.executable, os.path.join(REPO, 'bench', 'mock_graph.py'), '--port', str(mock_port), *webhook_args, *mock_args],
+    )
+    wait_until_up(f"{graph_url}/__stats", mock)
+
+    env = dict(os.environ, PYTHONPATH=REPO, FLASK_API_KEY=API_KEY, META_GRAPH_URL=graph_url,
+               META_REEL_POLL_MIN_INTERVAL='0.5', META_WEBHOOK_APP_SECRETS=WEBHOOK_SECRET,
+               META_WEBHOOK_VERIFY_TOKEN='bench', META_CALLBACK_HOSTS='127.0.0.1')
+    env.update(item.split('=', 1) for item in args.env)
+    if args.server == 'asgi':
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(service_port),
+                   '--log-level', 'warning', '--no-access-log']
+    else:
+        command = ['gunicorn', '--bind', f"127.0.0.1:{service_port}", '--worker-class', 'gthread',
+                   '--workers', '1', '--threads', str(args.concurrency * 2),
+                   '--config', os.path.join(REPO, 'gunicorn.conf.py'), 'app:app']
+    # The service's SQLite files land in the scratch directory
+    env.setdefault('META_DATA_DIR', workdir)
+    log = open(args.service_log or os.devnull, 'w')
+    service = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    wait_until_up(f"http://127.0.0.1:{service_port}/health", service)
+    return mock, service, graph_url, f"http://127.0.0.1:{service_port}"
+
+
+def serving_pid(service, server):
+    # gunicorn serves from a forked worker; report that process's memory
+    if server == 'wsgi':
+        try:
+            with open(f"/proc/{service.pid}/task/{service.pid}/children") as children:
+                return int(children.read().split()[0])
+        except (OSError, IndexError, ValueError):
+            pass
+    return service.pid
+
+
+def print_table(results):
+    columns = ['route', 'requests', 'failures', 'throughput_rps', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'rss_mb', 'peak_rss_mb']
+    widths = [max(len(column), *(len(str(row.get(column, ''))) for row in results)) for column in columns]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in results:
+        print('  '.join(str(row.get(column, '')).ljust(width) for column, width in zip(columns, widths)))
+
+
+async def main_async(args, mock_args):
+    with tempfile.TemporaryDirectory() as workdir:
+        mock, service, graph_url, service_url = start_processes(args, mock_args, workdir)
+        pid = serving_pid(service, args.server)
+        results = []
+        try:
+            routes = scenarios(graph_url)
+            selected = list(routes) if args.routes == 'all' else args.routes.split(',')
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=service_url, timeout=args.timeout, limits=limits) as client:
+                for route in selected:
+                    result = await run_route(
+                        client, route, routes[route], args.requests, args.concurrency, args.pages, graph_url,
+                    )
+                    result.update(memory(pid))
+                    results.append(result)
+                    if args.verbose:
+                        print_table([result])
+                graph_calls = httpx.get(f"{graph_url}/__stats").json()
+        finally:
+            service.terminate()
+            mock.terminate()
+            service.wait()
+            mock.wait()
+
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({'config': vars(args), 'mock_args': mock_args, 'results': results, 'graph_calls': graph_calls}, output, indent=2)
+
+
+def main():
+    argv = sys.argv[1:]
+    mock_args = argv[argv.index('--') + 1:] if '--' in argv else []
+    argv = argv[:argv.index('--')] if '--' in argv else argv
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=100, help="requests per route")
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--pages', type=int, default=20, help="distinct pages the requests are spread over")
+    parser.add_argument('--routes', default='all', help="comma separated scenario names, or 'all'")
+    parser.add_argument('--server', choices=('asgi', 'wsgi'), default='asgi',
+                        help="uvicorn asgi:app, or gunicorn app:app with gthread workers")
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help="extra environment for the service, e.g. META_GRAPH_BATCH=0")
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--service-log', help="write the service's output to this file instead of discarding it")
+    parser.add_argument('--verbose', action='store_true', help="print each route as it finishes")
+    asyncio.run(main_async(parser.parse_args(argv), mock_args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import contextvars
+import os
+import threading
+import time
+
+# Rejections of the current request, see start_watch()
+_rejections = contextvars.ContextVar("circuit_rejections", default=None)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a Graph call while its endpoint class is failing.
+    """
+
+    def __init__(self, endpoint_class, retry_after):
+        super().__init__(
+            f"Graph API {endpoint_class} calls are failing; not sending requests for another {retry_after:.0f}s"
+        )
+        self.endpoint_class = endpoint_class
+        self.retry_after = retry_after
+
+
+class CircuitBreaker():
+    """
+    Breaker for one class of Graph endpoints.
+
+    It opens after `failures` consecutive failed calls (network errors and 5xx
+    responses; throttling is left to the rate governor) and then rejects calls
+    for `cooldown` seconds. After that a single trial call is let through:
+    success closes the breaker, failure opens it for another cooldown.
+    """
+
+    def __init__(self, name, failures=5, cooldown=30.0):
+        self.name = name
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.opened = 0
+
+    def before(self):
+        """
+        Raise CircuitOpenError unless a call may be sent now.
+        """
+        with self._lock:
+            if self.state == 'closed':
+                return
+            now = time.monotonic()
+            if self.state == 'open' and now >= self._opened_at + self.cooldown:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._trial:
+                self._trial = True
+                return
+            self.rejected += 1
+            retry_after = max(self._opened_at + self.cooldown - now, 1.0)
+        error = CircuitOpenError(self.name, retry_after)
+        rejections = _rejections.get()
+        if rejections is not None:
+            rejections.append(error)
+        raise error
+
+    def record(self, ok):
+        with self._lock:
+            self._trial = False
+            if ok:
+                self._consecutive = 0
+                self.state = 'closed'
+                return
+            self._consecutive += 1
+            if self.state == 'half_open' or self._consecutive >= self.failures:
+                if self.state != 'open':
+                    self.opened += 1
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+    def release(self):
+        """
+        End a call that neither succeeded nor failed against the endpoint
+        (cancelled, or interrupted by an error of our own), so a half-open
+        breaker lets its next trial through.
+        """
+        with self._lock:
+            self._trial = False
+
+    def describe(self):
+        with self._lock:
+            state = {
+                'state': self.state,
+                'consecutive_failures': self._consecutive,
+                'rejected': self.rejected,
+                'opened': self.opened,
+            }
+            if self.state == 'open':
+                state['retry_after'] = round(max(self._opened_at + self.cooldown - time.monotonic(), 0), 1)
+        return state
+
+
+class CircuitBreakers():
+    """
+    One CircuitBreaker per endpoint class, created on first use.
+    """
+
+    def __init__(self, failures=5, cooldown=30.0, enabled=True):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.enabled = enabled
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint_class):
+        with self._lock:
+            breaker = self._breakers.get(endpoint_class)
+            if breaker is None:
+                breaker = self._breakers[endpoint_class] = CircuitBreaker(endpoint_class, self.failures, self.cooldown)
+            return breaker
+
+    def before(self, endpoint_class):
+        if self.enabled and endpoint_class:
+            self.get(endpoint_class).before()
+
+    def record(self, endpoint_class, ok):
+        if self.enabled and endpoint_class:
+            self.get(endpoint_class).record(ok)
+
+    def release(self, endpoint_class):
+        if self.enabled and endpoint_class:
+            self.get(endpoint_class).release()
+
+    def states(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.describe() for breaker in breakers}
+
+    def any_open(self):
+        return any(state['state'] != 'closed' for state in self.states().values())
+
+
+def start_watch():
+    """
+    Collect the CircuitOpenErrors raised in the current context (including
+    threads and tasks running a copy of it); returns (rejections, token).
+    """
+    rejections = []
+    return rejections, _rejections.set(rejections)
+
+
+def end_watch(token):
+    _rejections.reset(token)
+
+
+def rejection_for(status, body):
+    """
+    The CircuitOpenError behind a failed response of the current request, or
+    None when nothing was rejected or the response succeeded anyway.
+    """
+    rejections = _rejections.get()
+    if not rejections:
+        return None
+    failed = status >= 400
+    if isinstance(body, dict):
+        results = body.get('results')
+        failed = failed or body.get('success') is False or (isinstance(results, dict) and results.get('success') is False)
+    return rejections[-1] if failed else None
+
+
+circuit_breakers = CircuitBreakers(
+    failures=int(os.getenv("META_BREAKER_FAILURES", 5)),
+    cooldown=float(os.getenv("META_BREAKER_COOLDOWN", 30)),
+    enabled=os.getenv("META_BREAKER", "1") == "1",
+)
@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from meta import PostToFacebookPage
+from callbacks import callback_dispatcher, check_callback_url
+from registry import poster_registry
+from scheduler import publish_scheduler, parse_publish_at
+
+BULK_CONCURRENCY = int(os.getenv("META_BULK_CONCURRENCY", 16))
+BULK_PAGE_CONCURRENCY = int(os.getenv("META_BULK_PAGE_CONCURRENCY", 2))
+
+CREDENTIAL_FIELDS = ('app_id', 'app_secret', 'page_id', 'access_token')
+
+
+def publish_arguments(job):
+    """
+    Map a bulk job to its PostToFacebookPage method and keyword arguments.
+    Raises ValueError for unknown types or missing fields.
+    """
+    kind = job.get('type')
+    if kind in ('fb_post_images', 'ig_post_carousel'):
+        if not job.get('posts') or not isinstance(job['posts'], list):
+            raise ValueError('posts list is required')
+        return kind, {'posts': job['posts']}
+    if kind == 'ig_post_image':
+        if not job.get('image_url'):
+            raise ValueError('image_url is required')
+        return kind, {'image_url': job['image_url'], 'caption': job.get('caption', '')}
+    if kind == 'fb_upload_reel':
+        if not job.get('video_url'):
+            raise ValueError('video_url is required')
+        return kind, {'video_url': job['video_url'], 'caption': job.get('caption', '')}
+    if kind == 'ig_upload_reel':
+        if not job.get('video_url'):
+            raise ValueError('video_url is required')
+        return kind, {'video_url': job['video_url'], 'video_caption': job.get('caption', '')}
+    raise ValueError(f"Unsupported job type: {kind}")
+
+
+def run_bulk(jobs, defaults):
+    """
+    Run heterogeneous publish jobs across many pages and yield one NDJSON line
+    per job as soon as it completes.
+
+    Jobs are grouped by page credentials so every group shares one poster
+    (and therefore one token/IG account lookup). At most BULK_PAGE_CONCURRENCY
+    jobs run per page and BULK_CONCURRENCY overall. Jobs with a publish_at
+    are handed to the scheduler and answered with their job ID instead. A
+    job's callback_url, if any, also gets its outcome once it has run.
+
+    Every job is validated (and scheduled) before the first line goes out,
+    and the rest run on a background thread: a client that disconnects stops
+    getting lines, but all its jobs still run and send their callbacks.
+    """
+    lines, groups = [], OrderedDict()
+    for index, job in enumerate(jobs):
+        job = job if isinstance(job, dict) else {}
+        credentials = {field: job.get(field) or defaults.get(field) for field in CREDENTIAL_FIELDS}
+        line = {'index': index, 'id': job.get('id'), 'type': job.get('type'), 'page_id': credentials['page_id']}
+        if not all(credentials.values()):
+            lines.append(_line(line, error=f"Missing one of required fields: {', '.join(CREDENTIAL_FIELDS)}"))
+            continue
+        try:
+            method, kwargs = publish_arguments(job)
+            publish_at = None if job.get('publish_at') is None else parse_publish_at(job['publish_at'])
+            callback_url = None if job.get('callback_url') is None else check_callback_url(job['callback_url'])
+        except ValueError as e:
+            lines.append(_line(line, error=str(e)))
+            continue
+
+        key = tuple(credentials[field] for field in CREDENTIAL_FIELDS)
+        if publish_at is not None:
+            poster = poster_registry.get(PostToFacebookPage, *key)
+            job_id, run_at = publish_scheduler.schedule(poster, method, kwargs, publish_at, callback_url)
+            lines.append(_line(line, result={'success': True, 'job_id': job_id, 'status': 'scheduled', 'run_at': run_at}))
+            continue
+        groups.setdefault(key, deque()).append((line, method, kwargs, callback_url))
+
+    remaining = sum(len(pending) for pending in groups.values())
+    finished = queue.Queue()
+    if groups:
+        posters = {key: poster_registry.get(PostToFacebookPage, *key) for key in groups}
+        threading.Thread(target=_run_groups, args=(groups, posters, finished), name="bulk-publish", daemon=True).start()
+
+    yield from lines
+    for _ in range(remaining):
+        yield finished.get()
+
+
+def _run_groups(groups, posters, finished):
+    """
+    Run the grouped jobs within the concurrency limits and put each job's
+    NDJSON line on `finished` as it completes.
+    """
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=BULK_CONCURRENCY) as executor:
+        def submit_next(key):
+            line, method, kwargs, callback_url = groups[key].popleft()
+            future = executor.submit(_run_job, posters[key], method, kwargs, line, callback_url)
+            running[future] = (key, line)
+
+        for key, pending in groups.items():
+            for _ in range(min(BULK_PAGE_CONCURRENCY, len(pending))):
+                submit_next(key)
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, line = running.pop(future)
+                result, error, duration = future.result()
+                finished.put(_line(line, result=result, error=error, duration=duration))
+                if groups[key]:
+                    submit_next(key)
+
+
+def _run_job(poster, method, kwargs, line, callback_url):
+    started = time.monotonic()
+    try:
+        result, error = getattr(poster, method)(**kwargs), None
+    except Exception as e:
+        logging.exception("Bulk %s failed", method)
+        result, error = None, str(e)
+    if callback_url:
+        _notify(line, method, result, error, callback_url)
+    return result, error, time.monotonic() - started
+
+
+def _notify(line, method, result, error, callback_url):
+    """
+    Queue the 'publish.succeeded' or 'publish.failed' event of a bulk job
+    that ran right away.
+    """
+    status = 'succeeded' if result and result.get('success') and not error else 'failed'
+    event = {
+        'type': f"publish.{status}", 'method': method, 'status': status, 'finished_at': time.time(),
+        'page_id': line['page_id'], 'bulk_index': line['index'], 'bulk_id': line['id'],
+        'result': result, 'error': error,
+    }
+    try:
+        callback_dispatcher.send(callback_url, event)
+    except sqlite3.Error:
+        logging.exception("Failed to queue the callback of bulk job %s", line['index'])
+
+
+def _line(line, result=None, error=None, duration=None):
+    line = dict(line)
+    line['success'] = bool(result and result.get('success')) and not error
+    if result is not None:
+        line['result'] = result
+    if error:
+        line['error'] = error
+    if duration is not None:
+        line['duration_ms'] = round(duration * 1000, 1)
+    return json.dumps(line) + "\n"
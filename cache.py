@@ -0,0 +1,311 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from common import data_path
+
+
+class TokenCache():
+    """
+    Process-wide cache of page access tokens keyed by (app_id, page_id, user token hash).
+
+    Entries live for the `expires_in` returned by the long-lived token exchange
+    and are refreshed in the background shortly before they expire. Concurrent
+    callers for the same key share a single in-flight load. A token Graph
+    rejects before then (revoked, or expired early) is dropped with invalidate().
+    """
+
+    def __init__(self, default_ttl=None, max_ttl=None, refresh_margin=None):
+        self.default_ttl = default_ttl or int(os.getenv("META_TOKEN_TTL", 3600))
+        self.max_ttl = max_ttl or int(os.getenv("META_TOKEN_MAX_TTL", 86400))
+        self.refresh_margin = refresh_margin or int(os.getenv("META_TOKEN_REFRESH_MARGIN", 300))
+        self._entries = {}
+        self._inflight = {}
+        self._refreshing = set()
+        self._rejected = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(app_id, page_id, user_token):
+        token_hash = hashlib.sha256((user_token or "").encode()).hexdigest()
+        return (app_id, page_id, token_hash)
+
+    def get(self, key, user_token, loader):
+        """
+        Return the cached page access token for `key`, loading it with
+        `loader(user_token)` on a miss. The loader must return a
+        (long_lived_token, page_access_token, expires_in) tuple or None.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry["expires_at"] > now:
+                self.hits += 1
+                if entry["refresh_at"] <= now and key not in self._refreshing:
+                    self._refreshing.add(key)
+                    threading.Thread(
+                        target=self._refresh, args=(key, entry["long_lived_token"], loader), daemon=True
+                    ).start()
+                return entry["page_access_token"]
+
+            self.misses += 1
+            event = self._inflight.get(key)
+            leader = event is None
+            if leader:
+                event = threading.Event()
+                self._inflight[key] = event
+
+        if not leader:
+            # Another thread is already loading this key; share its result
+            event.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+                return entry["page_access_token"] if entry else None
+
+        try:
+            return self._load(key, user_token, loader)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def _load(self, key, user_token, loader):
+        try:
+            result = loader(user_token)
+        except Exception as e:
+            print("Error loading page access token:", e)
+            result = None
+
+        if not result:
+            with self._lock:
+                self.errors += 1
+            return None
+        return self.put(key, *result)
+
+    def put(self, key, long_lived_token, page_access_token, expires_in):
+        ttl = min(int(expires_in or self.default_ttl), self.max_ttl)
+        now = time.time()
+        with self._lock:
+            self._entries[key] = {
+                "long_lived_token": long_lived_token,
+                "page_access_token": page_access_token,
+                "expires_at": now + ttl,
+                "refresh_at": now + max(ttl - self.refresh_margin, ttl / 2),
+            }
+        return page_access_token
+
+    def peek(self, key):
+        """
+        Non-loading lookup for callers that load tokens themselves (e.g. the
+        asyncio poster). Returns (page_access_token, long_lived_token, needs_refresh),
+        or (None, None, False) on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry["expires_at"] > now:
+                self.hits += 1
+                return entry["page_access_token"], entry["long_lived_token"], entry["refresh_at"] <= now
+            self.misses += 1
+            return None, None, False
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def _refresh(self, key, long_lived_token, loader):
+        with self._lock:
+            self.refreshes += 1
+        try:
+            self._load(key, long_lived_token, loader)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def invalidate(self, key, page_access_token=None):
+        """
+        Drop the entry for `key`. With `page_access_token`, only when the entry
+        still holds that token, so a caller reporting an old token does not
+        throw away one that was loaded since. Returns True when the token was
+        dropped, now or by an earlier call, so callers still holding it know
+        to fetch the replacement.
+        """
+        with self._lock:
+            if page_access_token and self._rejected.get(key) == page_access_token:
+                return True
+            entry = self._entries.get(key)
+            if entry is None or (page_access_token and entry["page_access_token"] != page_access_token):
+                return False
+            del self._entries[key]
+            self._rejected[key] = entry["page_access_token"]
+            self.invalidations += 1
+            return True
+
+    def describe(self, key):
+        """
+        State of one entry for admin views, without counting as a lookup.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or entry["expires_at"] <= now:
+                return {"cached": False}
+            return {
+                "cached": True,
+                "expires_in": round(entry["expires_at"] - now),
+                "needs_refresh": entry["refresh_at"] <= now,
+                "refreshing": key in self._inflight,
+            }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "errors": self.errors,
+                "invalidations": self.invalidations,
+                "size": len(self._entries),
+            }
+
+
+class LRUCache():
+    """
+    Bounded, thread-safe LRU cache with a per-entry TTL.
+
+    When `db_path` is set, entries are also written through to a SQLite table
+    so that a restarted worker can warm up from disk instead of going back to
+    the Graph API. Values must be JSON-serialisable.
+    """
+
+    def __init__(self, namespace, max_size=1024, ttl=86400, db_path=None):
+        self.namespace = namespace
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT, key TEXT, value TEXT, expires_at REAL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                entry = self._db_get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    self._delete(key)
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict()
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (ttl or self.ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            self._evict()
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (self.namespace, key, json.dumps(value), expires_at),
+                )
+                self._db.commit()
+
+    def invalidate(self, key):
+        with self._lock:
+            self._delete(key)
+
+    def peek(self, key):
+        """
+        In-memory value of `key` without loading from disk, reordering or
+        counting as a lookup.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "persistent": self._db is not None,
+            }
+
+    def _db_get(self, key):
+        row = self._db.execute(
+            "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+            (self.namespace, key),
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def _delete(self, key):
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+            self._db.commit()
+
+    def _evict(self):
+        # Only the in-memory copy is bounded; the on-disk table keeps expiring rows
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+token_cache = TokenCache()
+
+ig_account_cache = LRUCache(
+    "ig_account",
+    max_size=int(os.getenv("META_IG_ACCOUNT_CACHE_SIZE", 4096)),
+    ttl=int(os.getenv("META_IG_ACCOUNT_CACHE_TTL", 86400)),
+    db_path=os.getenv("META_CACHE_DB"),
+)
+
+# Hashtag IDs never change and ig_hashtag_search is capped at 30 unique
+# hashtags per account per 7 days, so they are always kept on disk
+hashtag_id_cache = LRUCache(
+    "hashtag_id",
+    max_size=int(os.getenv("META_HASHTAG_CACHE_SIZE", 4096)),
+    ttl=int(os.getenv("META_HASHTAG_CACHE_TTL", 30 * 86400)),
+    db_path=os.getenv("META_CACHE_DB") or os.getenv("META_HASHTAG_DB") or data_path("hashtags.db"),
+)
+
+# Pre-flight probe results by media URL, revalidated with the stored ETag
+media_probe_cache = LRUCache(
+    "media_probe",
+    max_size=int(os.getenv("META_PROBE_CACHE_SIZE", 8192)),
+    ttl=int(os.getenv("META_PROBE_CACHE_TTL", 7 * 86400)),
+    db_path=os.getenv("META_CACHE_DB"),
+)
@@ -0,0 +1,262 @@
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+
+import transport
+from common import data_path
+
+# Hosts callbacks may be sent to, e.g. "hooks.example.com,10.0.0.5". When set,
+# no other host is accepted and these are trusted whatever they resolve to.
+CALLBACK_HOSTS = {host.strip().lower() for host in os.getenv("META_CALLBACK_HOSTS", "").split(",") if host.strip()}
+
+
+def check_callback_url(url):
+    """
+    Raise ValueError unless `url` is an absolute http(s) URL the service may
+    POST to: a host of CALLBACK_HOSTS when that is set, otherwise a host
+    that only resolves to public addresses, so callers cannot point the
+    service at itself or at the private network.
+    """
+    parts = urlsplit(url) if isinstance(url, str) else None
+    if parts is None or parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError("callback_url must be an absolute http(s) URL")
+
+    host = parts.hostname.lower()
+    if CALLBACK_HOSTS:
+        if host not in CALLBACK_HOSTS:
+            raise ValueError("callback_url host is not allowed")
+        return url
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or None, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError, ValueError):
+        raise ValueError("callback_url host does not resolve")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%')[0])
+        ip = getattr(ip, 'ipv4_mapped', None) or ip
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError("callback_url must point to a public address")
+    return url
+
+
+def signature(body, secret):
+    """
+    X-Hub-Signature-256 value of a body: the same scheme Meta signs its
+    webhooks with, so receivers can verify both the same way.
+    """
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+class CallbackDispatcher():
+    """
+    Delivers publish results to the callback_url the caller gave.
+
+    Events are written to an SQLite outbox first, so they survive restarts and
+    any process sharing the database can deliver them. A background thread
+    groups due events by destination and POSTs up to `batch_size` of them as
+    one {"events": [...]} body; a new event waits `batch_window` seconds so
+    the events finishing around it go out in the same request. Only one batch
+    per destination is in flight at a time.
+
+    Network errors and non-2xx answers are retried with exponential backoff
+    (or the destination's Retry-After) until `max_attempts`, after which the
+    events are marked 'failed'. Delivery is at least once; receivers dedupe
+    on the event 'id'. The destination is checked again before each attempt,
+    since its DNS may have changed since the event was queued.
+    """
+
+    def __init__(self, db_path, secret=None, batch_size=50, batch_window=0.5, max_attempts=8,
+                 backoff=2.0, max_backoff=300.0, workers=4, timeout=10.0, poll_interval=1.0, stale_after=300):
+        self.db_path = db_path
+        self.secret = secret
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self._busy = set()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="callback-delivery")
+        self.batches = 0
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS callbacks ("
+                "id TEXT PRIMARY KEY, url TEXT, payload TEXT, status TEXT, attempts INTEGER, "
+                "created_at REAL, next_attempt_at REAL, claim TEXT, claimed_at REAL, delivered_at REAL, error TEXT)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS callbacks_due ON callbacks (status, next_attempt_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def start(self):
+        with self._condition:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="callback-dispatcher", daemon=True)
+                self._thread.start()
+
+    def send(self, url, event):
+        """
+        Queue `event` (a JSON-serialisable dict) for delivery to `url`.
+        Returns the event ID it is delivered under.
+        """
+        event_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO callbacks (id, url, payload, status, attempts, created_at, next_attempt_at) "
+                "VALUES (?, ?, ?, 'pending', 0, ?, ?)",
+                (event_id, url, json.dumps(dict(event, id=event_id)), now, now + self.batch_window),
+            )
+        self.start()
+        with self._condition:
+            self._condition.notify()
+        return event_id
+
+    def stats(self):
+        with self._connect() as db:
+            counts = dict(db.execute("SELECT status, COUNT(*) FROM callbacks GROUP BY status").fetchall())
+        with self._condition:
+            return dict(counts, batches=self.batches, destinations_in_flight=len(self._busy))
+
+    def _run(self):
+        while True:
+            try:
+                batches = self._claim()
+            except sqlite3.Error:
+                logging.exception("Failed to claim callbacks")
+                batches = {}
+
+            with self._condition:
+                for url, rows in batches.items():
+                    self._busy.add(url)
+                    self._executor.submit(self._deliver, url, rows)
+                self._condition.wait(self._wait())
+
+    def _wait(self):
+        try:
+            with self._connect() as db:
+                due = db.execute("SELECT MIN(next_attempt_at) FROM callbacks WHERE status = 'pending'").fetchone()[0]
+        except sqlite3.Error:
+            due = None
+        if due is None:
+            return self.poll_interval
+        return min(max(due - time.time(), 0.01), self.poll_interval)
+
+    def _claim(self):
+        """
+        {url: [(id, payload, attempts), ...]} of the batches this process now
+        owns. Events are taken with a conditional UPDATE under a fresh claim
+        token, so each batch goes out from one process only.
+        """
+        now = time.time()
+        claim = uuid.uuid4().hex
+        batches = {}
+        with self._connect() as db:
+            # Batches of a process that died mid-delivery
+            db.execute(
+                "UPDATE callbacks SET status = 'pending', claim = NULL WHERE status = 'sending' AND claimed_at < ?",
+                (now - self.stale_after,),
+            )
+            urls = [row[0] for row in db.execute(
+                "SELECT DISTINCT url FROM callbacks WHERE status = 'pending' AND next_attempt_at <= ?", (now,)
+            )]
+            for url in urls:
+                with self._condition:
+                    if url in self._busy:
+                        continue
+                # A due event takes the destination's other first-attempt events along
+                ids = [row[0] for row in db.execute(
+                    "SELECT id FROM callbacks WHERE url = ? AND status = 'pending' AND (next_attempt_at <= ? OR attempts = 0) "
+                    "ORDER BY created_at LIMIT ?",
+                    (url, now, self.batch_size),
+                )]
+                db.execute(
+                    f"UPDATE callbacks SET status = 'sending', claim = ?, claimed_at = ? "
+                    f"WHERE id IN ({', '.join('?' * len(ids))}) AND status = 'pending'",
+                    (claim, now, *ids),
+                )
+                rows = db.execute(
+                    "SELECT id, payload, attempts FROM callbacks WHERE claim = ? AND url = ? ORDER BY created_at",
+                    (claim, url),
+                ).fetchall()
+                if rows:
+                    batches[url] = rows
+        return batches
+
+    def _deliver(self, url, rows):
+        body = json.dumps({'events': [json.loads(payload) for _, payload, _ in rows]}).encode()
+        headers = {'Content-Type': 'application/json'}
+        if self.secret:
+            headers['X-Hub-Signature-256'] = signature(body, self.secret)
+
+        retry_after = None
+        try:
+            check_callback_url(url)
+            response = transport.post(url, data=body, headers=headers, timeout=self.timeout, allow_redirects=False)
+            error = None if 200 <= response.status_code < 300 else f"HTTP {response.status_code}"
+            retry_after = response.headers.get('Retry-After')
+            response.close()
+        except (ValueError, requests.exceptions.RequestException) as e:
+            error = str(e)
+
+        try:
+            self._record(rows, error, retry_after)
+        except sqlite3.Error:
+            logging.exception("Failed to record callback delivery to %s", urlsplit(url).hostname)
+        finally:
+            with self._condition:
+                self.batches += 1
+                self._busy.discard(url)
+                self._condition.notify()
+
+    def _record(self, rows, error, retry_after):
+        now = time.time()
+        ids = [row[0] for row in rows]
+        placeholders = ', '.join('?' * len(ids))
+        with self._connect() as db:
+            if error is None:
+                db.execute(
+                    f"UPDATE callbacks SET status = 'delivered', delivered_at = ?, attempts = attempts + 1, error = NULL "
+                    f"WHERE id IN ({placeholders})",
+                    (now, *ids),
+                )
+                return
+
+            attempts = max(row[2] for row in rows) + 1
+            delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, min(float(retry_after), self.max_backoff))
+            status = 'failed' if attempts >= self.max_attempts else 'pending'
+            print(f"Callback delivery failed ({error}), attempt {attempts} of {self.max_attempts}")
+            db.execute(
+                f"UPDATE callbacks SET status = ?, attempts = ?, next_attempt_at = ?, claim = NULL, error = ? "
+                f"WHERE id IN ({placeholders})",
+                (status, attempts, now + delay, error, *ids),
+            )
+
+
+callback_dispatcher = CallbackDispatcher(
+    os.getenv("META_CALLBACKS_DB") or data_path("callbacks.db"),
+    secret=os.getenv("META_CALLBACK_SECRET"),
+    batch_size=int(os.getenv("META_CALLBACK_BATCH_SIZE", 50)),
+    batch_window=float(os.getenv("META_CALLBACK_BATCH_WINDOW", 0.5)),
+    max_attempts=int(os.getenv("META_CALLBACK_MAX_ATTEMPTS", 8)),
+    workers=int(os.getenv("META_CALLBACK_WORKERS", 4)),
+)
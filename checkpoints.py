@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from common import data_path
+
+
+class CheckpointStore():
+    """
+    SQLite record of the intermediate Graph IDs of multi-step publishes.
+
+    Every publish is a fixed sequence of steps (child uploads, container,
+    media_publish / reel start, upload, finish). Each step's output is saved
+    under the workflow key as soon as it succeeds, so a retry of the same
+    publish, or a job re-run after a worker restart, starts from the first
+    step that has not completed yet. Rows expire after `ttl` seconds, which
+    stays below the 24 hour lifetime of an unpublished Instagram container.
+    """
+
+    def __init__(self, db_path, ttl=82800):
+        self.db_path = db_path
+        self.ttl = ttl
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                "workflow TEXT, step TEXT, value TEXT, created_at REAL, "
+                "PRIMARY KEY (workflow, step))"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def load(self, workflow):
+        """
+        Completed steps of a workflow as {step: value}.
+        """
+        with self._connect() as db:
+            db.execute("DELETE FROM checkpoints WHERE created_at < ?", (time.time() - self.ttl,))
+            rows = db.execute("SELECT step, value FROM checkpoints WHERE workflow = ?", (workflow,)).fetchall()
+        return {step: json.loads(value) for step, value in rows}
+
+    def save(self, workflow, step, value):
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO checkpoints (workflow, step, value, created_at) VALUES (?, ?, ?, ?)",
+                (workflow, step, json.dumps(value), time.time()),
+            )
+
+    def discard(self, workflow, step):
+        with self._connect() as db:
+            db.execute("DELETE FROM checkpoints WHERE workflow = ? AND step = ?", (workflow, step))
+
+    def clear(self, workflow):
+        with self._connect() as db:
+            db.execute("DELETE FROM checkpoints WHERE workflow = ?", (workflow,))
+
+    def stats(self):
+        with self._connect() as db:
+            workflows, steps = db.execute(
+                "SELECT COUNT(DISTINCT workflow), COUNT(*) FROM checkpoints WHERE created_at >= ?",
+                (time.time() - self.ttl,),
+            ).fetchone()
+        return {'workflows': workflows, 'steps': steps}
+
+
+class Workflow():
+    """
+    One publish run against the checkpoint store. Steps read as:
+
+        creation_id = workflow.get('container')
+        if creation_id is None:
+            creation_id = ...create it...
+            workflow.save('container', creation_id)
+
+    and finish() forgets the run once the final step succeeded.
+    """
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        self.completed = store.load(key)
+
+    def get(self, step):
+        return self.completed.get(step)
+
+    def save(self, step, value):
+        self.completed[step] = value
+        self.store.save(self.key, step, value)
+        return value
+
+    def discard(self, step):
+        """Forget a step whose output turned out to be unusable (e.g. an expired container)."""
+        self.completed.pop(step, None)
+        self.store.discard(self.key, step)
+
+    def finish(self):
+        self.completed = {}
+        self.store.clear(self.key)
+
+
+def workflow_key(method, app_id, page_id, arguments):
+    """
+    Stable key of a publish: the same method, page and arguments resume the
+    same workflow.
+    """
+    canonical = json.dumps([method, app_id, page_id, arguments], sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+checkpoint_store = CheckpointStore(
+    os.getenv("META_CHECKPOINT_DB") or data_path("checkpoints.db"),
+    ttl=int(os.getenv("META_CHECKPOINT_TTL", 82800)),
+)
@@ -0,0 +1,11 @@
+import os
+
+
+def data_path(name):
+    """
+    Path of the state file or directory `name` in META_DATA_DIR (the working
+    directory by default), which is created when missing.
+    """
+    directory = os.getenv("META_DATA_DIR", ".")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
@@ -0,0 +1,338 @@
+"""
+Page-affinity front dispatcher: `python dispatcher.py --workers 4 --port 4000`.
+
+Starts local service workers on the ports after --port and forwards every
+request to the worker that X-PAGE-ID hashes to on a consistent-hash ring, so
+each page's token, Instagram account and rate budget stay warm in one
+process instead of being re-fetched by every worker.
+
+With peers (META_DISPATCH_PEERS, the dispatcher URLs of the other nodes,
+and META_DISPATCH_NODE_URL, this node's URL as the peers know it) pages are
+first hashed onto nodes, then onto that node's workers. Every node must be
+given the same set of node URLs.
+"""
+import argparse
+import asyncio
+import bisect
+import hashlib
+import hmac
+import itertools
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+# Marks a request a peer already routed, so it is only spread over local workers
+HOP_HEADER = 'X-Dispatch-Hop'
+# Starts each gunicorn worker's background threads
+GUNICORN_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+# Not forwarded in either direction
+HOP_BY_HOP = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailer',
+    'transfer-encoding', 'upgrade', 'host', 'content-length',
+}
+
+
+class HashRing():
+    """
+    Consistent-hash ring with `vnodes` points per member. Adding or removing
+    a member only moves the keys between its points and their neighbours,
+    about 1/N of them.
+    """
+
+    def __init__(self, members=(), vnodes=128):
+        self.vnodes = vnodes
+        self._hashes = []
+        self._members = []
+        for member in members:
+            self.add(member)
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.sha256(value.encode()).digest()[:8], 'big')
+
+    def add(self, member):
+        for i in range(self.vnodes):
+            point = self._hash(f"{member}#{i}")
+            index = bisect.bisect(self._hashes, point)
+            self._hashes.insert(index, point)
+            self._members.insert(index, member)
+
+    def remove(self, member):
+        keep = [(point, owner) for point, owner in zip(self._hashes, self._members) if owner != member]
+        self._hashes = [point for point, _ in keep]
+        self._members = [owner for _, owner in keep]
+
+    def members(self):
+        return sorted(set(self._members))
+
+    def lookup(self, key):
+        """
+        Distinct members in ring order from `key`'s position: the owner
+        first, then the members that take over its keys when it is down.
+        """
+        if not self._hashes:
+            return []
+        start = bisect.bisect(self._hashes, self._hash(key))
+        seen = []
+        for i in range(len(self._members)):
+            member = self._members[(start + i) % len(self._members)]
+            if member not in seen:
+                seen.append(member)
+        return seen
+
+
+class Dispatcher():
+    """
+    Routes requests onto the node ring and this node's worker ring.
+
+    Requests without X-PAGE-ID (stats, jobs, webhook verification) go to the
+    local workers in turn; webhook deliveries are sent to every worker on
+    every node, since only the process polling a container can wake it. A
+    member that refuses connections is skipped for `cooldown` seconds and
+    its pages go to the next member on the ring; nothing else moves.
+    """
+
+    def __init__(self, workers, peers=(), node_url=None, vnodes=128, cooldown=5.0, read_timeout=600.0):
+        self.workers = HashRing(workers, vnodes)
+        self.node_url = node_url.rstrip('/') if node_url else None
+        self.nodes = HashRing([self.node_url, *(peer.rstrip('/') for peer in peers)] if peers else (), vnodes)
+        self.cooldown = cooldown
+        self._down = {}
+        self._next_worker = itertools.cycle(list(workers))
+        self.requests = {}
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(5.0, read=read_timeout),
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=256),
+        )
+
+    def candidates(self, request):
+        """
+        Members to try for a request, preferred first; peers are marked so
+        the request is sent to them with the hop header.
+        """
+        page_id = request.headers.get('X-PAGE-ID')
+        if not page_id:
+            first = next(self._next_worker)
+            rest = [member for member in self.workers.members() if member != first]
+            return [(member, False) for member in [first, *rest]]
+
+        order = []
+        if self.nodes.members() and HOP_HEADER.lower() not in request.headers:
+            for node in self.nodes.lookup(page_id):
+                if node == self.node_url:
+                    order.extend((worker, False) for worker in self.workers.lookup(page_id))
+                else:
+                    order.append((node, True))
+        else:
+            order.extend((worker, False) for worker in self.workers.lookup(page_id))
+        # Members in their cooldown go last, in case everything else is down too
+        now = time.monotonic()
+        return sorted(order, key=lambda candidate: self._down.get(candidate[0], 0) > now)
+
+    async def forward(self, request):
+        body = await request.body()
+        last_error = None
+        for member, peer in self.candidates(request):
+            try:
+                response = await self._send(request, body, member, peer)
+            except httpx.ConnectError as e:
+                # Nothing reached the member, so the next one can take it
+                self._down[member] = time.monotonic() + self.cooldown
+                last_error = e
+                continue
+            self.requests[member] = self.requests.get(member, 0) + 1
+            headers = [(name, value) for name, value in response.headers.multi_items() if name.lower() not in HOP_BY_HOP]
+            # A peer's answer already names the worker that served it
+            if 'x-dispatch-backend' not in response.headers:
+                headers.append(('X-Dispatch-Backend', member))
+            return StreamingResponse(
+                response.aiter_raw(), status_code=response.status_code, headers=dict(headers),
+                background=BackgroundTask(response.aclose),
+            )
+        return JSONResponse({'error': f"No worker available: {last_error}"}, 502)
+
+    async def broadcast(self, request):
+        """
+        Send a webhook delivery to every local worker and, unless a peer sent
+        it, to every peer. Answers with the first successful response.
+        """
+        body = await request.body()
+        targets = [(worker, False) for worker in self.workers.members()]
+        if HOP_HEADER.lower() not in request.headers:
+            targets.extend((node, True) for node in self.nodes.members() if node != self.node_url)
+        results = await asyncio.gather(
+            *(self._read(request, body, member, peer) for member, peer in targets), return_exceptions=True,
+        )
+        responses = [result for result in results if isinstance(result, httpx.Response)]
+        if not responses:
+            return JSONResponse({'error': 'No worker available'}, 502)
+        best = next((response for response in responses if response.status_code < 400), responses[0])
+        return Response(best.content, best.status_code, media_type=best.headers.get('content-type'))
+
+    async def _send(self, request, body, member, peer):
+        url = member + request.url.path + (f"?{request.url.query}" if request.url.query else '')
+        headers = [(name, value) for name, value in request.headers.items() if name.lower() not in HOP_BY_HOP]
+        if peer:
+            headers.append((HOP_HEADER, '1'))
+        upstream = self.client.build_request(request.method, url, headers=headers, content=body)
+        return await self.client.send(upstream, stream=True)
+
+    async def _read(self, request, body, member, peer):
+        response = await self._send(request, body, member, peer)
+        await response.aread()
+        await response.aclose()
+        return response
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'node': self.node_url,
+            'nodes': self.nodes.members(),
+            'workers': self.workers.members(),
+            'down': [member for member, until in self._down.items() if until > now],
+            'requests': self.requests,
+        }
+
+
+class WorkerPool():
+    """
+    Local service processes on consecutive ports, restarted when they exit.
+    A restarted worker comes back on the same port, so it keeps its pages.
+    """
+
+    def __init__(self, count, base_port, server='asgi', threads=8, host='127.0.0.1'):
+        self.host = host
+        self.server = server
+        self.threads = threads
+        self.ports = [base_port + i for i in range(count)]
+        self.processes = {}
+
+    @property
+    def urls(self):
+        return [f"http://{self.host}:{port}" for port in self.ports]
+
+    def command(self, port):
+        if self.server == 'wsgi':
+            return ['gunicorn', '--bind', f"{self.host}:{port}", '--worker-class', 'gthread',
+                    '--workers', '1', '--threads', str(self.threads), '--config', GUNICORN_CONFIG, 'app:app']
+        return [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', self.host, '--port', str(port),
+                '--no-access-log']
+
+    def start(self):
+        for port in self.ports:
+            self.processes[port] = subprocess.Popen(self.command(port))
+
+    def wait_ready(self, timeout=60.0):
+        """
+        Block until every worker accepts connections (or `timeout` passes).
+        """
+        deadline = time.monotonic() + timeout
+        for port in self.ports:
+            while time.monotonic() < deadline:
+                try:
+                    socket.create_connection((self.host, port), timeout=1).close()
+                    break
+                except OSError:
+                    self.restart_exited()
+                    time.sleep(0.2)
+
+    async def supervise(self, interval=1.0):
+        while True:
+            await asyncio.sleep(interval)
+            self.restart_exited()
+
+    def restart_exited(self):
+        for port, process in self.processes.items():
+            if process.poll() is not None:
+                print(f"Worker on port {port} exited with {process.returncode}, restarting")
+                self.processes[port] = subprocess.Popen(self.command(port))
+
+    def stop(self):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def build_app(dispatcher, pool=None):
+    api_key = os.getenv("FLASK_API_KEY")
+
+    async def dispatch_stats(request):
+        key = request.headers.get("X-API-KEY") or ''
+        if not api_key or not hmac.compare_digest(key, api_key):
+            return JSONResponse({"error": "Unauthorized"}, 401)
+        return JSONResponse(dispatcher.stats())
+
+    async def proxy(request):
+        if request.url.path == '/webhooks' and request.method == 'POST':
+            return await dispatcher.broadcast(request)
+        return await dispatcher.forward(request)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        supervisor = asyncio.create_task(pool.supervise()) if pool else None
+        try:
+            yield
+        finally:
+            if supervisor:
+                supervisor.cancel()
+            await dispatcher.client.aclose()
+            if pool:
+                pool.stop()
+
+    methods = ['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE']
+    return Starlette(routes=[
+        Route('/dispatch/stats', dispatch_stats),
+        Route('/{path:path}', proxy, methods=methods),
+    ], lifespan=lifespan)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 4000)))
+    parser.add_argument('--workers', type=int, default=int(os.getenv("META_DISPATCH_WORKERS", os.cpu_count() or 2)))
+    parser.add_argument('--base-port', type=int, help="port of the first worker (default: --port + 1)")
+    parser.add_argument('--server', choices=('asgi', 'wsgi'), default=os.getenv("META_DISPATCH_SERVER", 'asgi'))
+    parser.add_argument('--threads', type=int, default=8, help="threads per gunicorn worker with --server wsgi")
+    parser.add_argument('--backends', default=os.getenv("META_DISPATCH_BACKENDS", ''),
+                        help="comma separated URLs of running workers to use instead of starting them")
+    parser.add_argument('--peers', default=os.getenv("META_DISPATCH_PEERS", ''),
+                        help="comma separated dispatcher URLs of the other nodes")
+    parser.add_argument('--node-url', default=os.getenv("META_DISPATCH_NODE_URL"),
+                        help="this node's dispatcher URL as the peers know it")
+    parser.add_argument('--vnodes', type=int, default=int(os.getenv("META_DISPATCH_VNODES", 128)))
+    args = parser.parse_args()
+
+    peers = [peer for peer in args.peers.split(',') if peer]
+    if peers and not args.node_url:
+        parser.error("--node-url (META_DISPATCH_NODE_URL) is required with peers")
+
+    pool = None
+    workers = [backend.rstrip('/') for backend in args.backends.split(',') if backend]
+    if not workers:
+        pool = WorkerPool(args.workers, args.base_port or args.port + 1, args.server, args.threads)
+        pool.start()
+        pool.wait_ready()
+        workers = pool.urls
+
+    dispatcher = Dispatcher(workers, peers, args.node_url, vnodes=args.vnodes,
+                            read_timeout=float(os.getenv("META_DISPATCH_READ_TIMEOUT", 600)))
+    uvicorn.run(build_app(dispatcher, pool), host=args.host, port=args.port, log_level='warning', access_log=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,8 @@
+# gunicorn.conf.py
+# Loaded by gunicorn from the working directory, or with --config.
+
+
+def post_worker_init(worker):
+    # Background threads do not survive a fork, so every worker starts its own
+    import app
+    app.start_background()
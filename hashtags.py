@@ -0,0 +1,265 @@
+import asyncio
+import contextvars
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import hashtag_id_cache
+from common import data_path
+from transport import GRAPH_URL
+
+HASHTAG_COMMENT_CONCURRENCY = int(os.getenv("META_HASHTAG_COMMENT_CONCURRENCY", 4))
+# Upper bound on media pages read per edge and run
+HASHTAG_MAX_PAGES = int(os.getenv("META_HASHTAG_MAX_PAGES", 5))
+HASHTAG_PAGE_SIZE = 50
+HASHTAG_EDGES = ('top_media', 'recent_media')
+MEDIA_FIELDS = "id,caption,like_count,comments_count,permalink,media_type,timestamp"
+DEFAULT_COMMENT = "Good post"
+
+
+def normalize_hashtag(hashtag):
+    return hashtag.strip().lstrip('#').lower()
+
+
+class SeenMediaIndex():
+    """
+    SQLite index of the media each Instagram account has commented on.
+
+    A media item is claimed before the comment is sent, so two concurrent runs
+    for the same account never both comment on it. A failed comment releases
+    the claim; a claim whose worker died mid-request is kept, since commenting
+    twice is worse than missing one item.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS seen_media ("
+                "instagram_account_id TEXT, media_id TEXT, hashtag TEXT, comment_id TEXT, created_at REAL, "
+                "PRIMARY KEY (instagram_account_id, media_id))"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def claim(self, instagram_account_id, media_id, hashtag):
+        with self._connect() as db:
+            return db.execute(
+                "INSERT OR IGNORE INTO seen_media (instagram_account_id, media_id, hashtag, created_at) VALUES (?, ?, ?, ?)",
+                (instagram_account_id, media_id, hashtag, time.time()),
+            ).rowcount == 1
+
+    def record(self, instagram_account_id, media_id, comment_id):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE seen_media SET comment_id = ? WHERE instagram_account_id = ? AND media_id = ?",
+                (comment_id, instagram_account_id, media_id),
+            )
+
+    def release(self, instagram_account_id, media_id):
+        with self._connect() as db:
+            db.execute(
+                "DELETE FROM seen_media WHERE instagram_account_id = ? AND media_id = ? AND comment_id IS NULL",
+                (instagram_account_id, media_id),
+            )
+
+
+def resolve_hashtag_id(poster, hashtag, instagram_account_id, page_access_token):
+    """
+    Hashtag ID from the persistent cache, falling back to ig_hashtag_search.
+    """
+    hashtag = normalize_hashtag(hashtag)
+    hashtag_id = hashtag_id_cache.get(hashtag)
+    if hashtag_id:
+        return hashtag_id
+
+    response = poster.graph_get(f"{GRAPH_URL}/v22.0/ig_hashtag_search", params={
+        "user_id": instagram_account_id,
+        "q": hashtag,
+        "access_token": page_access_token
+    })
+    return _remember_hashtag_id(poster, hashtag, response.json())
+
+
+def iter_hashtag_media(poster, hashtag_id, instagram_account_id, page_access_token, edge, max_pages=HASHTAG_MAX_PAGES):
+    """
+    Yield the media of a hashtag edge, following `after` cursors lazily so
+    pages are only fetched while the caller keeps consuming.
+    """
+    params = _media_params(instagram_account_id, page_access_token)
+    for _ in range(max_pages):
+        response = poster.graph_get(f"{GRAPH_URL}/v22.0/{hashtag_id}/{edge}", params=params)
+        data = response.json()
+        if 'error' in data:
+            print(f"Failed to read {edge} of hashtag {hashtag_id}:", data)
+            poster.check_instagram_account_error(data)
+            return
+        yield from data.get('data', [])
+        after = _next_cursor(data)
+        if not after:
+            return
+        params['after'] = after
+
+
+def engage_hashtag(poster, hashtag, message=DEFAULT_COMMENT, limit=5, edges=HASHTAG_EDGES, max_pages=HASHTAG_MAX_PAGES):
+    """
+    Comment `message` on up to `limit` media of `hashtag` that this Instagram
+    account has not commented on before. Media pages are streamed edge by edge
+    and each new item is handed to a bounded pool of comment workers as soon
+    as it is found.
+    """
+    result = _engage_result(hashtag)
+    page_access_token = poster.get_cached_page_access_token()
+    instagram_account_id = page_access_token and poster.get_instagram_account_id(page_access_token)
+    if not instagram_account_id:
+        result['error'] = "Instagram account ID not found"
+        return result
+
+    hashtag_id = resolve_hashtag_id(poster, hashtag, instagram_account_id, page_access_token)
+    if not hashtag_id:
+        result['error'] = f"Hashtag '{hashtag}' not found"
+        return result
+    result['hashtag_id'] = hashtag_id
+
+    def comment_on(media):
+        try:
+            comment = poster.post_comment(media['id'], message, page_access_token)
+        except Exception as e:
+            comment = {'error': str(e)}
+        return _record_comment(instagram_account_id, media, comment)
+
+    context = contextvars.copy_context()
+    futures = []
+    with ThreadPoolExecutor(max_workers=HASHTAG_COMMENT_CONCURRENCY) as executor:
+        for edge in edges:
+            for media in iter_hashtag_media(poster, hashtag_id, instagram_account_id, page_access_token, edge, max_pages):
+                if _claim(result, instagram_account_id, media, hashtag):
+                    futures.append(executor.submit(context.copy().run, comment_on, media))
+                if len(futures) >= limit:
+                    break
+            if len(futures) >= limit:
+                break
+        result['comments'] = [future.result() for future in futures]
+
+    return _finish_result(result)
+
+
+async def engage_hashtag_async(poster, hashtag, message=DEFAULT_COMMENT, limit=5, edges=HASHTAG_EDGES, max_pages=HASHTAG_MAX_PAGES):
+    """
+    engage_hashtag for AsyncPostToFacebookPage, sharing the hashtag cache and
+    the seen-media index.
+    """
+    result = _engage_result(hashtag)
+    page_access_token = await poster.get_cached_page_access_token()
+    instagram_account_id = page_access_token and await poster.get_instagram_account_id(page_access_token)
+    if not instagram_account_id:
+        result['error'] = "Instagram account ID not found"
+        return result
+
+    hashtag_id = hashtag_id_cache.get(normalize_hashtag(hashtag))
+    if not hashtag_id:
+        response = await poster.request('GET', f"{GRAPH_URL}/v22.0/ig_hashtag_search", params={
+            "user_id": instagram_account_id,
+            "q": normalize_hashtag(hashtag),
+            "access_token": page_access_token
+        })
+        hashtag_id = _remember_hashtag_id(poster, normalize_hashtag(hashtag), response.json())
+    if not hashtag_id:
+        result['error'] = f"Hashtag '{hashtag}' not found"
+        return result
+    result['hashtag_id'] = hashtag_id
+
+    semaphore = asyncio.Semaphore(HASHTAG_COMMENT_CONCURRENCY)
+
+    async def comment_on(media):
+        async with semaphore:
+            try:
+                comment = await poster.post_comment(media['id'], message, page_access_token)
+            except Exception as e:
+                comment = {'error': str(e)}
+        return _record_comment(instagram_account_id, media, comment)
+
+    tasks = []
+    for edge in edges:
+        params = _media_params(instagram_account_id, page_access_token)
+        for _ in range(max_pages):
+            if len(tasks) >= limit:
+                break
+            response = await poster.request('GET', f"{GRAPH_URL}/v22.0/{hashtag_id}/{edge}", params=params)
+            data = response.json()
+            if 'error' in data:
+                print(f"Failed to read {edge} of hashtag {hashtag_id}:", data)
+                poster.check_instagram_account_error(data)
+                break
+            for media in data.get('data', []):
+                if len(tasks) >= limit:
+                    break
+                if _claim(result, instagram_account_id, media, hashtag):
+                    tasks.append(asyncio.ensure_future(comment_on(media)))
+            params['after'] = _next_cursor(data)
+            if not params['after']:
+                break
+    result['comments'] = list(await asyncio.gather(*tasks))
+
+    return _finish_result(result)
+
+
+def _remember_hashtag_id(poster, hashtag, data):
+    if data.get("data"):
+        hashtag_id = data["data"][0]["id"]
+        hashtag_id_cache.set(hashtag, hashtag_id)
+        return hashtag_id
+    print(f"Hashtag '{hashtag}' not found.")
+    poster.check_instagram_account_error(data)
+    return None
+
+
+def _media_params(instagram_account_id, page_access_token):
+    return {
+        "user_id": instagram_account_id,
+        "fields": MEDIA_FIELDS,
+        "limit": HASHTAG_PAGE_SIZE,
+        "access_token": page_access_token
+    }
+
+
+def _next_cursor(data):
+    paging = data.get('paging') or {}
+    if not paging.get('next'):
+        return None
+    return (paging.get('cursors') or {}).get('after')
+
+
+def _engage_result(hashtag):
+    return {'success': False, 'hashtag': hashtag, 'scanned': 0, 'skipped': 0, 'comments': []}
+
+
+def _claim(result, instagram_account_id, media, hashtag):
+    result['scanned'] += 1
+    if seen_media.claim(instagram_account_id, media['id'], normalize_hashtag(hashtag)):
+        return True
+    result['skipped'] += 1
+    return False
+
+
+def _record_comment(instagram_account_id, media, comment):
+    outcome = {'media_id': media['id'], 'permalink': media.get('permalink')}
+    if isinstance(comment, dict) and 'id' in comment:
+        seen_media.record(instagram_account_id, media['id'], comment['id'])
+        outcome['comment_id'] = comment['id']
+    else:
+        print(f"Failed to post comment: {comment}")
+        seen_media.release(instagram_account_id, media['id'])
+        outcome['error'] = comment.get('error', comment) if isinstance(comment, dict) else comment
+    return outcome
+
+
+def _finish_result(result):
+    result['success'] = all('comment_id' in comment for comment in result['comments'])
+    return result
+
+
+seen_media = SeenMediaIndex(os.getenv("META_HASHTAG_DB") or data_path("hashtags.db"))
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from common import data_path
+
+
+class IdempotencyStore():
+    """
+    SQLite record of publish requests by Idempotency-Key.
+
+    A key is claimed with an 'in_progress' row before the publish runs and
+    completed with the response that was sent. Duplicates that arrive while
+    the first request is running are turned away, so they do not tie up a
+    worker; later duplicates get the stored response back without touching
+    Graph. Claims older than `stale_after` are treated as abandoned by a
+    dead worker and may be taken over.
+    """
+
+    def __init__(self, db_path, ttl=86400, stale_after=900):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.stale_after = stale_after
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency ("
+                "key TEXT PRIMARY KEY, fingerprint TEXT, state TEXT, "
+                "status INTEGER, body TEXT, created_at REAL, completed_at REAL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def begin(self, key, fingerprint):
+        """
+        Try to claim `key`. Returns one of:
+        ('new', None)               -- caller owns the key and must complete() or abandon() it
+        ('completed', (body, code)) -- replay the stored response
+        ('in_progress', None)       -- another request holds the key
+        ('mismatch', None)          -- the key was used with a different request body
+        """
+        now = time.time()
+        with self._connect() as db:
+            db.execute("DELETE FROM idempotency WHERE created_at < ?", (now - self.ttl,))
+            claimed = db.execute(
+                "INSERT OR IGNORE INTO idempotency (key, fingerprint, state, created_at) VALUES (?, ?, 'in_progress', ?)",
+                (key, fingerprint, now),
+            ).rowcount
+            if not claimed:
+                row = db.execute(
+                    "SELECT fingerprint, state, status, body, created_at FROM idempotency WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return self.begin(key, fingerprint)
+                stored_fingerprint, state, status, body, created_at = row
+                if stored_fingerprint != fingerprint:
+                    return 'mismatch', None
+                if state == 'completed':
+                    return 'completed', (body, status)
+                taken_over = db.execute(
+                    "UPDATE idempotency SET created_at = ? WHERE key = ? AND state = 'in_progress' AND created_at < ?",
+                    (now, key, now - self.stale_after),
+                ).rowcount
+                if not taken_over:
+                    return 'in_progress', None
+        return 'new', None
+
+    def complete(self, key, body, status):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE idempotency SET state = 'completed', status = ?, body = ?, completed_at = ? WHERE key = ?",
+                (status, body, time.time(), key),
+            )
+
+    def abandon(self, key):
+        """
+        Forget a claim whose publish failed so a retry can run it again.
+        """
+        with self._connect() as db:
+            db.execute("DELETE FROM idempotency WHERE key = ? AND state = 'in_progress'", (key,))
+
+
+def scope(app_id, page_id, path, key):
+    """
+    Store key of an Idempotency-Key: keys are only unique per app, page and route.
+    """
+    return f"{app_id}:{page_id}:{path}:{key}"
+
+
+def fingerprint(data):
+    """
+    Stable fingerprint of a JSON request body.
+    """
+    try:
+        canonical = json.dumps(json.loads(data or b'{}'), sort_keys=True).encode()
+    except ValueError:
+        canonical = data or b''
+    return hashlib.sha256(canonical).hexdigest()
+
+
+idempotency_store = IdempotencyStore(
+    os.getenv("META_IDEMPOTENCY_DB") or data_path("idempotency.db"),
+    ttl=int(os.getenv("META_IDEMPOTENCY_TTL", 86400)),
+    stale_after=int(os.getenv("META_IDEMPOTENCY_STALE_AFTER", 900)),
+)
@@ -0,0 +1,398 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import transport
+from callbacks import callback_dispatcher
+from common import data_path
+from meta import PostToFacebookPage
+from registry import poster_registry
+
+# PostToFacebookPage methods that may be run as background jobs
+PUBLISH_METHODS = ('fb_post_images', 'fb_upload_reel', 'ig_post_carousel', 'ig_post_image', 'ig_upload_reel')
+# Columns added after the first release, migrated in place on start-up
+ADDED_COLUMNS = (
+    ('publish_at', 'REAL'), ('run_at', 'REAL'), ('prepare_at', 'REAL'), ('prepared_at', 'REAL'),
+    ('callback_url', 'TEXT'), ('lease_until', 'REAL'),
+)
+JOB_FIELDS = (
+    'id', 'method', 'status', 'created_at', 'publish_at', 'run_at', 'prepared_at',
+    'started_at', 'finished_at', 'steps', 'result', 'error', 'callback_url',
+)
+
+
+class JobQueue():
+    """
+    SQLite-backed publish queue drained by a pool of background worker threads.
+
+    Jobs carry the credentials needed to rebuild a PostToFacebookPage (app
+    secret and long-lived user token), so the database file is sensitive: it
+    is kept readable by its owner only, and a job's credentials are erased as
+    soon as it finishes or is cancelled. Only queued and scheduled jobs hold
+    them, since they must survive a restart. Several processes may
+    share one database; a job is claimed with a conditional UPDATE so it runs
+    exactly once.
+
+    A running job holds a lease of `lease` seconds that its process renews
+    every lease / 3 seconds. Only a job whose lease ran out, because the
+    process that claimed it died or froze, is re-queued for another worker.
+    A frozen process that wakes up after that can still finish the job, so
+    the lease must be well above any pause the host may take.
+
+    Jobs with a publish time start out 'scheduled'; the scheduler moves them
+    through 'preparing' and 'prepared' and releases them to 'queued' when they
+    are due, or they are 'cancelled' before that.
+
+    When a job with a callback_url finishes, its outcome is handed to the
+    callback dispatcher for delivery.
+    """
+
+    def __init__(self, db_path, workers=4, poll_interval=1.0, stale_after=900, lease=60):
+        self.db_path = db_path
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.lease = lease
+        self._condition = threading.Condition()
+        self._running = set()
+        self._started = False
+        self._init_db()
+
+    def _init_db(self):
+        if self.db_path != ":memory:":
+            if not os.path.exists(self.db_path):
+                os.close(os.open(self.db_path, os.O_CREAT | os.O_WRONLY, 0o600))
+            else:
+                try:
+                    os.chmod(self.db_path, 0o600)
+                except OSError as e:
+                    logging.warning("Could not restrict the permissions of %s: %s", self.db_path, e)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, method TEXT, args TEXT, credentials TEXT, "
+                "status TEXT, created_at REAL, started_at REAL, finished_at REAL, "
+                "steps TEXT, result TEXT, error TEXT)"
+            )
+            columns = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+            for column, kind in ADDED_COLUMNS:
+                if column not in columns:
+                    try:
+                        db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+                    except sqlite3.OperationalError as e:
+                        # Another worker starting at the same time added it first
+                        if 'duplicate column' not in str(e):
+                            raise
+            db.execute("UPDATE jobs SET run_at = created_at WHERE run_at IS NULL")
+            # Jobs finished before credentials were erased on completion
+            db.execute(
+                "UPDATE jobs SET credentials = NULL "
+                "WHERE status IN ('succeeded', 'failed', 'cancelled') AND credentials IS NOT NULL"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_run_at ON jobs (status, run_at)")
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        # Overwrite erased credentials instead of leaving them in free pages
+        db.execute("PRAGMA secure_delete = ON")
+        return db
+
+    def start(self):
+        """
+        Start the worker threads and the lease keeper once per process.
+        """
+        with self._condition:
+            if self._started:
+                return
+            self._started = True
+
+        self._requeue_expired()
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"publish-worker-{i}", daemon=True).start()
+        threading.Thread(target=self._keep_leases, name="publish-leases", daemon=True).start()
+
+    def _requeue_expired(self):
+        """
+        Re-queue the running jobs whose lease ran out. Jobs claimed before
+        leases existed fall back to stale_after.
+        """
+        now = time.time()
+        with self._connect() as db:
+            return db.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL, lease_until = NULL WHERE status = 'running' "
+                "AND (lease_until < ? OR (lease_until IS NULL AND started_at < ?))",
+                (now, now - self.stale_after),
+            ).rowcount
+
+    def _keep_leases(self):
+        while True:
+            time.sleep(self.lease / 3)
+            with self._condition:
+                running = list(self._running)
+            try:
+                if running:
+                    with self._connect() as db:
+                        db.execute(
+                            f"UPDATE jobs SET lease_until = ? WHERE status = 'running' "
+                            f"AND id IN ({', '.join('?' * len(running))})",
+                            (time.time() + self.lease, *running),
+                        )
+                requeued = self._requeue_expired()
+            except sqlite3.Error:
+                logging.exception("Failed to renew publish job leases")
+                continue
+
+            if requeued:
+                with self._condition:
+                    self._condition.notify(requeued)
+
+    def enqueue(self, poster, method, kwargs, publish_at=None, run_at=None, prepare_at=None, callback_url=None):
+        """
+        Store a publish job. Without `run_at` it is queued for the workers
+        right away; otherwise it waits, 'scheduled', for the scheduler.
+        """
+        if method not in PUBLISH_METHODS:
+            raise ValueError(f"Unsupported publish method: {method}")
+
+        now = time.time()
+        status = 'scheduled' if run_at is not None else 'queued'
+        if status == 'queued':
+            self.start()
+        job_id = uuid.uuid4().hex
+        credentials = {
+            'app_id': poster.app_id,
+            'app_secret': poster.app_secret,
+            'page_id': poster.page_id,
+            'token': poster.long_lived_token_file,
+        }
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, method, args, credentials, status, created_at, publish_at, run_at, prepare_at, "
+                "callback_url) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, method, json.dumps(kwargs), json.dumps(credentials), status, now,
+                 publish_at, now if run_at is None else run_at, prepare_at, callback_url),
+            )
+        if status == 'queued':
+            with self._condition:
+                self._condition.notify()
+        return job_id
+
+    def get(self, job_id):
+        """
+        Public view of a job: status, per-step timings and the final result.
+        Credentials are never returned.
+        """
+        with self._connect() as db:
+            row = db.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(zip(JOB_FIELDS, row))
+        job['steps'] = json.loads(job['steps']) if job['steps'] else []
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def cancel(self, job_id):
+        """
+        Cancel a job that has not been released to the workers yet.
+        Containers it already prepared are left to expire.
+        """
+        with self._connect() as db:
+            return db.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ?, credentials = NULL "
+                "WHERE id = ? AND status IN ('scheduled', 'preparing', 'prepared')",
+                (time.time(), job_id),
+            ).rowcount == 1
+
+    def scheduled(self):
+        """
+        (id, status, prepare_at, run_at) of every job the scheduler still
+        has to prepare or release.
+        """
+        with self._connect() as db:
+            return db.execute(
+                "SELECT id, status, prepare_at, run_at FROM jobs "
+                "WHERE status IN ('scheduled', 'preparing', 'prepared') ORDER BY run_at"
+            ).fetchall()
+
+    def claim_prepare(self, job_id):
+        """
+        Mark a scheduled job as preparing. Returns (method, args, credentials),
+        or None when another process got to it first or it was cancelled.
+        """
+        with self._connect() as db:
+            claimed = db.execute(
+                "UPDATE jobs SET status = 'preparing', started_at = ? WHERE id = ? AND status = 'scheduled'",
+                (time.time(), job_id),
+            ).rowcount
+            if not claimed:
+                return None
+            return db.execute("SELECT method, args, credentials FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def finish_prepare(self, job_id, steps, result, error):
+        """
+        Record the outcome of preparing a job. A failed preparation puts the
+        job back to 'scheduled'; the full publish still runs when it is due.
+        """
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, prepared_at = ?, started_at = NULL, steps = ?, result = ?, error = ? "
+                "WHERE id = ? AND status = 'preparing'",
+                (
+                    'scheduled' if error else 'prepared',
+                    None if error else time.time(),
+                    json.dumps(steps),
+                    json.dumps(result),
+                    json.dumps(error) if error and not isinstance(error, str) else error,
+                    job_id,
+                ),
+            )
+
+    def release(self, job_id):
+        """
+        Hand a due job to the workers. Returns 'released', 'busy' while it is
+        still being prepared, or None if it is no longer waiting.
+        """
+        with self._connect() as db:
+            released = db.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL WHERE id = ? AND "
+                "(status IN ('scheduled', 'prepared') OR (status = 'preparing' AND started_at < ?))",
+                (job_id, time.time() - self.stale_after),
+            ).rowcount
+            if not released:
+                row = db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                return 'busy' if row and row[0] == 'preparing' else None
+
+        self.start()
+        with self._condition:
+            self._condition.notify()
+        return 'released'
+
+    def counts(self):
+        with self._connect() as db:
+            return dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def _claim(self):
+        with self._connect() as db:
+            while True:
+                row = db.execute(
+                    "SELECT id, method, args, credentials, callback_url FROM jobs "
+                    "WHERE status = 'queued' ORDER BY run_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                now = time.time()
+                claimed = db.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ?, lease_until = ? "
+                    "WHERE id = ? AND status = 'queued'",
+                    (now, now + self.lease, row[0]),
+                ).rowcount
+                if claimed:
+                    with self._condition:
+                        self._running.add(row[0])
+                    return row
+
+    def _work(self):
+        while True:
+            try:
+                job = self._claim()
+            except sqlite3.Error:
+                logging.exception("Failed to claim publish job")
+                job = None
+
+            if job is None:
+                with self._condition:
+                    self._condition.wait(self.poll_interval)
+                continue
+
+            try:
+                self._run(*job)
+            except Exception as e:
+                logging.exception("Publish job %s crashed", job[0])
+                self._fail(job[0], str(e))
+            finally:
+                with self._condition:
+                    self._running.discard(job[0])
+
+    def _fail(self, job_id, error):
+        """
+        Mark a job whose run crashed as failed, so it is not left 'running'
+        with its credentials. A job that already reached its final state is
+        left alone.
+        """
+        try:
+            with self._connect() as db:
+                db.execute(
+                    "UPDATE jobs SET status = 'failed', finished_at = ?, error = ?, credentials = NULL "
+                    "WHERE id = ? AND status = 'running'",
+                    (time.time(), error, job_id),
+                )
+        except sqlite3.Error:
+            logging.exception("Failed to mark publish job %s as failed", job_id)
+
+    def _run(self, job_id, method, args, credentials, callback_url):
+        steps, result, error = self.call(job_id, method, args, credentials)
+
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, steps = ?, result = ?, error = ?, credentials = NULL "
+                "WHERE id = ?",
+                (
+                    'failed' if error else 'succeeded',
+                    time.time(),
+                    json.dumps(steps),
+                    json.dumps(result),
+                    json.dumps(error) if error and not isinstance(error, str) else error,
+                    job_id,
+                ),
+            )
+        if callback_url:
+            self.notify(job_id, json.loads(credentials)['page_id'], callback_url)
+
+    def notify(self, job_id, page_id, callback_url):
+        """
+        Queue the 'publish.succeeded' or 'publish.failed' event of a finished job.
+        """
+        job = self.get(job_id)
+        event = {key: job[key] for key in JOB_FIELDS if key not in ('id', 'steps', 'callback_url')}
+        event.update(type=f"publish.{job['status']}", job_id=job_id, page_id=page_id)
+        try:
+            callback_dispatcher.send(callback_url, event)
+        except sqlite3.Error:
+            logging.exception("Failed to queue the callback of job %s", job_id)
+
+    def call(self, job_id, method, args, credentials, **options):
+        """
+        Run a job's publish method on the registry's poster for its page.
+        Returns (steps, result, error).
+        """
+        credentials = json.loads(credentials)
+        poster = poster_registry.get(
+            PostToFacebookPage,
+            credentials['app_id'], credentials['app_secret'], credentials['page_id'], credentials['token'],
+        )
+        result, error = None, None
+
+        with transport.trace() as steps:
+            try:
+                result = getattr(poster, method)(**json.loads(args), **options)
+                if not result.get('success'):
+                    error = result.get('error') or "Publish failed"
+            except Exception as e:
+                logging.exception("Publish job %s failed", job_id)
+                error = str(e)
+        return steps, result, error
+
+
+job_queue = JobQueue(
+    os.getenv("META_JOBS_DB") or data_path("jobs.db"),
+    workers=int(os.getenv("META_JOB_WORKERS", 4)),
+    stale_after=int(os.getenv("META_JOB_STALE_AFTER", 900)),
+    lease=int(os.getenv("META_JOB_LEASE", 60)),
+)
@@ -0,0 +1,127 @@
+import hashlib
+import os
+import threading
+import time
+
+import preflight
+from cache import LRUCache
+
+
+class MediaIndex():
+    """
+    Content-addressed index of media already uploaded to a target, so a post
+    that repeats an image attaches the existing object instead of uploading it
+    again.
+
+    Targets are 'fb:<page_id>' (unpublished photo media_fbids) and
+    'ig:<instagram_account_id>' (carousel item containers). Entries are keyed
+    by target, URL and the ETag the pre-flight probe read for it, so a changed
+    object at the same URL is a miss. Entries expire before Graph drops the
+    objects (24 hours for unpublished containers), and callers check that a
+    reused object is still usable before attaching it and forget it when the
+    post it went into fails. Once that post is published the object is no
+    longer an unpublished upload, so it is dropped from the index too.
+
+    Each entry is held by the workflow that last created or reused it for
+    `lease` seconds, so two posts running at the same time never attach the
+    same object. The claim is taken under the index lock, so it only holds
+    between posts of the same process; posts in other workers may still
+    upload their own copy.
+    """
+
+    def __init__(self, cache, lease=900):
+        self.cache = cache
+        self.lease = lease
+        self._lock = threading.Lock()
+        self.reused = 0
+        self.invalidated = 0
+
+    def key(self, target, url):
+        version = preflight.media_version(url) or ''
+        return hashlib.sha256(f"{target}\0{url}\0{version}".encode()).hexdigest()
+
+    def claim(self, target, posts, outcomes, owner):
+        """
+        {index: media_id} of the posts without an outcome whose image is in
+        the index for `target` and not held by another workflow; the returned
+        entries are now held by `owner`.
+        """
+        found = {}
+        now = time.time()
+        with self._lock:
+            for i, outcome in enumerate(outcomes):
+                if outcome is None:
+                    key = self.key(target, posts[i]['image_url'])
+                    entry = self.cache.get(key)
+                    if not isinstance(entry, dict):
+                        continue
+                    if entry['owner'] != owner and entry['lease_until'] > now:
+                        continue
+                    self.cache.set(key, dict(entry, owner=owner, lease_until=now + self.lease))
+                    found[i] = entry['media_id']
+        return found
+
+    def release(self, target, posts, found):
+        """
+        Give back the entries of `found` without using them, e.g. when they
+        could not be checked.
+        """
+        with self._lock:
+            for i in found:
+                key = self.key(target, posts[i]['image_url'])
+                entry = self.cache.get(key)
+                if isinstance(entry, dict):
+                    self.cache.set(key, dict(entry, owner=None, lease_until=0))
+
+    def usable(self, target, posts, found, statuses, require_finished=False):
+        """
+        Indexes of `found` whose object is still usable according to a Graph
+        `?ids=` lookup; the others are forgotten. IG containers must also be
+        FINISHED (a published or expired container cannot be attached again).
+        """
+        if not isinstance(statuses, dict) or 'error' in statuses:
+            statuses = {}
+
+        usable = []
+        for i, media_id in found.items():
+            status = statuses.get(media_id)
+            if isinstance(status, dict) and (not require_finished or status.get('status_code') == 'FINISHED'):
+                usable.append(i)
+            else:
+                self.forget(target, posts[i]['image_url'])
+        with self._lock:
+            self.reused += len(usable)
+        return usable
+
+    def remember(self, target, url, media_id, owner):
+        entry = {'media_id': media_id, 'owner': owner, 'lease_until': time.time() + self.lease}
+        with self._lock:
+            self.cache.set(self.key(target, url), entry)
+
+    def published(self, target, urls):
+        """
+        Drop the media of a published post; it cannot be attached again.
+        """
+        for url in urls:
+            self.cache.invalidate(self.key(target, url))
+
+    def forget(self, target, url):
+        with self._lock:
+            self.invalidated += 1
+        self.cache.invalidate(self.key(target, url))
+
+    def stats(self):
+        stats = self.cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        with self._lock:
+            stats.update(reused=self.reused, invalidated=self.invalidated)
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+        return stats
+
+
+media_index = MediaIndex(LRUCache(
+    "uploaded_media",
+    max_size=int(os.getenv("META_MEDIA_INDEX_SIZE", 16384)),
+    ttl=int(os.getenv("META_MEDIA_INDEX_TTL", 82800)),
+    db_path=os.getenv("META_CACHE_DB"),
+), lease=int(os.getenv("META_MEDIA_INDEX_LEASE", 900)))
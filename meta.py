@@ -1,7 +1,417 @@
 import requests  # Import the requests library to handle HTTP requests
 import os
-import time
 import json
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import transport
+from transport import GRAPH_URL
+import preflight
+from cache import TokenCache, token_cache, ig_account_cache
+from poller import reel_poller, MISSING_OBJECT_CODES
+from batch import GraphBatch, BatchError
+from checkpoints import Workflow, checkpoint_store, workflow_key
+from hashtags import engage_hashtag, DEFAULT_COMMENT, HASHTAG_EDGES
+from media_index import media_index
+from staging import staging_area
+
+# Maximum number of child media uploads in flight for a single publish
+UPLOAD_CONCURRENCY = int(os.getenv("META_UPLOAD_CONCURRENCY", 4))
+# Bytes held in memory per reel while relaying it to rupload.facebook.com
+UPLOAD_CHUNK_SIZE = int(os.getenv("META_UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+UPLOAD_MAX_RETRIES = int(os.getenv("META_UPLOAD_MAX_RETRIES", 3))
+# Combine independent child uploads (and create + publish) into Graph batch requests
+GRAPH_BATCH = os.getenv("META_GRAPH_BATCH", "1") == "1"
+# Graph error codes of an access token that expired or was revoked
+TOKEN_ERROR_CODES = {102, 190, 463, 467}
+
+
+def is_instagram_account_error(data):
+    """
+    True when a Graph error means the linked Instagram account is gone or we
+    lost permission on it.
+    """
+    error = data.get('error') if isinstance(data, dict) else None
+    if not isinstance(error, dict):
+        return False
+
+    code = error.get('code')
+    subcode = error.get('error_subcode')
+    missing_object = code == 100 and subcode == 33
+    permission_error = code in (10, 190) or (isinstance(code, int) and 200 <= code < 300)
+    return missing_object or permission_error
+
+def rejected_token(response, kwargs):
+    """
+    The access token a request carried (as access_token in its params, form
+    or JSON body, or an OAuth Authorization header) when Graph rejected it as
+    expired or revoked, or None.
+    """
+    if kwargs.get('stream') or transport.graph_error_code(response) not in TOKEN_ERROR_CODES:
+        return None
+    for field in ('params', 'data', 'json'):
+        value = kwargs.get(field)
+        if isinstance(value, dict) and value.get('access_token'):
+            return value['access_token']
+    authorization = (kwargs.get('headers') or {}).get('Authorization') or ''
+    return authorization[len('OAuth '):] if authorization.startswith('OAuth ') else None
+
+
+def with_token(kwargs, old_token, new_token):
+    """
+    Copy of request kwargs with `old_token` replaced by `new_token`.
+    """
+    kwargs = dict(kwargs)
+    for field in ('params', 'data', 'json'):
+        value = kwargs.get(field)
+        if isinstance(value, dict) and value.get('access_token') == old_token:
+            kwargs[field] = dict(value, access_token=new_token)
+    headers = kwargs.get('headers')
+    if isinstance(headers, dict) and headers.get('Authorization') == f"OAuth {old_token}":
+        kwargs['headers'] = dict(headers, Authorization=f"OAuth {new_token}")
+    return kwargs
+
+
+def content_length(headers, status_code):
+    """
+    Total size of the source file, also when the response is a 206 for a
+    Range that does not start at byte 0.
+    """
+    if status_code == 206 and '/' in headers.get('Content-Range', ''):
+        total = headers['Content-Range'].rsplit('/', 1)[1]
+        if total.isdigit():
+            return int(total)
+    if 'Content-Length' in headers:
+        return int(headers['Content-Length'])
+    return None
+
+
+def file_chunk(path, offset):
+    """
+    Up to UPLOAD_CHUNK_SIZE bytes of a local file from `offset`.
+    """
+    with open(path, 'rb') as source:
+        source.seek(offset)
+        return source.read(UPLOAD_CHUNK_SIZE)
+
+
+def finish_reel_workflow(workflow, result):
+    """
+    Settle a reel workflow once the poller is done with its container: forget
+    it after publishing, and drop a container that failed processing so the
+    next attempt creates a fresh one.
+    """
+    if result.get('success'):
+        workflow.finish()
+    elif result.get('status_code') in ('ERROR', 'EXPIRED'):
+        workflow.discard('container')
+
+
+def is_failed_upload_session(data):
+    """
+    True when a reel video lookup shows its upload session can never be
+    resumed: the video is unknown to Graph, or failed or expired.
+    """
+    if not isinstance(data, dict):
+        return False
+    error = data.get('error')
+    if error is not None:
+        return isinstance(error, dict) and error.get('code') in MISSING_OBJECT_CODES
+    status = data.get('status') if isinstance(data.get('status'), dict) else {}
+    uploading = status.get('uploading_phase') if isinstance(status.get('uploading_phase'), dict) else {}
+    return status.get('video_status') in ('error', 'expired') or uploading.get('status') == 'error'
+
+
+def prepared(result, complete):
+    """
+    Result of a prepare_only run: every step before the publish itself is
+    checkpointed, so the real call only has to publish.
+    """
+    result['success'] = complete
+    result['prepared'] = True
+    return result
+
+
+# Request building and result shaping shared by PostToFacebookPage and
+# AsyncPostToFacebookPage, so the two only differ in how they send requests.
+# Shapers accept requests and httpx responses alike.
+
+def authorized(payload, access_token):
+    """
+    `payload` with the access token added, or unchanged without one (batch
+    requests carry the token once for the whole batch).
+    """
+    return dict(payload, access_token=access_token) if access_token else payload
+
+
+def fields_params(fields, access_token):
+    return {'fields': fields, 'access_token': access_token}
+
+
+def token_exchange_params(app_id, app_secret, long_lived_token):
+    return {
+        'grant_type': 'fb_exchange_token',
+        'client_id': app_id,
+        'client_secret': app_secret,
+        'fb_exchange_token': long_lived_token
+    }
+
+
+def exchanged_token(data):
+    """
+    (token, expires_in) of a token exchange answer, or (None, None).
+    """
+    if 'access_token' in data:
+        return data['access_token'], data.get('expires_in')
+    print("Failed to refresh long-lived token:", data)
+    return None, None
+
+
+def page_access_token_from(page_id, data):
+    # The linked Instagram account comes back in the same call, so warm its cache too
+    if 'instagram_business_account' in data:
+        ig_account_cache.set(page_id, data['instagram_business_account']['id'])
+    return data['access_token']
+
+
+def instagram_account_from(page_id, data):
+    if 'instagram_business_account' in data:
+        instagram_account_id = data['instagram_business_account']['id']
+        ig_account_cache.set(page_id, instagram_account_id)
+        return instagram_account_id
+    print("Instagram Business Account not found:", data)
+    return None
+
+
+def check_instagram_account_error(page_id, data):
+    """
+    Drop the memoized Instagram account ID of the page when Graph reports
+    that the account no longer exists or that we lost permission on it.
+    """
+    if is_instagram_account_error(data):
+        ig_account_cache.invalidate(page_id)
+        return True
+    return False
+
+
+def created_id(data):
+    """
+    (id, None) of an object creation answer, or (None, error).
+    """
+    if isinstance(data, dict) and 'id' in data:
+        return data['id'], None
+    return None, data.get('error', data) if isinstance(data, dict) else data
+
+
+def photo_payload(image_url, access_token=None):
+    return authorized({'url': image_url, 'published': 'false'}, access_token)
+
+
+def photo_outcome(image_url, media_fbid, error):
+    if media_fbid:
+        return {'image_url': image_url, 'media_fbid': media_fbid}
+    print("Failed to upload image:", image_url, error)
+    return {'image_url': image_url, 'error': error}
+
+
+def feed_payload(posts, images, access_token):
+    """
+    Feed post attaching every uploaded photo in order, or None if none was.
+    """
+    media_fbids = [{'media_fbid': image['media_fbid']} for image in images if image and 'media_fbid' in image]
+    if not media_fbids:
+        return None
+    payload = {'access_token': access_token, 'message': posts[-1].get('caption', '')}
+    for i, media in enumerate(media_fbids):
+        payload[f'attached_media[{i}]'] = str(media)
+    return payload
+
+
+def carousel_item_payload(image_url, access_token=None):
+    return authorized({'image_url': image_url, 'is_carousel_item': 'true'}, access_token)
+
+
+def item_outcome(page_id, image_url, creation_id, error):
+    if creation_id:
+        return {'image_url': image_url, 'creation_id': creation_id}
+    print("Image upload failed:", image_url, error)
+    check_instagram_account_error(page_id, {'error': error})
+    return {'image_url': image_url, 'error': error}
+
+
+def carousel_payload(posts, creation_ids, access_token=None):
+    return authorized({
+        'media_type': 'CAROUSEL',
+        'children': ','.join(creation_ids),
+        'caption': posts[0]['caption'] if posts else '',
+    }, access_token)
+
+
+def image_payload(image_url, caption, access_token):
+    return {'image_url': image_url, 'caption': caption, 'access_token': access_token}
+
+
+def reel_payload(video_url, caption, access_token):
+    return {
+        "video_url": video_url,
+        "caption": caption,
+        "media_type": "REELS",
+        "share_to_feed": "true",  # Ensure Reel appears in feed
+        "access_token": access_token
+    }
+
+
+def publish_payload(creation_id, access_token):
+    return {"creation_id": creation_id, "access_token": access_token}
+
+
+def publish_result(response, creation_id):
+    """
+    Result dict of a media_publish call.
+    """
+    result = {'success': False, 'creation_id': creation_id}
+    publish_data = response.json()
+    if response.status_code == 200 and "id" in publish_data:
+        print("Post successfully published to Instagram!")
+        result['success'] = True
+        result['media_id'] = publish_data['id']
+    else:
+        print(f"Failed to publish container {creation_id}: {json.dumps(publish_data)}")
+        result['error'] = publish_data.get('error', publish_data)
+    return result
+
+
+def reel_start_payload(access_token):
+    return {"upload_phase": "start", "access_token": access_token}
+
+
+def reel_finish_payload(video_id, caption, access_token):
+    payload = {
+        "upload_phase": "finish",
+        "video_id": video_id,
+        "access_token": access_token,
+        "video_state": "PUBLISHED"
+    }
+    if caption:
+        payload["description"] = caption
+    return payload
+
+
+def chunk_headers(access_token, offset, file_size):
+    return {
+        "Authorization": f"OAuth {access_token}",
+        "offset": str(offset),
+        "file_size": str(file_size),
+        "Content-Type": "application/octet-stream"
+    }
+
+
+def acknowledged_offset(data, fallback):
+    uploading = data.get('status', {}).get('uploading_phase', {})
+    return int(uploading.get('bytes_transferred', fallback))
+
+
+def checkpointed_media(workflow, posts, step, field):
+    """
+    Outcomes of the images a previous attempt already checkpointed under
+    `step`, None for the others.
+    """
+    outcomes = [None] * len(posts)
+    for i, post in enumerate(posts):
+        media_id = workflow.get(f'{step}:{i}')
+        if media_id:
+            outcomes[i] = {'image_url': post['image_url'], field: media_id}
+    return outcomes
+
+
+def reuse_params(found, field, access_token):
+    """
+    ?ids= lookup confirming that media found in the index still exist.
+    """
+    return {
+        'ids': ','.join(sorted(set(found.values()))),
+        'fields': 'status_code' if field == 'creation_id' else 'id',
+        'access_token': access_token,
+    }
+
+
+def apply_reuse(target, workflow, posts, outcomes, found, statuses, field, step):
+    """
+    Fill and checkpoint the outcomes of the found media the lookup showed
+    usable. Returns the reused indexes.
+    """
+    reused = media_index.usable(target, posts, found, statuses, require_finished=field == 'creation_id')
+    for i in reused:
+        outcomes[i] = {'image_url': posts[i]['image_url'], field: found[i], 'reused': True}
+        workflow.save(f'{step}:{i}', found[i])
+    return reused
+
+
+def record_created(target, workflow, posts, outcomes, indexes, created, step, field):
+    """
+    Store the outcomes of newly created media, checkpointing and indexing
+    those that succeeded.
+    """
+    for i, outcome in zip(indexes, created):
+        outcomes[i] = outcome
+        if field in outcome:
+            workflow.save(f'{step}:{i}', outcome[field])
+            media_index.remember(target, posts[i]['image_url'], outcome[field], workflow.key)
+
+
+def finish_published(target, workflow, posts):
+    """
+    Settle a workflow whose post went out: its checkpoints and the index
+    entries of its media are no longer needed.
+    """
+    workflow.finish()
+    media_index.published(target, [post['image_url'] for post in posts])
+
+
+def forget_reused(target, workflow, posts, reused, step):
+    """
+    Drop reused media from the index and the checkpoints after the post
+    they were attached to failed, so the next attempt uploads them again.
+    """
+    for i in reused:
+        media_index.forget(target, posts[i]['image_url'])
+        workflow.discard(f'{step}:{i}')
+
+
+def forget_items(target, workflow, items):
+    """
+    Drop the item containers of a dead carousel; they were made with it or
+    before it.
+    """
+    for i, item in enumerate(items):
+        if item and 'creation_id' in item:
+            media_index.forget(target, item['image_url'])
+            workflow.discard(f'item:{i}')
+
+
+def discard_failed_session(workflow, video_id, data):
+    """
+    Drop the checkpointed upload session of a failed reel once Graph
+    reports it as gone, so the next attempt starts a new one instead of
+    replaying the dead video_id.
+    """
+    if is_failed_upload_session(data):
+        print(f"Upload session of video {video_id} is gone, starting over next time")
+        workflow.discard('upload')
+        workflow.discard('start')
+
+
+def discard_if_dead(workflow, creation_id, data):
+    """
+    Drop the checkpointed container when its status lookup shows it ERROR
+    or EXPIRED, so the next attempt creates a fresh one instead of replaying
+    it. Returns the container's status_code.
+    """
+    status_code = data.get('status_code') if isinstance(data, dict) else None
+    if status_code in ('ERROR', 'EXPIRED'):
+        print(f"Container {creation_id} is {status_code}, creating a new one next time")
+        workflow.discard('container')
+    return status_code
+
 
 class PostToFacebookPage():
     def __init__(self, app_id, app_secret, page_id, long_lived_token_file):
@@ -9,495 +419,815 @@ class PostToFacebookPage():
         self.app_secret = app_secret
         self.page_id = page_id
         self.long_lived_token_file = long_lived_token_file
+        self.token_key = TokenCache.make_key(app_id, page_id, long_lived_token_file)
 
-    def refresh_long_lived_token(self, current_long_lived_token):
+    def __repr__(self):
+        # Never render the app secret or tokens, e.g. in tracebacks and logs
+        return f"PostToFacebookPage(app_id={self.app_id!r}, page_id={self.page_id!r})"
+
+    @property
+    def budget_key(self):
+        return (self.app_id, self.page_id)
+
+    def workflow(self, method, **arguments):
         """
-        Refresh a long-lived user access token before it expires.
+        Checkpointed state of the publish `method` called with `arguments`.
         """
-        url = 'https://graph.facebook.com/oauth/access_token'
-        params = {
-            'grant_type': 'fb_exchange_token',
-            'client_id': self.app_id,
-            'client_secret': self.app_secret,
-            'fb_exchange_token': current_long_lived_token
-        }
+        return Workflow(checkpoint_store, workflow_key(method, self.app_id, self.page_id, arguments))
 
-        response = requests.get(url, params=params)
-        data = response.json()
+    def graph_get(self, url, **kwargs):
+        """
+        GET through the shared transport, charged to this app/page's rate budget.
+        """
+        return self.graph_request('GET', url, **kwargs)
 
-        if 'access_token' in data:
-            print(data['access_token'])
-            return data['access_token']
-        else:
-            print("Failed to refresh long-lived token:", data)
-            return None
+    def graph_post(self, url, **kwargs):
+        """
+        POST through the shared transport, charged to this app/page's rate budget.
+        """
+        return self.graph_request('POST', url, **kwargs)
+
+    def graph_request(self, method, url, **kwargs):
+        """
+        When Graph rejects the cached page token as expired or revoked, the
+        token is dropped from the cache and the call is sent once more with a
+        freshly loaded one.
+        """
+        response = transport.request(method, url, budget=self.budget_key, **kwargs)
+        token = rejected_token(response, kwargs)
+        if token is None or not token_cache.invalidate(self.token_key, token):
+            return response
+
+        print(f"Page access token for page {self.page_id} was rejected, loading a new one")
+        fresh_token = self.get_cached_page_access_token()
+        if not fresh_token or fresh_token == token:
+            return response
+        response.close()
+        return transport.request(method, url, budget=self.budget_key, **with_token(kwargs, token, fresh_token))
+
+    def exchange_long_lived_token(self, current_long_lived_token):
+        """
+        Exchange a long-lived user access token for a fresh one.
+        Returns a (token, expires_in) tuple, or (None, None) on failure.
+        """
+        response = self.graph_get(
+            f'{GRAPH_URL}/oauth/access_token',
+            params=token_exchange_params(self.app_id, self.app_secret, current_long_lived_token),
+        )
+        return exchanged_token(response.json())
+
+    def refresh_long_lived_token(self, current_long_lived_token):
+        """
+        Refresh a long-lived user access token before it expires.
+        """
+        token, _ = self.exchange_long_lived_token(current_long_lived_token)
+        return token
 
     def get_page_access_token(self, user_access_token):
         """
         Function to retrieve the Page Access Token using the user access token and page ID.
         """
 
-        api_url_token = f'https://graph.facebook.com/{self.page_id}?fields=access_token&access_token={user_access_token}'
-        
         try:
             # Make a GET request to the Facebook Graph API to fetch the Page Access Token
-            response = requests.get(api_url_token)
+            response = self.graph_get(
+                f'{GRAPH_URL}/{self.page_id}',
+                params=fields_params('access_token,instagram_business_account', user_access_token),
+                hedge=True,
+            )
             response.raise_for_status()  # Raise an exception if the request returns an HTTP error
+            return page_access_token_from(self.page_id, response.json())
 
-            # Parse the response as JSON and return the access token
-            data = response.json()
-            return data['access_token']
-        
         except requests.exceptions.RequestException as e:
             # Handle any exceptions (e.g., network issues, API errors) and print the error
             print("Error:", e)
             return None  # Return None if the access token retrieval fails
-        
-    def fb_post_images(self, posts: list):
+
+    def get_cached_page_access_token(self):
         """
-        Function to publish a post to the Facebook Page using the Page Access
-        Token.
+        Return the Page Access Token from the process-wide token cache,
+        exchanging the long-lived user token only on a miss or near expiry.
         """
+        return token_cache.get(self.token_key, self.long_lived_token_file, self._load_page_access_token)
 
-        new_long_lived_token = self.refresh_long_lived_token(self.long_lived_token_file)
-        page_access_token = self.get_page_access_token(new_long_lived_token)
-
-        media_fbids = []
-
-        for post in posts:
-            image_url = post['image_url']
-            upload_url = f"https://graph.facebook.com/{self.page_id}/photos"
-            upload_payload = {
-                'url': image_url,
-                'published': 'false',
-                'access_token': page_access_token
-            }
+    def _load_page_access_token(self, user_access_token):
+        long_lived_token, expires_in = self.exchange_long_lived_token(user_access_token)
+        if not long_lived_token:
+            return None
+        page_access_token = self.get_page_access_token(long_lived_token)
+        if not page_access_token:
+            return None
+        return long_lived_token, page_access_token, expires_in
 
-            upload_response = requests.post(upload_url, data=upload_payload)
-            try:
-                upload_data = upload_response.json()
-            except Exception as e:
-                print("Error parsing upload response:", upload_response.text)
-                continue
+    def fb_post_images(self, posts: list, prepare_only=False):
+        """
+        Function to publish a post to the Facebook Page using the Page Access
+        Token. Images are uploaded concurrently as unpublished photos, then
+        attached to a single feed post in their original order. Uploaded
+        media_fbids are checkpointed, so a retry only uploads what is missing,
+        and images this page uploaded before are reused from the media index.
+        With prepare_only=True it stops before the feed post.
+        """
 
-            if 'id' in upload_data:
-                media_fbids.append({'media_fbid': upload_data['id']})
-            else:
-                print("Failed to upload image:", upload_data)
+        page_access_token = self.get_cached_page_access_token()
+        workflow = self.workflow('fb_post_images', posts=posts)
+
+        images = checkpointed_media(workflow, posts, 'photo', 'media_fbid')
+        missing = self.preflight(posts, images, 'fb_image')
+        target = f"fb:{self.page_id}"
+        reused = self.reuse_media(target, workflow, posts, images, 'media_fbid', 'photo', page_access_token)
+        missing = [i for i in missing if images[i] is None]
+
+        uploaded = None
+        if GRAPH_BATCH and len(missing) > 1:
+            created = self.batch_create(
+                f"{self.page_id}/photos", [photo_payload(posts[i]['image_url']) for i in missing], page_access_token,
+            )
+            if created is not None:
+                uploaded = [
+                    photo_outcome(posts[i]['image_url'], media_fbid, error)
+                    for i, (media_fbid, error) in zip(missing, created)
+                ]
+        if uploaded is None:
+            uploaded = self.run_concurrently(
+                lambda i: self.fb_upload_unpublished_photo(posts[i]['image_url'], page_access_token),
+                missing,
+            )
+        record_created(target, workflow, posts, images, missing, uploaded, 'photo', 'media_fbid')
+
+        result = {'success': False, 'images': images}
+        if prepare_only:
+            return prepared(result, all('media_fbid' in image for image in images))
 
         # Final post with all images
-        if media_fbids:
-            post_url = f"https://graph.facebook.com/{self.page_id}/feed"
-            post_payload = {
-                'access_token': page_access_token,
-                'message': post['caption']
-            }
-
-            for i, media in enumerate(media_fbids):
-                post_payload[f'attached_media[{i}]'] = str(media)
-
-            final_response = requests.post(post_url, data=post_payload)
+        post_payload = feed_payload(posts, images, page_access_token)
+        if post_payload:
+            final_response = self.graph_post(f"{GRAPH_URL}/{self.page_id}/feed", data=post_payload)
             if final_response.status_code == 200:
                 print("🎉 Multi-image post published to Facebook!")
+                result['success'] = True
+                result['post_id'] = final_response.json().get('id')
+                finish_published(target, workflow, posts)
             else:
                 print("❌ Failed to publish multi-image post:", final_response.text)
-    
+                result['error'] = final_response.text
+                forget_reused(target, workflow, posts, reused, 'photo')
+
+        return result
 
-    def fb_upload_reel(self, video_url: str, caption: str = "") -> bool:
+    def fb_upload_unpublished_photo(self, image_url, page_access_token):
+        """
+        Upload a single photo to the Page without publishing it, so it can be
+        attached to a multi-image feed post.
+        """
+        try:
+            upload_response = self.graph_post(
+                f"{GRAPH_URL}/{self.page_id}/photos", data=photo_payload(image_url, page_access_token),
+            )
+            media_fbid, error = created_id(upload_response.json())
+        except Exception as e:
+            media_fbid, error = None, str(e)
+        return photo_outcome(image_url, media_fbid, error)
+
+    def batch_create(self, relative_url, payloads, page_access_token):
+        """
+        Create one object per payload under relative_url using Graph batch
+        requests. Returns an (id, error) pair per payload, or None when the
+        batch itself failed and the caller should fall back to single requests.
+        """
+        batch = GraphBatch(page_access_token, budget=self.budget_key)
+        for payload in payloads:
+            batch.add('POST', relative_url, payload)
+
+        try:
+            results = batch.execute()
+        except (BatchError, requests.exceptions.RequestException) as e:
+            print("Batch request failed, falling back to single requests:", e)
+            return None
+
+        return [created_id(item['body']) if item else (None, "Skipped by Graph batch") for item in results]
+
+    def ig_create_and_publish(self, instagram_account_id, media_payload, page_access_token):
+        """
+        Create a media container and publish it in a single batch request, with
+        media_publish referencing the container ID through JSONPath.
+        Returns a partial result dict, or None if the batch itself failed.
+        """
+        batch = GraphBatch(page_access_token, budget=self.budget_key)
+        batch.add('POST', f'{instagram_account_id}/media', media_payload, name='container')
+        batch.add('POST', f'{instagram_account_id}/media_publish',
+                  {'creation_id': '{result=container:$.id}'}, depends_on='container')
+
+        try:
+            container, published = batch.execute()
+        except (BatchError, requests.exceptions.RequestException) as e:
+            print("Batch request failed, falling back to single requests:", e)
+            return None
+
+        result = {'success': False}
+        creation_id, error = created_id(container['body'] if container else {})
+        if not creation_id:
+            self.check_instagram_account_error({'error': error})
+            result['error'] = error
+            return result
+        result['creation_id'] = creation_id
+
+        media_id, error = created_id(published['body'] if published else "media_publish was skipped")
+        if media_id:
+            result['success'] = True
+            result['media_id'] = media_id
+        else:
+            result['error'] = error
+        return result
+
+    def preflight(self, posts, outcomes, target):
+        """
+        Validate the images of posts that have no outcome yet, recording a
+        rejection for those that fail. Returns the indexes still to upload.
+        """
+        missing = [i for i, outcome in enumerate(outcomes) if outcome is None]
+        checked = self.run_concurrently(lambda i: preflight.validate(posts[i]['image_url'], target), missing)
+        for i, problems in zip(missing, checked):
+            if problems:
+                print("Image failed pre-flight validation:", posts[i]['image_url'], problems)
+                outcomes[i] = preflight.rejection(problems, image_url=posts[i]['image_url'])
+        return [i for i, outcome in enumerate(outcomes) if outcome is None]
+
+    def reuse_media(self, target, workflow, posts, outcomes, field, step, page_access_token):
+        """
+        Fill the outcomes of images already uploaded to `target` from the
+        media index, after one ?ids= lookup confirms the objects are still
+        usable. Objects held by another running post are left alone. Returns
+        the reused indexes.
+        """
+        found = media_index.claim(target, posts, outcomes, workflow.key)
+        if not found:
+            return []
+
+        try:
+            response = self.graph_get(f"{GRAPH_URL}/", params=reuse_params(found, field, page_access_token))
+            statuses = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print("Failed to check reusable media:", e)
+            media_index.release(target, posts, found)
+            return []
+        return apply_reuse(target, workflow, posts, outcomes, found, statuses, field, step)
+
+    def run_concurrently(self, func, items):
+        """
+        Apply func to every item on a bounded thread pool, preserving order.
+        """
+        if not items:
+            return []
+        workers = max(1, min(UPLOAD_CONCURRENCY, len(items)))
+        # Run each call in a copy of the caller's context so request tracing follows it
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda item: context.copy().run(func, item), items))
+
+    def fb_upload_reel(self, video_url: str, caption: str = "", prepare_only=False) -> dict:
         """
         Uploads a Reel video to a Facebook Page as a Reel post from an S3 URL.
         Requires video to follow Facebook's specifications for Reels.
+        Returns a result dict with 'success' and the reel's 'video_id'.
+        A retry reuses the checkpointed upload session and resumes the upload
+        from the offset Graph acknowledged. With prepare_only=True it stops
+        once the video is uploaded, before the finish phase publishes it.
+        When reel staging is configured the staged copy is relayed instead.
         """
-        new_long_lived_token = self.refresh_long_lived_token(self.long_lived_token_file)
-        page_access_token = self.get_page_access_token(new_long_lived_token)
+        problems = preflight.validate(video_url, 'fb_reel')
+        if problems:
+            print("❌ Video failed pre-flight validation:", problems)
+            return preflight.rejection(problems, success=False)
 
-        # Step 1: Initialize upload
-        start_upload_url = f"https://graph.facebook.com/v22.0/{self.page_id}/video_reels"
-        start_payload = {
-            "upload_phase": "start",
-            "access_token": page_access_token
-        }
-
-        start_response = requests.post(start_upload_url, json=start_payload)
-        if start_response.status_code != 200:
-            print("❌ Failed to start video upload:", start_response.text)
-            return False
+        page_access_token = self.get_cached_page_access_token()
+        workflow = self.workflow('fb_upload_reel', video_url=video_url, caption=caption)
+        reels_url = f"{GRAPH_URL}/v22.0/{self.page_id}/video_reels"
 
-        upload_data = start_response.json()
+        # Step 1: Initialize upload
+        upload_data = workflow.get('start')
+        resumed = upload_data is not None
+        if upload_data is None:
+            # A resumed upload must keep relaying the same bytes, so the source is checkpointed
+            source = staging_area.stage(video_url, 'fb_reel')
+            start_response = self.graph_post(reels_url, json=reel_start_payload(page_access_token))
+            if start_response.status_code != 200:
+                print("❌ Failed to start video upload:", start_response.text)
+                return {'success': False, 'error': start_response.text}
+
+            upload_data = start_response.json()
+            upload_data = workflow.save('start', {
+                'video_id': upload_data["video_id"], 'upload_url': upload_data["upload_url"], 'source': source,
+            })
         video_id = upload_data["video_id"]
-        upload_url = upload_data["upload_url"]
+        result = {'success': False, 'video_id': video_id}
 
-        # Step 2: Download video from S3 and upload to rupload.facebook.com
-        try:
-            # Download video from S3 URL
-            video_response = requests.get(video_url, stream=True)
-            if video_response.status_code != 200:
-                print("❌ Failed to download video from S3:", video_response.status_code)
-                return False
-
-            # Get video data and file size
-            video_data = video_response.content
-            file_size = len(video_data)
-
-            headers = {
-                "Authorization": f"OAuth {page_access_token}",
-                "offset": "0",
-                "file_size": str(file_size),
-                "Content-Type": "application/octet-stream"
-            }
-
-            upload_response = requests.post(upload_url, headers=headers, data=video_data)
-            if upload_response.status_code != 200:
-                print("❌ Video upload failed:", upload_response.text)
-                return False
-        except Exception as e:
-            print("❌ Exception during video download/upload:", e)
-            return False
+        # Step 2: Stream the video from S3 to rupload.facebook.com in chunks
+        if not workflow.get('upload'):
+            offset = self._uploaded_offset(video_id, page_access_token, 0) if resumed else 0
+            try:
+                error = self.relay_video(
+                    upload_data.get('source', video_url), upload_data["upload_url"], video_id, page_access_token,
+                    offset=offset,
+                )
+            except Exception as e:
+                print("❌ Exception during video download/upload:", e)
+                error = str(e)
+            if error:
+                result['error'] = error
+                self.discard_failed_upload(workflow, video_id, page_access_token)
+                return result
+            workflow.save('upload', True)
+        if prepare_only:
+            return prepared(result, True)
 
         # Step 3: Finish upload
-        finish_url = f"https://graph.facebook.com/v22.0/{self.page_id}/video_reels"
-        finish_payload = {
-            "upload_phase": "finish",
-            "video_id": video_id,
-            "access_token": page_access_token,
-            "video_state":"PUBLISHED"
-        }
-        if caption:
-            finish_payload["description"] = caption
-
-        finish_response = requests.post(finish_url, json=finish_payload)
+        finish_response = self.graph_post(reels_url, json=reel_finish_payload(video_id, caption, page_access_token))
         if finish_response.status_code == 200:
             print("🎉 Reel successfully uploaded to Facebook!")
-            return True
+            result['success'] = True
+            workflow.finish()
         else:
             print("❌ Failed to finalize reel upload:", finish_response.text)
-            return False
-                            
+            result['error'] = finish_response.text
+            self.discard_failed_upload(workflow, video_id, page_access_token)
+        return result
+
+    def discard_failed_upload(self, workflow, video_id, page_access_token):
+        """
+        Look up the upload session of a failed reel and drop its checkpoints
+        if it is gone, see discard_failed_session().
+        """
+        try:
+            response = self.graph_get(f"{GRAPH_URL}/v22.0/{video_id}", params=fields_params('status', page_access_token))
+            data = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print("Failed to read upload session status:", e)
+            return
+        discard_failed_session(workflow, video_id, data)
+
+    def relay_video(self, video_url, upload_url, video_id, page_access_token, offset=0):
+        """
+        Pipe the source video into a rupload session one chunk at a time, so at
+        most UPLOAD_CHUNK_SIZE bytes are held in memory. After a failed chunk the
+        acknowledged offset is read back from Graph and both the download
+        (via a Range request) and the upload resume from there.
+        Returns None on success or an error message.
+        """
+        path = staging_area.local_path(video_url)
+        if path:
+            return self.relay_file(path, upload_url, video_id, page_access_token, offset)
+
+        file_size = None
+        retries = 0
+
+        while file_size is None or offset < file_size:
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            with transport.get(video_url, stream=True, headers=headers) as video_response:
+                # Resuming a session whose upload had already completed
+                if video_response.status_code == 416 and offset and file_size is None:
+                    return None
+                if video_response.status_code not in (200, 206):
+                    print("❌ Failed to download video from S3:", video_response.status_code)
+                    return f"Video download failed with status {video_response.status_code}"
+
+                if file_size is None:
+                    file_size = content_length(video_response.headers, video_response.status_code)
+                    if file_size is None:
+                        return "Video source did not report a Content-Length"
+                # A source that ignores Range restarts at byte 0
+                skip = offset if video_response.status_code == 200 else 0
+
+                try:
+                    for chunk in self._read_chunks(video_response, skip):
+                        upload_response = self.graph_post(
+                            upload_url, headers=chunk_headers(page_access_token, offset, file_size), data=chunk,
+                        )
+                        if upload_response.status_code != 200:
+                            raise IOError(upload_response.text)
+                        offset += len(chunk)
+                except (IOError, requests.exceptions.RequestException) as e:
+                    retries += 1
+                    print(f"❌ Video upload failed at offset {offset}: {e}")
+                    if retries > UPLOAD_MAX_RETRIES:
+                        return str(e)
+                    offset = self._uploaded_offset(video_id, page_access_token, offset)
+                    continue
+
+            if offset < file_size:
+                return f"Video source ended after {offset} of {file_size} bytes"
+        return None
+
+    def relay_file(self, path, upload_url, video_id, page_access_token, offset=0):
+        """
+        relay_video() for a reel staged on this host, read from disk instead
+        of downloading it again from its public URL.
+        """
+        file_size = os.path.getsize(path)
+        retries = 0
+
+        while offset < file_size:
+            try:
+                chunk = file_chunk(path, offset)
+                if not chunk:
+                    return f"Video source ended after {offset} of {file_size} bytes"
+                upload_response = self.graph_post(
+                    upload_url, headers=chunk_headers(page_access_token, offset, file_size), data=chunk,
+                )
+                if upload_response.status_code != 200:
+                    raise IOError(upload_response.text)
+                offset += len(chunk)
+            except (IOError, requests.exceptions.RequestException) as e:
+                retries += 1
+                print(f"❌ Video upload failed at offset {offset}: {e}")
+                if retries > UPLOAD_MAX_RETRIES:
+                    return str(e)
+                offset = self._uploaded_offset(video_id, page_access_token, offset)
+        return None
+
+    def _read_chunks(self, response, skip=0):
+        buffer = bytearray()
+        for data in response.iter_content(chunk_size=UPLOAD_CHUNK_SIZE):
+            if skip:
+                dropped = min(skip, len(data))
+                data = data[dropped:]
+                skip -= dropped
+            buffer.extend(data)
+            if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                yield bytes(buffer[:UPLOAD_CHUNK_SIZE])
+                del buffer[:UPLOAD_CHUNK_SIZE]
+        if buffer:
+            yield bytes(buffer)
+
+    def _uploaded_offset(self, video_id, page_access_token, fallback):
+        """
+        Ask Graph how many bytes of the upload it has acknowledged.
+        """
+        try:
+            response = self.graph_get(f"{GRAPH_URL}/v22.0/{video_id}", params=fields_params('status', page_access_token))
+            return acknowledged_offset(response.json(), fallback)
+        except Exception as e:
+            print("Failed to read upload offset:", e)
+            return fallback
+
     def get_instagram_account_id(self, page_access_token):
         """
         Function to get the Instagram Business Account ID linked to the Facebook Page.
+        The page -> account mapping is memoized in the shared ig_account_cache.
         """
-        url = f'https://graph.facebook.com/{self.page_id}?fields=instagram_business_account&access_token={page_access_token}'
-        
-        response = requests.get(url)
-        data = response.json()
-        if 'instagram_business_account' in data:
-            return data['instagram_business_account']['id']
-        else:
-            print("Instagram Business Account not found:", data)
-            return None
+        cached_id = ig_account_cache.get(self.page_id)
+        if cached_id:
+            return cached_id
+
+        response = self.graph_get(
+            f'{GRAPH_URL}/{self.page_id}', params=fields_params('instagram_business_account', page_access_token), hedge=True,
+        )
+        return instagram_account_from(self.page_id, response.json())
 
-    def ig_post_carousel(self, posts: list):
+    def check_instagram_account_error(self, data):
+        return check_instagram_account_error(self.page_id, data)
+
+    def ig_post_carousel(self, posts: list, prepare_only=False):
         """
         Function to publish a carousel to the Instagram Business Account.
+        Carousel items are created concurrently; the per-item outcome is
+        reported under 'items' in the returned result. Item and carousel
+        container IDs are checkpointed so a retry resumes where it failed, and
+        item containers made for the same images before are reused from the
+        media index. With prepare_only=True it stops before media_publish.
         """
-        post_posted = False
+        result = {'success': False, 'items': []}
 
-        new_long_lived_token = self.refresh_long_lived_token(self.long_lived_token_file)
-        page_access_token = self.get_page_access_token(new_long_lived_token)
+        page_access_token = self.get_cached_page_access_token()
         instagram_account_id = self.get_instagram_account_id(page_access_token)
 
         if not instagram_account_id:
             print("Instagram account ID not found.")
-            return False
-
-        # Step 1: Upload each image with is_carousel_item=true
-        creation_ids = []
-
-        for post in posts:
-            image_url = post['image_url']
-            create_image_url = f'https://graph.facebook.com/{instagram_account_id}/media'
-            image_payload = {
-                'image_url': image_url,
-                'is_carousel_item': 'true',
-                'access_token': page_access_token
-            }
-
-            img_response = requests.post(create_image_url, data=image_payload)
+            result['error'] = "Instagram account ID not found"
+            return result
 
-            try:
-                img_data = img_response.json()
-            except Exception as e:
-                print("Failed to parse image response:", img_response.text)
-                continue
+        workflow = self.workflow('ig_post_carousel', posts=posts)
 
-            if 'id' in img_data:
-                creation_ids.append(img_data['id'])
-            else:
-                print("Image upload failed:", img_data)
+        # Step 1: Upload each image with is_carousel_item=true
+        items = checkpointed_media(workflow, posts, 'item', 'creation_id')
+        missing = self.preflight(posts, items, 'ig_image')
+        target = f"ig:{instagram_account_id}"
+        reused = self.reuse_media(target, workflow, posts, items, 'creation_id', 'item', page_access_token)
+        missing = [i for i in missing if items[i] is None]
+
+        created_items = None
+        if GRAPH_BATCH and len(missing) > 1:
+            created = self.batch_create(
+                f"{instagram_account_id}/media", [carousel_item_payload(posts[i]['image_url']) for i in missing],
+                page_access_token,
+            )
+            if created is not None:
+                created_items = [
+                    item_outcome(self.page_id, posts[i]['image_url'], creation_id, error)
+                    for i, (creation_id, error) in zip(missing, created)
+                ]
+        if created_items is None:
+            created_items = self.run_concurrently(
+                lambda i: self.ig_create_carousel_item(instagram_account_id, posts[i]['image_url'], page_access_token),
+                missing,
+            )
+        record_created(target, workflow, posts, items, missing, created_items, 'item', 'creation_id')
+        result['items'] = items
+        creation_ids = [item['creation_id'] for item in items if 'creation_id' in item]
 
         if not creation_ids:
             print("No images were uploaded.")
-            return False
+            result['error'] = "No images were uploaded"
+            return result
 
         # Step 2: Create carousel container
-        create_carousel_url = f'https://graph.facebook.com/{instagram_account_id}/media'
-        carousel_payload = {
-            'media_type': 'CAROUSEL',
-            'children': ','.join(creation_ids),
-            'caption': posts[0]['caption'] if posts else '',
-            'access_token': page_access_token
-        }
-
-        carousel_response = requests.post(create_carousel_url, data=carousel_payload)
-
-        try:
-            carousel_data = carousel_response.json()
-        except Exception as e:
-            print("Failed to parse carousel response:", carousel_response.text)
-            return False
-
-        if 'id' not in carousel_data:
-            print("Carousel creation failed:", carousel_data)
-            return False
-
-        carousel_id = carousel_data['id']
+        carousel_id = workflow.get('container')
+        if carousel_id is None:
+            if GRAPH_BATCH and not prepare_only:
+                published = self.ig_create_and_publish(
+                    instagram_account_id, carousel_payload(posts, creation_ids), page_access_token,
+                )
+                if published is not None:
+                    if published['success']:
+                        print("🎉 Carousel successfully published to Instagram!")
+                        finish_published(target, workflow, posts)
+                    else:
+                        print("❌ Failed to publish carousel:", published.get('error'))
+                        if published.get('creation_id'):
+                            workflow.save('container', published['creation_id'])
+                            self.discard_dead_carousel(target, workflow, items, published['creation_id'])
+                        else:
+                            forget_reused(target, workflow, posts, reused, 'item')
+                    result.update(published)
+                    return result
+
+            carousel_response = self.graph_post(
+                f'{GRAPH_URL}/{instagram_account_id}/media', data=carousel_payload(posts, creation_ids, page_access_token),
+            )
+            try:
+                carousel_id, error = created_id(carousel_response.json())
+            except ValueError:
+                print("Failed to parse carousel response:", carousel_response.text)
+                result['error'] = carousel_response.text
+                return result
+
+            if not carousel_id:
+                print("Carousel creation failed:", error)
+                self.check_instagram_account_error({'error': error})
+                forget_reused(target, workflow, posts, reused, 'item')
+                result['error'] = error
+                return result
+
+            workflow.save('container', carousel_id)
+        result['creation_id'] = carousel_id
+        if prepare_only:
+            return prepared(result, len(creation_ids) == len(posts))
 
         # Step 3: Publish carousel
-        publish_url = f'https://graph.facebook.com/{instagram_account_id}/media_publish'
-        publish_payload = {
-            'creation_id': carousel_id,
-            'access_token': page_access_token
-        }
-
-        publish_response = requests.post(publish_url, data=publish_payload)
-
-        if publish_response.status_code == 200:
+        result.update(self.ig_publish_container(instagram_account_id, carousel_id, page_access_token))
+        if result['success']:
             print("🎉 Carousel successfully published to Instagram!")
-            post_posted = True
+            finish_published(target, workflow, posts)
         else:
-            print(f"❌ Failed to publish carousel: {publish_response.text}")
+            self.discard_dead_carousel(target, workflow, items, carousel_id)
+
+        return result
+
+    def discard_dead_carousel(self, target, workflow, items, carousel_id):
+        """
+        discard_dead_container() for a carousel, dropping its item
+        containers along with it.
+        """
+        if self.discard_dead_container(workflow, carousel_id) in ('ERROR', 'EXPIRED'):
+            forget_items(target, workflow, items)
 
-        return post_posted
+    def ig_create_carousel_item(self, instagram_account_id, image_url, page_access_token):
+        """
+        Create a single carousel item container for an image.
+        """
+        try:
+            img_response = self.graph_post(
+                f'{GRAPH_URL}/{instagram_account_id}/media', data=carousel_item_payload(image_url, page_access_token),
+            )
+            creation_id, error = created_id(img_response.json())
+        except Exception as e:
+            creation_id, error = None, str(e)
+        return item_outcome(self.page_id, image_url, creation_id, error)
 
-    def ig_post_image(self, image_url: str, caption: str = ""):
+    def ig_post_image(self, image_url: str, caption: str = "", prepare_only=False):
         """
         Function to publish an image to the Instagram Business Account.
+        Returns a result dict with 'success', 'creation_id' and 'media_id'.
+        With prepare_only=True it stops before media_publish.
         """
-        post_posted = False
+        result = {'success': False}
 
-        new_long_lived_token = self.refresh_long_lived_token(self.long_lived_token_file)
-        page_access_token = self.get_page_access_token(new_long_lived_token)
+        page_access_token = self.get_cached_page_access_token()
         instagram_account_id = self.get_instagram_account_id(page_access_token)
 
         if not instagram_account_id:
             print("Instagram account ID not found.")
-            return False
-
-        # Step 1: Create a Media Object
-        create_media_url = f'https://graph.facebook.com/{instagram_account_id}/media'
-        media_payload = {
-            'image_url': image_url,
-            'caption': caption,
-            'access_token': page_access_token
-        }
-
-        media_response = requests.post(create_media_url, data=media_payload)
-        media_data = media_response.json()
-
-        if 'id' in media_data:
-            creation_id = media_data['id']
-
-            # Step 2: Publish the Media Object
-            publish_url = f'https://graph.facebook.com/{instagram_account_id}/media_publish'
-            publish_payload = {
-                'creation_id': creation_id,
-                'access_token': page_access_token
-            }
-
-            publish_response = requests.post(publish_url, data=publish_payload)
-
-            if publish_response.status_code == 200:
-                print("Post successfully published to Instagram!")
-                post_posted = True
-            else:
-                print(f"Failed to publish post: {publish_response.status_code}")
-                print(publish_response.json())
+            result['error'] = "Instagram account ID not found"
+            return result
+
+        problems = preflight.validate(image_url, 'ig_image')
+        if problems:
+            print("Image failed pre-flight validation:", problems)
+            return preflight.rejection(problems, success=False)
+
+        workflow = self.workflow('ig_post_image', image_url=image_url, caption=caption)
+
+        # Step 1: Create a Media Object, unless a previous attempt already did
+        creation_id = workflow.get('container')
+        if creation_id is None:
+            media_response = self.graph_post(
+                f'{GRAPH_URL}/{instagram_account_id}/media', data=image_payload(image_url, caption, page_access_token),
+            )
+            creation_id, error = created_id(media_response.json())
+            if not creation_id:
+                print("Failed to create media object:", error)
+                self.check_instagram_account_error({'error': error})
+                result['error'] = error
+                return result
+            workflow.save('container', creation_id)
+
+        result['creation_id'] = creation_id
+        if prepare_only:
+            return prepared(result, True)
+
+        # Step 2: Publish the Media Object
+        result.update(self.ig_publish_container(instagram_account_id, creation_id, page_access_token))
+        if result['success']:
+            workflow.finish()
         else:
-            print("Failed to create media object:", media_data)
-            
-        return post_posted
+            self.discard_dead_container(workflow, creation_id)
+        return result
 
-    def ig_upload_reel(self, video_url, video_caption):
+    def ig_upload_reel(self, video_url, video_caption, wait=True, prepare_only=False):
+        """
+        Function to publish a Reel to the Instagram Business Account.
+        Returns a result dict with 'success', 'creation_id' and 'media_id'.
+        With wait=False it returns as soon as the container is created and the
+        shared reel poller publishes it in the background. With
+        prepare_only=True it stops once the container is created, leaving
+        Instagram to process the video until the publish runs. When reel
+        staging is configured Instagram fetches the staged copy.
+        """
+        result = {'success': False}
 
-        new_long_lived_token = self.refresh_long_lived_token(self.long_lived_token_file)
-        page_access_token = self.get_page_access_token(new_long_lived_token)
+        page_access_token = self.get_cached_page_access_token()
 
         # Get Instagram account ID
         try:
             instagram_account_id = self.get_instagram_account_id(page_access_token)
             if not instagram_account_id:
                 print("Failed to get Instagram account ID.")
-                return False
+                result['error'] = "Instagram account ID not found"
+                return result
         except Exception as e:
             print(f"Error getting Instagram account ID: {str(e)}")
-            return False
+            result['error'] = str(e)
+            return result
 
-        try:
-            # Create media container
-            create_media_url = f"https://graph.facebook.com/v20.0/{instagram_account_id}/media"
-            media_payload = {
-                "video_url": video_url,
-                "caption": video_caption,
-                "media_type": "REELS",
-                "share_to_feed": "true",  # Ensure Reel appears in feed
-                "access_token": page_access_token
-            }
-
-            media_response = requests.post(create_media_url, data=media_payload)
-            media_data = media_response.json()
-
-            if media_response.status_code != 200 or "id" not in media_data:
-                print(f"Failed to create media object: {json.dumps(media_data, indent=2)}")
-                print(f"Status Code: {media_response.status_code}")
-                return
-            
-            creation_id = media_data["id"]
-
-            # Poll for media processing status
-            status_url = f"https://graph.facebook.com/{creation_id}?fields=status_code,status&access_token={page_access_token}"
-            for attempt in range(50):  # Up to ~250 seconds
-                time.sleep(5)
-                status_response = requests.get(status_url)
-                status_data = status_response.json()
-
-                status_code = status_data.get("status_code")
-                print(f"Attempt {attempt + 1}: Status - {status_code}")
-
-                if status_code == "FINISHED":
-                    break
-                elif status_code == "ERROR":
-                    print(f"Media processing failed: {json.dumps(status_data, indent=2)}")
-                    return False
-                elif status_response.status_code != 200:
-                    print(f"Polling error: {json.dumps(status_data, indent=2)}")
-                    return False
-            else:
-                print("Media processing timed out after 50 seconds.")
-                return False
-
-            # Publish the Reel
-            publish_url = f"https://graph.facebook.com/v20.0/{instagram_account_id}/media_publish"
-            publish_payload = {
-                "creation_id": creation_id,
-                "access_token": page_access_token
-            }
-
-            publish_response = requests.post(publish_url, data=publish_payload)
-            publish_data = publish_response.json()
-
-            if publish_response.status_code == 200 and "id" in publish_data:
-                print("Reel successfully published to Instagram!")
-                return True
-            else:
-                print(f"Failed to publish Reel: {json.dumps(publish_data, indent=2)}")
-                print(f"Status Code: {publish_response.status_code}")
-                return False
+        problems = preflight.validate(video_url, 'ig_reel')
+        if problems:
+            print("Video failed pre-flight validation:", problems)
+            return preflight.rejection(problems, success=False)
 
-        except Exception as e:
-            print(f"Error processing post {post_url}: {str(e)}")
-            return False
+        workflow = self.workflow('ig_upload_reel', video_url=video_url, video_caption=video_caption)
 
-    # Step 1: Get the hashtag ID
-    def post_comments_about_hashtag(self, hashtag):
         try:
-            current_long_lived_token = self.read_access_token()
+            # Create media container, or pick up the one a previous attempt created
+            creation_id = workflow.get('container')
+            if creation_id is None:
+                media_response = self.graph_post(
+                    f"{GRAPH_URL}/v20.0/{instagram_account_id}/media",
+                    data=reel_payload(staging_area.stage(video_url, 'ig_reel'), video_caption, page_access_token),
+                )
+                creation_id, error = created_id(media_response.json())
+                if not creation_id:
+                    print(f"Failed to create media object: {json.dumps(error, indent=2)}")
+                    print(f"Status Code: {media_response.status_code}")
+                    self.check_instagram_account_error({'error': error})
+                    result['error'] = error
+                    return result
+
+                workflow.save('container', creation_id)
+            result['creation_id'] = creation_id
+            if prepare_only:
+                return prepared(result, True)
+
+            # Hand the container to the shared poller, which publishes it once processing finishes
+            future = reel_poller.submit(
+                creation_id,
+                page_access_token,
+                lambda creation_id: self.ig_publish_container(instagram_account_id, creation_id, page_access_token),
+            )
+            future.add_done_callback(lambda future: finish_reel_workflow(workflow, future.result()))
+            if not wait:
+                result['success'] = True
+                result['status'] = 'IN_PROGRESS'
+                return result
+
+            result.update(future.result())
+            return result
+
         except Exception as e:
-            print(f"Error reading access token: {str(e)}")
-            return False
+            print(f"Error processing post {video_url}: {str(e)}")
+            result['error'] = str(e)
+            return result
 
-        if not current_long_lived_token:
-            print("No valid access token found.")
-            return False
+    def ig_publish_container(self, instagram_account_id, creation_id, page_access_token):
+        """
+        Publish a processed media container with media_publish.
+        """
+        publish_response = self.graph_post(
+            f"{GRAPH_URL}/v20.0/{instagram_account_id}/media_publish", data=publish_payload(creation_id, page_access_token),
+        )
+        return publish_result(publish_response, creation_id)
 
-        # Refresh long-lived token
-        try:
-            new_long_lived_token = self.refresh_long_lived_token(current_long_lived_token)
-            if not new_long_lived_token:
-                print("Failed to refresh long-lived token.")
-                return False
-            self.save_access_token(new_long_lived_token)
-        except Exception as e:
-            print(f"Error refreshing token: {str(e)}")
-            return False
+    def ig_prepare(self, method, **arguments):
+        """
+        Create the containers of an Instagram publish without publishing
+        them, waiting for a reel to finish processing. Returns a result dict
+        with 'success' and the 'creation_id' that is ready for media_publish.
+        """
+        result = getattr(self, method)(**arguments, prepare_only=True)
+        if not result.get('success') or method != 'ig_upload_reel':
+            return result
+
+        future = reel_poller.submit(
+            result['creation_id'],
+            self.get_cached_page_access_token(),
+            lambda creation_id: {'success': True, 'creation_id': creation_id},
+        )
+        processed = future.result()
+        if not processed['success']:
+            self.workflow(method, **arguments).discard('container')
+            result.update(processed)
+        return result
+
+    def forget_published_items(self, posts):
+        """
+        Drop the item containers of a carousel published by ig_commit from
+        the media index.
+        """
+        instagram_account_id = self.get_instagram_account_id(self.get_cached_page_access_token())
+        if instagram_account_id:
+            media_index.published(f"ig:{instagram_account_id}", [post['image_url'] for post in posts])
 
-        # Get page access token
-        try:
-            page_access_token = self.get_page_access_token(new_long_lived_token)
-            if not page_access_token:
-                print("Failed to get page access token.")
-                return False
-        except Exception as e:
-            print(f"Error getting page access token: {str(e)}")
-            return False
+    def ig_commit(self, creation_id):
+        """
+        Publish a container made by ig_prepare: a single media_publish call.
+        """
+        page_access_token = self.get_cached_page_access_token()
+        instagram_account_id = self.get_instagram_account_id(page_access_token)
+        if not instagram_account_id:
+            return {'success': False, 'creation_id': creation_id, 'error': "Instagram account ID not found"}
+        return self.ig_publish_container(instagram_account_id, creation_id, page_access_token)
 
-        # Get Instagram account ID
+    def discard_dead_container(self, workflow, creation_id):
+        """
+        After a failed media_publish, look up the container and drop its
+        checkpoint if it is dead, see discard_if_dead(). Returns the
+        container's status_code.
+        """
         try:
-            instagram_account_id = self.get_instagram_account_id(page_access_token)
-            if not instagram_account_id:
-                print("Failed to get Instagram account ID.")
-                return False
-        except Exception as e:
-            print(f"Error getting Instagram account ID: {str(e)}")
-            return False
+            data = self.container_lookup(creation_id)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print("Failed to read container status:", e)
+            return None
+        return discard_if_dead(workflow, creation_id, data)
 
-        url = f"https://graph.facebook.com/v22.0/ig_hashtag_search"
-        params = {
-            "user_id": instagram_account_id,
-            "q": hashtag,
-            "access_token": page_access_token
-        }
-        response = requests.get(url, params=params)
-        data = response.json()
-        if data.get("data") and len(data["data"]) > 0:
-            hashtag_id = data["data"][0]["id"]
-        else:
-            print(f"Hashtag '{hashtag}' not found.")
-            return
-        
-        if hashtag_id:
-            url = f"https://graph.facebook.com/v22.0/{hashtag_id}/recent_media"
-            params = {
-                "user_id": instagram_account_id,
-                "fields": "id,caption,like_count,permalink,media_type",
-                "access_token": page_access_token
-            }
-            response = requests.get(url, params=params)
-            data = response.json()
-            recent_media_with_hashtag = data.get("data", [])
-            if not recent_media_with_hashtag:
-                print("No media found for the hashtag.")
-                return
-
-            # Sort media by like_count to get "top" posts
-            sorted_media = sorted(recent_media_with_hashtag, key=lambda x: x.get("like_count", 0), reverse=True)
-
-            # Process top 5 media (or all if fewer than 5)
-            top_media = sorted_media[:5]
-            print(top_media)
-            for media in top_media:
-                media_id = media["id"]
-                caption = media.get("caption", "No caption")
-                like_count = media.get("like_count", 0)
-                permalink = media.get("permalink", "")
-                media_type = media.get("media_type", "")
-
-                print(f"\nMedia ID: {media_id}")
-                print(f"Permalink: {permalink}")
-
-                # Post a comment
-                comment_result = self.post_comment(media_id, "Good post", page_access_token)
-                if "id" in comment_result:
-                    print(f"Comment posted successfully: {comment_result}")
-                else:
-                    print(f"Failed to post comment: {comment_result}")
-
-
-    # Step 3: Post a comment on a media object
-    def post_comment(self,media_id, comment_message, access_token):
-        url = f"https://graph.facebook.com/{media_id}/comments?message={comment_message}"
+    def container_status(self, creation_id):
+        """
+        status_code of a media container (IN_PROGRESS, FINISHED, ERROR, EXPIRED,
+        PUBLISHED), or None if it could not be read.
+        """
+        data = self.container_lookup(creation_id)
+        return data.get('status_code') if isinstance(data, dict) else None
+
+    def container_lookup(self, creation_id):
+        response = self.graph_get(
+            f"{GRAPH_URL}/{creation_id}", params=fields_params('status_code', self.get_cached_page_access_token()),
+        )
+        return response.json()
+
+    def post_comments_about_hashtag(self, hashtag, message=DEFAULT_COMMENT, limit=5, edges=HASHTAG_EDGES):
+        """
+        Comment on the top and recent media of a hashtag that this account has
+        not commented on yet. See hashtags.engage_hashtag for the pipeline.
+        """
+        return engage_hashtag(self, hashtag, message, limit=limit, edges=edges)
+
+    def post_comment(self, media_id, comment_message, access_token):
+        """
+        Post a comment on an Instagram media object.
+        """
+        url = f"{GRAPH_URL}/{media_id}/comments"
         params = {
+            "message": comment_message,
             "access_token": access_token
         }
-        response = requests.post(url, params=params)
-        return response.json()
\ No newline at end of file
+        response = self.graph_post(url, params=params)
+        return response.json()
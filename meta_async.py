@@ -0,0 +1,631 @@
+import asyncio
+import json
+import os
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+import transport
+from transport import GRAPH_URL
+import preflight
+from staging import staging_area
+from cache import TokenCache, token_cache, ig_account_cache
+from checkpoints import Workflow, checkpoint_store, workflow_key
+from hashtags import engage_hashtag_async, DEFAULT_COMMENT, HASHTAG_EDGES
+from media_index import media_index
+from meta import (
+    content_length, finish_reel_workflow, rejected_token, with_token,
+    acknowledged_offset, apply_reuse, carousel_item_payload, carousel_payload, check_instagram_account_error,
+    checkpointed_media, chunk_headers, created_id, discard_failed_session, discard_if_dead, exchanged_token,
+    feed_payload, fields_params, file_chunk, finish_published, forget_items, forget_reused, image_payload, instagram_account_from,
+    item_outcome, page_access_token_from, photo_outcome, photo_payload, publish_payload, publish_result,
+    record_created, reel_finish_payload, reel_payload, reel_start_payload, reuse_params, token_exchange_params,
+    UPLOAD_CONCURRENCY, UPLOAD_CHUNK_SIZE, UPLOAD_MAX_RETRIES,
+)
+from poller import reel_poller
+from breaker import circuit_breakers
+from ratelimit import rate_governor
+
+_client = None
+# In-flight token loads per cache key, shared by every poster on the event loop
+_token_loads = {}
+
+
+def get_client():
+    """
+    Shared keep-alive AsyncClient, sized and timed like the sync transport.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=transport.POOL_SIZE * 10, max_keepalive_connections=transport.POOL_SIZE),
+            timeout=httpx.Timeout(transport.READ_TIMEOUT, connect=transport.CONNECT_TIMEOUT),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+class AsyncPostToFacebookPage():
+    """
+    asyncio counterpart of PostToFacebookPage built on httpx.
+
+    The publish methods mirror the sync class and return the same result
+    dicts. Token and Instagram account caches, rate budgets, publish
+    checkpoints and the reel poller are shared with the sync code, so both can
+    serve the same pages from one process.
+    """
+
+    def __init__(self, app_id, app_secret, page_id, long_lived_token_file):
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self.page_id = page_id
+        self.long_lived_token_file = long_lived_token_file
+        self.token_key = TokenCache.make_key(app_id, page_id, long_lived_token_file)
+
+    def __repr__(self):
+        # Never render the app secret or tokens, e.g. in tracebacks and logs
+        return f"AsyncPostToFacebookPage(app_id={self.app_id!r}, page_id={self.page_id!r})"
+
+    @property
+    def budget_key(self):
+        return (self.app_id, self.page_id)
+
+    def workflow(self, method, **arguments):
+        return Workflow(checkpoint_store, workflow_key(method, self.app_id, self.page_id, arguments))
+
+    async def request(self, method, url, governed=True, hedge=False, **kwargs):
+        """
+        Send a request on the shared client, paced and retried by the rate
+        governor and guarded by the circuit breakers like transport.request.
+        A rejected page token is replaced like in PostToFacebookPage.graph_request.
+        """
+        response = await self._request(method, url, governed, hedge, **kwargs)
+        token = rejected_token(response, kwargs)
+        if token is None or not token_cache.invalidate(self.token_key, token):
+            return response
+
+        print(f"Page access token for page {self.page_id} was rejected, loading a new one")
+        fresh_token = await self.get_cached_page_access_token()
+        if not fresh_token or fresh_token == token:
+            return response
+        return await self._request(method, url, governed, hedge, **with_token(kwargs, token, fresh_token))
+
+    async def _request(self, method, url, governed, hedge, **kwargs):
+        governed = governed and transport.is_graph_host(urlsplit(url).hostname or "")
+        breaker = transport.endpoint_class(method, url, kwargs.get('params'), kwargs.get('json'))
+        send = self._send_hedged if hedge and transport.HEDGE_DELAY > 0 and method == 'GET' else self._send
+        attempt = 0
+        while True:
+            if governed:
+                delay = rate_governor.delay_for(*self.budget_key)
+                if delay:
+                    await asyncio.sleep(delay)
+
+            circuit_breakers.before(breaker)
+            try:
+                response = await send(method, url, **kwargs)
+            except httpx.HTTPError:
+                circuit_breakers.record(breaker, False)
+                raise
+            except BaseException:
+                # Cancelled (e.g. a lost hedge) or failed on our side
+                circuit_breakers.release(breaker)
+                raise
+            circuit_breakers.record(breaker, response.status_code < 500)
+
+            if not governed:
+                return response
+            rate_governor.record(*self.budget_key, response.headers)
+            if attempt >= rate_governor.max_retries or not rate_governor.is_throttled(response):
+                return response
+            await asyncio.sleep(rate_governor.backoff(*self.budget_key, response, attempt))
+            attempt += 1
+
+    async def _send(self, method, url, **kwargs):
+        started = time.monotonic()
+        try:
+            response = await get_client().request(method, url, **kwargs)
+        except httpx.HTTPError:
+            transport.observe(method, url, None, started)
+            raise
+        transport.observe(
+            method, url, response.status_code, started,
+            error_code=transport.graph_error_code(response),
+            bytes_sent=len(response.request.content),
+            bytes_received=len(response.content),
+        )
+        return response
+
+    async def _send_hedged(self, method, url, **kwargs):
+        """
+        Async counterpart of transport._send_hedged: race a second request
+        against a first one that is slower than HEDGE_DELAY.
+        """
+        first = asyncio.ensure_future(self._send(method, url, **kwargs))
+        done, _ = await asyncio.wait({first}, timeout=transport.HEDGE_DELAY)
+        if done:
+            return first.result()
+
+        second = asyncio.ensure_future(self._send(method, url, **kwargs))
+        transport.count_hedge()
+        done, _ = await asyncio.wait({first, second}, return_when=asyncio.FIRST_COMPLETED)
+        if all(task.exception() is not None for task in done):
+            # The other attempt may still succeed
+            await asyncio.wait({first, second})
+        winner = next((task for task in (first, second) if task.done() and task.exception() is None), first)
+        loser = second if winner is first else first
+        loser.cancel()
+        if winner is second:
+            transport.count_hedge(won=True)
+        return winner.result()
+
+    async def exchange_long_lived_token(self, current_long_lived_token):
+        response = await self.request(
+            'GET', f'{GRAPH_URL}/oauth/access_token',
+            params=token_exchange_params(self.app_id, self.app_secret, current_long_lived_token),
+        )
+        return exchanged_token(response.json())
+
+    async def get_page_access_token(self, user_access_token):
+        try:
+            response = await self.request(
+                'GET', f'{GRAPH_URL}/{self.page_id}',
+                params=fields_params('access_token,instagram_business_account', user_access_token), hedge=True,
+            )
+            response.raise_for_status()
+            return page_access_token_from(self.page_id, response.json())
+        except httpx.HTTPError as e:
+            print("Error:", e)
+            return None
+
+    async def get_cached_page_access_token(self):
+        """
+        Page Access Token from the shared token cache. Concurrent misses for the
+        same key share one load and near-expiry entries refresh in the background.
+        """
+        key = self.token_key
+        page_access_token, long_lived_token, needs_refresh = token_cache.peek(key)
+        if page_access_token:
+            if needs_refresh and key not in _token_loads:
+                self._start_token_load(key, long_lived_token)
+            return page_access_token
+
+        task = _token_loads.get(key) or self._start_token_load(key, self.long_lived_token_file)
+        return await asyncio.shield(task)
+
+    def _start_token_load(self, key, user_access_token):
+        task = asyncio.ensure_future(self._load_page_access_token(key, user_access_token))
+        _token_loads[key] = task
+        task.add_done_callback(lambda _: _token_loads.pop(key, None))
+        return task
+
+    async def _load_page_access_token(self, key, user_access_token):
+        long_lived_token, expires_in = await self.exchange_long_lived_token(user_access_token)
+        page_access_token = await self.get_page_access_token(long_lived_token) if long_lived_token else None
+        if not page_access_token:
+            token_cache.record_error()
+            return None
+        return token_cache.put(key, long_lived_token, page_access_token, expires_in)
+
+    async def get_instagram_account_id(self, page_access_token):
+        cached_id = ig_account_cache.get(self.page_id)
+        if cached_id:
+            return cached_id
+
+        response = await self.request(
+            'GET', f'{GRAPH_URL}/{self.page_id}', params=fields_params('instagram_business_account', page_access_token),
+            hedge=True,
+        )
+        return instagram_account_from(self.page_id, response.json())
+
+    def check_instagram_account_error(self, data):
+        return check_instagram_account_error(self.page_id, data)
+
+    async def gather_bounded(self, func, items):
+        """
+        Run func over items with at most UPLOAD_CONCURRENCY in flight, preserving order.
+        """
+        semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+        async def run(item):
+            async with semaphore:
+                return await func(item)
+
+        return await asyncio.gather(*(run(item) for item in items))
+
+    async def preflight(self, posts, outcomes, target):
+        """
+        Async counterpart of PostToFacebookPage.preflight; probes run on worker threads.
+        """
+        missing = [i for i, outcome in enumerate(outcomes) if outcome is None]
+        checked = await self.gather_bounded(
+            lambda i: asyncio.to_thread(preflight.validate, posts[i]['image_url'], target), missing,
+        )
+        for i, problems in zip(missing, checked):
+            if problems:
+                print("Image failed pre-flight validation:", posts[i]['image_url'], problems)
+                outcomes[i] = preflight.rejection(problems, image_url=posts[i]['image_url'])
+        return [i for i, outcome in enumerate(outcomes) if outcome is None]
+
+    async def reuse_media(self, target, workflow, posts, outcomes, field, step, page_access_token):
+        """
+        Async counterpart of PostToFacebookPage.reuse_media.
+        """
+        found = media_index.claim(target, posts, outcomes, workflow.key)
+        if not found:
+            return []
+
+        try:
+            response = await self.request('GET', f"{GRAPH_URL}/", params=reuse_params(found, field, page_access_token))
+            statuses = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            print("Failed to check reusable media:", e)
+            media_index.release(target, posts, found)
+            return []
+        return apply_reuse(target, workflow, posts, outcomes, found, statuses, field, step)
+
+    async def create_object(self, url, payload):
+        """
+        POST payload to url and return (id, error).
+        """
+        try:
+            response = await self.request('POST', url, data=payload)
+            return created_id(response.json())
+        except (httpx.HTTPError, ValueError) as e:
+            return None, str(e)
+
+    async def fb_post_images(self, posts: list):
+        page_access_token = await self.get_cached_page_access_token()
+        workflow = self.workflow('fb_post_images', posts=posts)
+
+        images = checkpointed_media(workflow, posts, 'photo', 'media_fbid')
+        missing = await self.preflight(posts, images, 'fb_image')
+        target = f"fb:{self.page_id}"
+        reused = await self.reuse_media(target, workflow, posts, images, 'media_fbid', 'photo', page_access_token)
+        missing = [i for i in missing if images[i] is None]
+
+        async def upload(i):
+            media_fbid, error = await self.create_object(
+                f"{GRAPH_URL}/{self.page_id}/photos", photo_payload(posts[i]['image_url'], page_access_token),
+            )
+            return photo_outcome(posts[i]['image_url'], media_fbid, error)
+
+        record_created(target, workflow, posts, images, missing, await self.gather_bounded(upload, missing), 'photo', 'media_fbid')
+
+        result = {'success': False, 'images': images}
+        post_payload = feed_payload(posts, images, page_access_token)
+        if not post_payload:
+            return result
+
+        final_response = await self.request('POST', f"{GRAPH_URL}/{self.page_id}/feed", data=post_payload)
+        if final_response.status_code == 200:
+            print("🎉 Multi-image post published to Facebook!")
+            result['success'] = True
+            result['post_id'] = final_response.json().get('id')
+            finish_published(target, workflow, posts)
+        else:
+            print("❌ Failed to publish multi-image post:", final_response.text)
+            result['error'] = final_response.text
+            forget_reused(target, workflow, posts, reused, 'photo')
+        return result
+
+    async def fb_upload_reel(self, video_url: str, caption: str = "") -> dict:
+        problems = await asyncio.to_thread(preflight.validate, video_url, 'fb_reel')
+        if problems:
+            print("❌ Video failed pre-flight validation:", problems)
+            return preflight.rejection(problems, success=False)
+
+        page_access_token = await self.get_cached_page_access_token()
+        workflow = self.workflow('fb_upload_reel', video_url=video_url, caption=caption)
+        reels_url = f"{GRAPH_URL}/v22.0/{self.page_id}/video_reels"
+
+        upload_data = workflow.get('start')
+        resumed = upload_data is not None
+        if upload_data is None:
+            source = await asyncio.to_thread(staging_area.stage, video_url, 'fb_reel')
+            start_response = await self.request('POST', reels_url, json=reel_start_payload(page_access_token))
+            if start_response.status_code != 200:
+                print("❌ Failed to start video upload:", start_response.text)
+                return {'success': False, 'error': start_response.text}
+
+            upload_data = start_response.json()
+            upload_data = workflow.save('start', {
+                'video_id': upload_data["video_id"], 'upload_url': upload_data["upload_url"], 'source': source,
+            })
+        video_id = upload_data["video_id"]
+        result = {'success': False, 'video_id': video_id}
+
+        if not workflow.get('upload'):
+            offset = await self._uploaded_offset(video_id, page_access_token, 0) if resumed else 0
+            try:
+                error = await self.relay_video(
+                    upload_data.get('source', video_url), upload_data["upload_url"], video_id, page_access_token,
+                    offset=offset,
+                )
+            except Exception as e:
+                print("❌ Exception during video download/upload:", e)
+                error = str(e)
+            if error:
+                result['error'] = error
+                await self.discard_failed_upload(workflow, video_id, page_access_token)
+                return result
+            workflow.save('upload', True)
+
+        finish_response = await self.request('POST', reels_url, json=reel_finish_payload(video_id, caption, page_access_token))
+        if finish_response.status_code == 200:
+            print("🎉 Reel successfully uploaded to Facebook!")
+            result['success'] = True
+            workflow.finish()
+        else:
+            print("❌ Failed to finalize reel upload:", finish_response.text)
+            result['error'] = finish_response.text
+            await self.discard_failed_upload(workflow, video_id, page_access_token)
+        return result
+
+    async def discard_failed_upload(self, workflow, video_id, page_access_token):
+        """
+        Async counterpart of PostToFacebookPage.discard_failed_upload.
+        """
+        try:
+            response = await self.request(
+                'GET', f"{GRAPH_URL}/v22.0/{video_id}", params=fields_params('status', page_access_token),
+            )
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            print("Failed to read upload session status:", e)
+            return
+        discard_failed_session(workflow, video_id, data)
+
+    async def relay_video(self, video_url, upload_url, video_id, page_access_token, offset=0):
+        """
+        Async version of PostToFacebookPage.relay_video: chunked relay with
+        resume from the acknowledged offset. Returns None or an error message.
+        """
+        path = staging_area.local_path(video_url)
+        if path:
+            return await self.relay_file(path, upload_url, video_id, page_access_token, offset)
+
+        file_size = None
+        retries = 0
+
+        while file_size is None or offset < file_size:
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            async with get_client().stream('GET', video_url, headers=headers) as video_response:
+                if video_response.status_code == 416 and offset and file_size is None:
+                    return None
+                if video_response.status_code not in (200, 206):
+                    return f"Video download failed with status {video_response.status_code}"
+                if file_size is None:
+                    file_size = content_length(video_response.headers, video_response.status_code)
+                    if file_size is None:
+                        return "Video source did not report a Content-Length"
+                skip = offset if video_response.status_code == 200 else 0
+
+                try:
+                    async for chunk in video_response.aiter_bytes(UPLOAD_CHUNK_SIZE):
+                        if skip:
+                            dropped = min(skip, len(chunk))
+                            chunk, skip = chunk[dropped:], skip - dropped
+                            if not chunk:
+                                continue
+                        upload_response = await self.request(
+                            'POST', upload_url, headers=chunk_headers(page_access_token, offset, file_size), content=chunk,
+                        )
+                        if upload_response.status_code != 200:
+                            raise IOError(upload_response.text)
+                        offset += len(chunk)
+                except (IOError, httpx.HTTPError) as e:
+                    retries += 1
+                    print(f"❌ Video upload failed at offset {offset}: {e}")
+                    if retries > UPLOAD_MAX_RETRIES:
+                        return str(e)
+                    offset = await self._uploaded_offset(video_id, page_access_token, offset)
+                    continue
+
+            if offset < file_size:
+                return f"Video source ended after {offset} of {file_size} bytes"
+        return None
+
+    async def relay_file(self, path, upload_url, video_id, page_access_token, offset=0):
+        """
+        Async version of PostToFacebookPage.relay_file.
+        """
+        file_size = os.path.getsize(path)
+        retries = 0
+
+        while offset < file_size:
+            try:
+                chunk = await asyncio.to_thread(file_chunk, path, offset)
+                if not chunk:
+                    return f"Video source ended after {offset} of {file_size} bytes"
+                upload_response = await self.request(
+                    'POST', upload_url, headers=chunk_headers(page_access_token, offset, file_size), content=chunk,
+                )
+                if upload_response.status_code != 200:
+                    raise IOError(upload_response.text)
+                offset += len(chunk)
+            except (IOError, httpx.HTTPError) as e:
+                retries += 1
+                print(f"❌ Video upload failed at offset {offset}: {e}")
+                if retries > UPLOAD_MAX_RETRIES:
+                    return str(e)
+                offset = await self._uploaded_offset(video_id, page_access_token, offset)
+        return None
+
+    async def _uploaded_offset(self, video_id, page_access_token, fallback):
+        try:
+            response = await self.request(
+                'GET', f"{GRAPH_URL}/v22.0/{video_id}", params=fields_params('status', page_access_token),
+            )
+            return acknowledged_offset(response.json(), fallback)
+        except Exception as e:
+            print("Failed to read upload offset:", e)
+            return fallback
+
+    async def ig_post_carousel(self, posts: list):
+        result = {'success': False, 'items': []}
+        page_access_token = await self.get_cached_page_access_token()
+        instagram_account_id = await self.get_instagram_account_id(page_access_token)
+        if not instagram_account_id:
+            result['error'] = "Instagram account ID not found"
+            return result
+
+        media_url = f'{GRAPH_URL}/{instagram_account_id}/media'
+        workflow = self.workflow('ig_post_carousel', posts=posts)
+
+        items = checkpointed_media(workflow, posts, 'item', 'creation_id')
+        missing = await self.preflight(posts, items, 'ig_image')
+        target = f"ig:{instagram_account_id}"
+        reused = await self.reuse_media(target, workflow, posts, items, 'creation_id', 'item', page_access_token)
+        missing = [i for i in missing if items[i] is None]
+
+        async def create_item(i):
+            creation_id, error = await self.create_object(
+                media_url, carousel_item_payload(posts[i]['image_url'], page_access_token),
+            )
+            return item_outcome(self.page_id, posts[i]['image_url'], creation_id, error)
+
+        record_created(target, workflow, posts, items, missing, await self.gather_bounded(create_item, missing), 'item', 'creation_id')
+        result['items'] = items
+        creation_ids = [item['creation_id'] for item in items if 'creation_id' in item]
+        if not creation_ids:
+            result['error'] = "No images were uploaded"
+            return result
+
+        carousel_id = workflow.get('container')
+        if carousel_id is None:
+            carousel_id, error = await self.create_object(media_url, carousel_payload(posts, creation_ids, page_access_token))
+            if not carousel_id:
+                print("Carousel creation failed:", error)
+                self.check_instagram_account_error({'error': error})
+                forget_reused(target, workflow, posts, reused, 'item')
+                result['error'] = error
+                return result
+            workflow.save('container', carousel_id)
+
+        result.update(await self.ig_publish_container(instagram_account_id, carousel_id, page_access_token))
+        if result['success']:
+            print("🎉 Carousel successfully published to Instagram!")
+            finish_published(target, workflow, posts)
+        elif await self.discard_dead_container(workflow, carousel_id) in ('ERROR', 'EXPIRED'):
+            forget_items(target, workflow, items)
+        return result
+
+    async def ig_post_image(self, image_url: str, caption: str = ""):
+        result = {'success': False}
+        page_access_token = await self.get_cached_page_access_token()
+        instagram_account_id = await self.get_instagram_account_id(page_access_token)
+        if not instagram_account_id:
+            result['error'] = "Instagram account ID not found"
+            return result
+
+        problems = await asyncio.to_thread(preflight.validate, image_url, 'ig_image')
+        if problems:
+            print("Image failed pre-flight validation:", problems)
+            return preflight.rejection(problems, success=False)
+
+        workflow = self.workflow('ig_post_image', image_url=image_url, caption=caption)
+        creation_id = workflow.get('container')
+        if creation_id is None:
+            creation_id, error = await self.create_object(
+                f'{GRAPH_URL}/{instagram_account_id}/media', image_payload(image_url, caption, page_access_token),
+            )
+            if not creation_id:
+                print("Failed to create media object:", error)
+                self.check_instagram_account_error({'error': error})
+                result['error'] = error
+                return result
+            workflow.save('container', creation_id)
+        result['creation_id'] = creation_id
+
+        result.update(await self.ig_publish_container(instagram_account_id, creation_id, page_access_token))
+        if result['success']:
+            workflow.finish()
+        else:
+            await self.discard_dead_container(workflow, creation_id)
+        return result
+
+    async def ig_upload_reel(self, video_url, video_caption, wait=True):
+        result = {'success': False}
+        page_access_token = await self.get_cached_page_access_token()
+        instagram_account_id = await self.get_instagram_account_id(page_access_token)
+        if not instagram_account_id:
+            result['error'] = "Instagram account ID not found"
+            return result
+
+        problems = await asyncio.to_thread(preflight.validate, video_url, 'ig_reel')
+        if problems:
+            print("Video failed pre-flight validation:", problems)
+            return preflight.rejection(problems, success=False)
+
+        workflow = self.workflow('ig_upload_reel', video_url=video_url, video_caption=video_caption)
+        creation_id = workflow.get('container')
+        if creation_id is None:
+            source = await asyncio.to_thread(staging_area.stage, video_url, 'ig_reel')
+            creation_id, error = await self.create_object(
+                f"{GRAPH_URL}/v20.0/{instagram_account_id}/media", reel_payload(source, video_caption, page_access_token),
+            )
+            if not creation_id:
+                print(f"Failed to create media object: {json.dumps(error, indent=2)}")
+                self.check_instagram_account_error({'error': error})
+                result['error'] = error
+                return result
+            workflow.save('container', creation_id)
+        result['creation_id'] = creation_id
+
+        # The shared poller checks the container from its own thread; the publish runs back on this loop
+        loop = asyncio.get_running_loop()
+        future = reel_poller.submit(
+            creation_id,
+            page_access_token,
+            lambda creation_id: asyncio.run_coroutine_threadsafe(
+                self.ig_publish_container(instagram_account_id, creation_id, page_access_token), loop,
+            ).result(),
+        )
+        future.add_done_callback(lambda future: finish_reel_workflow(workflow, future.result()))
+        if not wait:
+            result['success'] = True
+            result['status'] = 'IN_PROGRESS'
+            return result
+
+        result.update(await asyncio.wrap_future(future))
+        return result
+
+    async def ig_publish_container(self, instagram_account_id, creation_id, page_access_token):
+        publish_response = await self.request(
+            'POST', f"{GRAPH_URL}/v20.0/{instagram_account_id}/media_publish",
+            data=publish_payload(creation_id, page_access_token),
+        )
+        return publish_result(publish_response, creation_id)
+
+    async def discard_dead_container(self, workflow, creation_id):
+        """
+        Async counterpart of PostToFacebookPage.discard_dead_container.
+        """
+        try:
+            response = await self.request(
+                'GET', f"{GRAPH_URL}/{creation_id}",
+                params=fields_params('status_code', await self.get_cached_page_access_token()),
+            )
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            print("Failed to read container status:", e)
+            return None
+        return discard_if_dead(workflow, creation_id, data)
+
+    async def post_comments_about_hashtag(self, hashtag, message=DEFAULT_COMMENT, limit=5, edges=HASHTAG_EDGES):
+        return await engage_hashtag_async(self, hashtag, message, limit=limit, edges=edges)
+
+    async def post_comment(self, media_id, comment_message, access_token):
+        response = await self.request('POST', f"{GRAPH_URL}/{media_id}/comments", params={
+            "message": comment_message,
+            "access_token": access_token
+        })
+        return response.json()
@@ -0,0 +1,106 @@
+import threading
+
+# Seconds; Graph calls range from tens of milliseconds to multi-minute uploads
+DURATION_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 8388608, 67108864)
+
+
+class Histogram():
+    """
+    Minimal Prometheus-style histogram keyed by a tuple of label values.
+    """
+
+    def __init__(self, name, documentation, label_names, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                base = _labels(self.label_names, labels)
+                for bound, count in zip(self.buckets, series['counts']):
+                    lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {series["count"]}')
+                lines.append(f'{self.name}_sum{{{base}}} {series["sum"]}')
+                lines.append(f'{self.name}_count{{{base}}} {series["count"]}')
+        return "\n".join(lines)
+
+
+class Counter():
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{{{_labels(self.label_names, labels)}}} {value}')
+        return "\n".join(lines)
+
+
+def _labels(names, values):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+graph_request_duration = Histogram(
+    "graph_request_duration_seconds", "Duration of outbound Graph API calls.",
+    ("method", "endpoint", "status"), DURATION_BUCKETS,
+)
+graph_request_bytes_sent = Histogram(
+    "graph_request_bytes_sent", "Request body size of outbound Graph API calls.",
+    ("method", "endpoint"), SIZE_BUCKETS,
+)
+graph_request_bytes_received = Histogram(
+    "graph_request_bytes_received", "Response body size of outbound Graph API calls.",
+    ("method", "endpoint"), SIZE_BUCKETS,
+)
+graph_errors = Counter(
+    "graph_errors_total", "Graph API error responses by error code.",
+    ("method", "endpoint", "code"),
+)
+
+REGISTRY = [graph_request_duration, graph_request_bytes_sent, graph_request_bytes_received, graph_errors]
+
+
+def observe_call(method, endpoint, status, duration, error_code=None, bytes_sent=0, bytes_received=0):
+    status = "error" if status is None else str(status)
+    graph_request_duration.observe((method, endpoint, status), duration)
+    graph_request_bytes_sent.observe((method, endpoint), bytes_sent)
+    graph_request_bytes_received.observe((method, endpoint), bytes_received)
+    if error_code is not None:
+        graph_errors.inc((method, endpoint, str(error_code)))
+
+
+def render():
+    """
+    All metrics of this process in the Prometheus text exposition format.
+    """
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
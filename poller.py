@@ -0,0 +1,234 @@
+import heapq
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import transport
+from breaker import CircuitOpenError
+from transport import GRAPH_URL
+
+# Graph accepts up to 50 object IDs in a single ?ids= lookup
+MAX_IDS_PER_LOOKUP = 50
+# Lookup errors that mean the requested object does not exist
+MISSING_OBJECT_CODES = {100, 803}
+
+
+class ReelPoller():
+    """
+    Single background thread that tracks every pending IG media container.
+
+    Instead of each request sleeping in its own loop, containers are checked
+    together with one `?ids=` lookup per access token. Each container backs
+    off from `min_interval` to `max_interval` seconds while it is processing.
+    Once a container is FINISHED its `on_finished` callback (normally
+    media_publish) runs on a small executor and its Future is resolved with
+    the callback's result dict.
+
+    Several callers may wait on one container, e.g. a scheduled publish
+    arriving while the container is still being prepared. Each gets its own
+    Future and callback, run in turn; once one of them published the
+    container, the callers after it get that result instead of publishing
+    it again.
+
+    A lookup that fails for reasons of its own (network errors, 5xx,
+    throttling, token errors) leaves the containers pending and retries them
+    at their next backoff step, within their deadline. Only Graph reporting a
+    container as failed, expired or nonexistent fails it.
+
+    wake() moves containers to the front of the queue when a webhook reports
+    that their processing ended; the lookup it triggers stays the authority
+    on their status.
+    """
+
+    def __init__(self, min_interval=2.0, max_interval=30.0, backoff=1.5, timeout=300.0, publish_workers=4):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self._pending = {}
+        self._schedule = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=publish_workers, thread_name_prefix="reel-publish")
+
+    def submit(self, creation_id, access_token, on_finished):
+        """
+        Track `creation_id` until processing ends. Returns a Future that resolves
+        to on_finished(creation_id) or to a failure result dict.
+        """
+        future = Future()
+        now = time.monotonic()
+        with self._condition:
+            # A resumed publish may hand back a container that is already tracked
+            if creation_id in self._pending:
+                self._pending[creation_id]['waiters'].append((on_finished, future))
+                return future
+            self._pending[creation_id] = {
+                'access_token': access_token,
+                'waiters': [(on_finished, future)],
+                'interval': self.min_interval,
+                'deadline': now + self.timeout,
+            }
+            self._due(creation_id, now + self.min_interval)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="reel-poller", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def wake(self, creation_ids):
+        """
+        Check these containers now instead of at their next backoff step.
+        Returns how many of them this process is tracking.
+        """
+        now = time.monotonic()
+        woken = 0
+        with self._condition:
+            for creation_id in creation_ids:
+                if creation_id in self._pending and not self._pending[creation_id].get('finishing'):
+                    self._due(creation_id, now)
+                    woken += 1
+            if woken:
+                self._condition.notify()
+        return woken
+
+    def pending(self):
+        with self._condition:
+            return len(self._pending)
+
+    def _due(self, creation_id, when):
+        # Only the latest schedule entry of a container counts, see _run()
+        self._pending[creation_id]['due'] = when
+        heapq.heappush(self._schedule, (when, creation_id))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._schedule or self._schedule[0][0] > time.monotonic():
+                    wait = self._schedule[0][0] - time.monotonic() if self._schedule else None
+                    self._condition.wait(wait)
+                due = {}
+                while self._schedule and self._schedule[0][0] <= time.monotonic():
+                    when, creation_id = heapq.heappop(self._schedule)
+                    entry = self._pending.get(creation_id)
+                    if entry and entry['due'] == when:
+                        due.setdefault(entry['access_token'], []).append(creation_id)
+
+            for access_token, creation_ids in due.items():
+                for i in range(0, len(creation_ids), MAX_IDS_PER_LOOKUP):
+                    self._check(creation_ids[i:i + MAX_IDS_PER_LOOKUP], access_token)
+
+    def _check(self, creation_ids, access_token):
+        try:
+            response = transport.get(
+                GRAPH_URL + "/",
+                params={
+                    'ids': ','.join(creation_ids),
+                    'fields': 'status_code,status',
+                    'access_token': access_token,
+                },
+                hedge=True,
+            )
+            status = response.status_code
+            data = response.json()
+        except CircuitOpenError as e:
+            # Graph is failing, not the containers; look again once the breaker may let us through
+            with self._condition:
+                for creation_id in creation_ids:
+                    if creation_id in self._pending:
+                        self._due(creation_id, time.monotonic() + e.retry_after)
+            return
+        except Exception as e:
+            logging.warning("Reel status lookup failed: %s", e)
+            self._retry(creation_ids, str(e))
+            return
+
+        error = data.get('error') if isinstance(data, dict) else {'message': 'Unexpected response'}
+        if error is not None:
+            code = error.get('code') if isinstance(error, dict) else None
+            if status >= 500 or code not in MISSING_OBJECT_CODES:
+                # Says nothing about the containers themselves
+                logging.warning("Reel status lookup failed: %s", error)
+                self._retry(creation_ids, error)
+                return
+            if len(creation_ids) > 1:
+                # One bad ID fails the whole lookup; fall back to checking each on its own
+                for creation_id in creation_ids:
+                    self._check([creation_id], access_token)
+                return
+            data = {creation_ids[0]: {'status_code': 'ERROR', 'status': error}}
+
+        for creation_id in creation_ids:
+            status = data.get(creation_id) or {}
+            self._advance(creation_id, status)
+
+    def _retry(self, creation_ids, error):
+        for creation_id in creation_ids:
+            self._advance(creation_id, {'error': error})
+
+    def _advance(self, creation_id, status):
+        status_code = status.get('status_code')
+        with self._condition:
+            entry = self._pending.get(creation_id)
+            if entry is None or entry.get('finishing'):
+                return
+
+            if status_code == 'FINISHED':
+                # Kept pending so callers arriving during the publish join it
+                entry['finishing'] = True
+            elif status_code == 'PUBLISHED':
+                del self._pending[creation_id]
+                self._resolve(entry, {'success': True, 'creation_id': creation_id})
+                return
+            elif status_code in ('ERROR', 'EXPIRED') or time.monotonic() >= entry['deadline']:
+                del self._pending[creation_id]
+                if status_code in ('ERROR', 'EXPIRED'):
+                    error = status.get('status') or status_code
+                elif 'error' in status:
+                    error = f"Media processing timed out, last status lookup failed: {status['error']}"
+                else:
+                    error = "Media processing timed out"
+                self._resolve(entry, {
+                    'success': False, 'creation_id': creation_id, 'status_code': status_code, 'error': error,
+                })
+                return
+            else:
+                entry['interval'] = min(entry['interval'] * self.backoff, self.max_interval)
+                self._due(creation_id, time.monotonic() + entry['interval'])
+                return
+
+        self._executor.submit(self._finish, creation_id, entry)
+
+    def _resolve(self, entry, result):
+        for _, future in entry['waiters']:
+            future.set_result(dict(result))
+
+    def _finish(self, creation_id, entry):
+        published = None
+        while True:
+            with self._condition:
+                if not entry['waiters']:
+                    del self._pending[creation_id]
+                    return
+                on_finished, future = entry['waiters'].pop(0)
+
+            if published is not None:
+                future.set_result(dict(published))
+                continue
+            try:
+                result = on_finished(creation_id)
+            except Exception as e:
+                logging.exception("Publishing container %s failed", creation_id)
+                result = {'success': False, 'creation_id': creation_id, 'error': str(e)}
+            if result.get('media_id'):
+                published = result
+            future.set_result(result)
+
+
+reel_poller = ReelPoller(
+    min_interval=float(os.getenv("META_REEL_POLL_MIN_INTERVAL", 2)),
+    max_interval=float(os.getenv("META_REEL_POLL_MAX_INTERVAL", 30)),
+    timeout=float(os.getenv("META_REEL_POLL_TIMEOUT", 300)),
+)
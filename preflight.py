@@ -0,0 +1,391 @@
+import os
+import struct
+import time
+
+import requests
+
+import transport
+from cache import media_probe_cache
+
+PREFLIGHT = os.getenv("META_PREFLIGHT", "1") == "1"
+# Cached probes younger than this are trusted without asking the origin
+PROBE_FRESH_FOR = int(os.getenv("META_PROBE_FRESH_FOR", 600))
+# Enough for JPEG EXIF (at most 64 KiB) and a faststart MP4's moov for short clips
+PROBE_HEAD_BYTES = 128 * 1024
+# A moov larger than this is not worth downloading just to validate
+PROBE_MAX_MOOV_BYTES = 16 * 1024 * 1024
+PROBE_MAX_FETCHES = 6
+
+MB = 1024 * 1024
+
+# Published limits of the Graph endpoints. Fields a probe could not read are not checked.
+SPECS = {
+    'fb_image': {
+        'formats': ('jpeg', 'png', 'gif', 'bmp', 'tiff', 'webp'),
+        'max_bytes': 10 * MB,
+    },
+    'ig_image': {
+        'formats': ('jpeg',),
+        'max_bytes': 8 * MB,
+        'min_aspect': 4 / 5,
+        'max_aspect': 1.91,
+    },
+    'fb_reel': {
+        'formats': ('mp4', 'mov'),
+        'video_codecs': ('avc1', 'avc3', 'hvc1', 'hev1'),
+        'min_width': 540,
+        'min_height': 960,
+        'min_aspect': 9 / 16 * 0.98,
+        'max_aspect': 9 / 16 * 1.02,
+        'min_duration': 3,
+        'max_duration': 90,
+        'min_frame_rate': 23,
+        'max_frame_rate': 60,
+    },
+    'ig_reel': {
+        'formats': ('mp4', 'mov'),
+        'video_codecs': ('avc1', 'avc3', 'hvc1', 'hev1'),
+        'audio_codecs': ('mp4a',),
+        'max_bytes': 1024 * MB,
+        'max_width': 1920,
+        'min_aspect': 0.01,
+        'max_aspect': 10,
+        'min_duration': 3,
+        'max_duration': 15 * 60,
+        'min_frame_rate': 23,
+        'max_frame_rate': 60,
+    },
+}
+
+
+def validate(url, target):
+    """
+    Problems that would make Graph reject the media at `url` for `target`
+    (a SPECS key), as a list of messages. An empty list means the media looks
+    fine or could not be probed; the final word stays with Graph.
+    """
+    if not PREFLIGHT:
+        return []
+    info = probe(url)
+    if info is None:
+        return []
+    return check(info, SPECS[target])
+
+
+def rejection(problems, **fields):
+    """
+    Result entry for media that failed pre-flight validation.
+    """
+    return dict(fields, error=f"Pre-flight validation failed: {'; '.join(problems)}", preflight=problems)
+
+
+def check(info, spec):
+    problems = []
+    fmt = info.get('format')
+    if fmt and 'formats' in spec and fmt not in spec['formats']:
+        problems.append(f"format {fmt} is not supported (expected {', '.join(spec['formats'])})")
+    if info.get('size') and 'max_bytes' in spec and info['size'] > spec['max_bytes']:
+        problems.append(f"file is {info['size'] / MB:.1f} MB, the limit is {spec['max_bytes'] // MB} MB")
+
+    width, height = info.get('width'), info.get('height')
+    if width and height:
+        if width < spec.get('min_width', 0) or height < spec.get('min_height', 0):
+            problems.append(f"resolution {width}x{height} is below {spec.get('min_width', 0)}x{spec.get('min_height', 0)}")
+        if 'max_width' in spec and width > spec['max_width']:
+            problems.append(f"width {width} is above {spec['max_width']}")
+        aspect = width / height
+        if not spec.get('min_aspect', 0) <= aspect <= spec.get('max_aspect', float('inf')):
+            problems.append(
+                f"aspect ratio {aspect:.3f} is outside {spec['min_aspect']:.3f}-{spec['max_aspect']:.3f}"
+            )
+
+    duration = info.get('duration')
+    if duration is not None and not spec.get('min_duration', 0) <= duration <= spec.get('max_duration', float('inf')):
+        problems.append(f"duration {duration:.1f}s is outside {spec['min_duration']}-{spec['max_duration']}s")
+    frame_rate = info.get('frame_rate')
+    if frame_rate and not spec.get('min_frame_rate', 0) <= frame_rate <= spec.get('max_frame_rate', float('inf')):
+        problems.append(f"frame rate {frame_rate:.2f} is outside {spec['min_frame_rate']}-{spec['max_frame_rate']} fps")
+
+    for field in ('video_codec', 'audio_codec'):
+        allowed = spec.get(field + 's')
+        if allowed and info.get(field) and info[field] not in allowed:
+            problems.append(f"{field.replace('_', ' ')} {info[field]} is not supported")
+    return problems
+
+
+def probe(url):
+    """
+    Format, size, dimensions and (for video) duration, codecs and frame rate
+    of the media at `url`, read from its first bytes with Range requests.
+
+    Results are cached by URL together with the ETag they were read from; a
+    stale entry is revalidated with If-None-Match, so an unchanged object
+    costs at most one empty 304 response. Returns None if the media could
+    not be read.
+    """
+    cached = media_probe_cache.get(url)
+    if cached and time.time() - cached['checked_at'] < PROBE_FRESH_FOR:
+        return cached['info']
+
+    headers = {'Range': f'bytes=0-{PROBE_HEAD_BYTES - 1}'}
+    if cached and cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+
+    try:
+        with transport.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 304 and cached:
+                cached['checked_at'] = time.time()
+                media_probe_cache.set(url, cached)
+                return cached['info']
+            if response.status_code not in (200, 206):
+                print("Pre-flight probe failed:", url, response.status_code)
+                return None
+            head = _read_head(response)
+            etag = response.headers.get('ETag')
+            size = _total_size(response)
+            info = _probe_bytes(head, size, lambda start, length: _fetch(url, etag, start, length))
+    except (requests.exceptions.RequestException, IOError, ValueError, IndexError, struct.error) as e:
+        print("Pre-flight probe failed:", url, e)
+        return None
+
+    if info is None:
+        info = {'format': None}
+    info['size'] = size
+    media_probe_cache.set(url, {'etag': etag, 'checked_at': time.time(), 'info': info})
+    return info
+
+
+def media_version(url):
+    """
+    ETag the media at `url` had when it was last probed, or None.
+    """
+    cached = media_probe_cache.peek(url) or media_probe_cache.get(url)
+    return cached.get('etag') if cached else None
+
+
+def _read_head(response):
+    head = bytearray()
+    for data in response.iter_content(chunk_size=PROBE_HEAD_BYTES):
+        head.extend(data)
+        if len(head) >= PROBE_HEAD_BYTES:
+            break
+    return bytes(head[:PROBE_HEAD_BYTES])
+
+
+def _total_size(response):
+    content_range = response.headers.get('Content-Range', '')
+    if response.status_code == 206 and content_range.rsplit('/', 1)[-1].isdigit():
+        return int(content_range.rsplit('/', 1)[-1])
+    if response.status_code == 200 and 'Content-Length' in response.headers:
+        return int(response.headers['Content-Length'])
+    return None
+
+
+def _fetch(url, etag, start, length):
+    # If-Match keeps us from mixing bytes of two versions of the object
+    headers = {'Range': f'bytes={start}-{start + length - 1}'}
+    if etag:
+        headers['If-Match'] = etag
+    with transport.get(url, headers=headers, stream=True) as response:
+        if response.status_code != 206:
+            raise IOError(f"Range request returned {response.status_code}")
+        return response.content
+
+
+def _probe_bytes(head, size, fetch):
+    if head[:3] == b'\xff\xd8\xff':
+        return _probe_jpeg(head)
+    if head[:8] == b'\x89PNG\r\n\x1a\n' and len(head) >= 24:
+        width, height = struct.unpack('>II', head[16:24])
+        return {'format': 'png', 'width': width, 'height': height}
+    if head[:4] in (b'GIF8',) and len(head) >= 10:
+        width, height = struct.unpack('<HH', head[6:10])
+        return {'format': 'gif', 'width': width, 'height': height}
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return _probe_webp(head)
+    if head[:2] == b'BM':
+        return {'format': 'bmp'}
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return {'format': 'tiff'}
+    if head[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'wide'):
+        return _probe_mp4(head, size, fetch)
+    return None
+
+
+def _probe_jpeg(data):
+    info = {'format': 'jpeg'}
+    orientation = 1
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return info
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if 0xD0 <= marker <= 0xD9 or marker == 0x01:
+            i += 2
+            continue
+        length = struct.unpack('>H', data[i + 2:i + 4])[0]
+        if marker == 0xE1 and data[i + 4:i + 10] == b'Exif\x00\x00':
+            orientation = _exif_orientation(data[i + 10:i + 2 + length])
+        if marker in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            # Orientations 5-8 are rotated by 90 degrees when displayed
+            if orientation >= 5:
+                width, height = height, width
+            info.update(width=width, height=height)
+            return info
+        i += 2 + length
+    return info
+
+
+def _exif_orientation(tiff):
+    try:
+        endian = '<' if tiff[:2] == b'II' else '>'
+        ifd = struct.unpack(endian + 'I', tiff[4:8])[0]
+        count = struct.unpack(endian + 'H', tiff[ifd:ifd + 2])[0]
+        for n in range(count):
+            entry = ifd + 2 + n * 12
+            tag, _, _, value = struct.unpack(endian + 'HHIH', tiff[entry:entry + 10])
+            if tag == 0x0112:
+                return value
+    except struct.error:
+        pass
+    return 1
+
+
+def _probe_webp(data):
+    info = {'format': 'webp'}
+    chunk = data[12:16]
+    if chunk == b'VP8 ' and len(data) >= 30:
+        width, height = struct.unpack('<HH', data[26:30])
+        info.update(width=width & 0x3FFF, height=height & 0x3FFF)
+    elif chunk == b'VP8L' and len(data) >= 25:
+        bits = struct.unpack('<I', data[21:25])[0]
+        info.update(width=(bits & 0x3FFF) + 1, height=((bits >> 14) & 0x3FFF) + 1)
+    elif chunk == b'VP8X' and len(data) >= 30:
+        info.update(
+            width=int.from_bytes(data[24:27], 'little') + 1,
+            height=int.from_bytes(data[27:30], 'little') + 1,
+        )
+    return info
+
+
+def _probe_mp4(head, size, fetch):
+    """
+    Walk the top-level boxes until moov. When moov sits behind mdat (no
+    faststart) only the box headers on the way and moov itself are fetched.
+    """
+    info = {'format': 'mp4'}
+    offset = 0
+    fetches = 0
+    seen_mdat = False
+    while size is None or offset < size:
+        header = head[offset:offset + 16]
+        if len(header) < 16 and (size is None or offset + len(header) < size):
+            if fetches >= PROBE_MAX_FETCHES:
+                return info
+            header = fetch(offset, 16 if size is None else min(16, size - offset))
+            fetches += 1
+        if len(header) < 8:
+            return info
+        box_size, kind = struct.unpack('>I4s', header[:8])
+        header_len = 8
+        if box_size == 1:
+            box_size = struct.unpack('>Q', header[8:16])[0]
+            header_len = 16
+        elif box_size == 0:
+            box_size = (size - offset) if size else len(head) - offset
+
+        if kind == b'ftyp' and header[8:12] == b'qt  ':
+            info['format'] = 'mov'
+        if kind == b'moov':
+            if box_size > PROBE_MAX_MOOV_BYTES:
+                return info
+            if offset + box_size <= len(head):
+                moov = head[offset + header_len:offset + box_size]
+            elif fetches < PROBE_MAX_FETCHES:
+                moov = fetch(offset, box_size)[header_len:]
+            else:
+                return info
+            info['faststart'] = not seen_mdat
+            info.update(_parse_moov(moov))
+            return info
+        if kind == b'mdat':
+            seen_mdat = True
+        if box_size < header_len:
+            return info
+        offset += box_size
+    return info
+
+
+def _boxes(data):
+    offset = 0
+    while offset + 8 <= len(data):
+        box_size, kind = struct.unpack('>I4s', data[offset:offset + 8])
+        header_len = 8
+        if box_size == 1:
+            box_size = struct.unpack('>Q', data[offset + 8:offset + 16])[0]
+            header_len = 16
+        elif box_size == 0:
+            box_size = len(data) - offset
+        if box_size < header_len:
+            return
+        yield kind, data[offset + header_len:offset + box_size]
+        offset += box_size
+
+
+def _child(data, *path):
+    for kind, body in _boxes(data):
+        if kind == path[0]:
+            return body if len(path) == 1 else _child(body, *path[1:])
+    return None
+
+
+def _timescale_duration(body):
+    # mvhd and mdhd share this layout: 32-bit times in version 0, 64-bit in version 1
+    if body[0] == 1:
+        return struct.unpack('>IQ', body[20:32])
+    return struct.unpack('>II', body[12:20])
+
+
+def _parse_moov(moov):
+    info = {}
+    mvhd = _child(moov, b'mvhd')
+    if mvhd:
+        timescale, duration = _timescale_duration(mvhd)
+        if timescale:
+            info['duration'] = duration / timescale
+
+    for kind, trak in _boxes(moov):
+        if kind != b'trak':
+            continue
+        hdlr = _child(trak, b'mdia', b'hdlr')
+        handler = hdlr[8:12] if hdlr else None
+        stsd = _child(trak, b'mdia', b'minf', b'stbl', b'stsd')
+        codec = stsd[12:16].decode('latin-1') if stsd and len(stsd) >= 16 else None
+
+        if handler == b'soun' and 'audio_codec' not in info:
+            info['audio_codec'] = codec
+        elif handler == b'vide' and 'video_codec' not in info:
+            info['video_codec'] = codec
+            tkhd = _child(trak, b'tkhd')
+            if tkhd:
+                matrix = 52 if tkhd[0] == 1 else 40
+                a, b = struct.unpack('>ii', tkhd[matrix:matrix + 8])
+                width, height = struct.unpack('>II', tkhd[matrix + 36:matrix + 44])
+                width, height = width >> 16, height >> 16
+                # A 90/270 degree rotation matrix swaps the displayed dimensions
+                if a == 0 and b != 0:
+                    width, height = height, width
+                info.update(width=width, height=height)
+
+            mdhd = _child(trak, b'mdia', b'mdhd')
+            stsz = _child(trak, b'mdia', b'minf', b'stbl', b'stsz')
+            if mdhd and stsz:
+                timescale, duration = _timescale_duration(mdhd)
+                samples = struct.unpack('>I', stsz[8:12])[0]
+                if timescale and duration:
+                    info['frame_rate'] = samples / (duration / timescale)
+    return info
@@ -0,0 +1,227 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+from bulk import publish_arguments
+from common import data_path
+
+# Instagram publishes that can be split into prepare and commit
+PREPARE_METHODS = ('ig_post_image', 'ig_post_carousel', 'ig_upload_reel')
+# Containers closer than this to their expiry are recreated before publishing
+COMMIT_MARGIN = int(os.getenv("META_PREPARED_COMMIT_MARGIN", 300))
+
+ENTRY_FIELDS = (
+    'handle', 'app_id', 'page_id', 'method', 'args', 'creation_id', 'status',
+    'created_at', 'prepared_at', 'expires_at', 'committed_at', 'media_id', 'error',
+)
+
+
+def prepare_arguments(payload):
+    """
+    Map a prepare request to its PostToFacebookPage method and keyword
+    arguments. Raises ValueError for unknown types or missing fields.
+    """
+    if payload.get('type') not in PREPARE_METHODS:
+        raise ValueError(f"type must be one of {', '.join(PREPARE_METHODS)}")
+    return publish_arguments(payload)
+
+
+class PreparedContainers():
+    """
+    SQLite record of Instagram containers created ahead of publishing.
+
+    Each entry is addressed by an opaque handle and remembers the publish it
+    was made for, so a container that expired (Instagram keeps unpublished
+    containers for 24 hours) can be made again from the same arguments. An
+    entry moves from 'prepared' to 'committing' with a conditional UPDATE, so
+    one handle is only ever published once.
+
+    Preparing the same publish twice resumes the same checkpointed container,
+    so a container is only handed out under one open handle at a time.
+    """
+
+    def __init__(self, db_path, ttl=82800):
+        self.db_path = db_path
+        self.ttl = ttl
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS prepared_containers ("
+                "handle TEXT PRIMARY KEY, app_id TEXT, page_id TEXT, method TEXT, args TEXT, "
+                "creation_id TEXT, status TEXT, created_at REAL, prepared_at REAL, expires_at REAL, "
+                "committed_at REAL, media_id TEXT, error TEXT)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS prepared_creation_id ON prepared_containers (creation_id)")
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def add(self, poster, method, arguments, creation_id):
+        """
+        Record a container under a new handle. Returns (handle, None), or
+        (None, open_handle) when another handle that is still 'prepared' or
+        'committing' holds the same container.
+        """
+        handle = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT handle FROM prepared_containers WHERE creation_id = ? AND status IN ('prepared', 'committing')",
+                (creation_id,),
+            ).fetchone()
+            if row is not None:
+                return None, row[0]
+            db.execute(
+                "INSERT INTO prepared_containers "
+                "(handle, app_id, page_id, method, args, creation_id, status, created_at, prepared_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, 'prepared', ?, ?, ?)",
+                (handle, poster.app_id, poster.page_id, method, json.dumps(arguments), creation_id,
+                 now, now, now + self.ttl),
+            )
+        return handle, None
+
+    def get(self, handle):
+        with self._connect() as db:
+            row = db.execute(
+                f"SELECT {', '.join(ENTRY_FIELDS)} FROM prepared_containers WHERE handle = ?", (handle,)
+            ).fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(ENTRY_FIELDS, row))
+        entry['args'] = json.loads(entry['args'])
+        return entry
+
+    def claim(self, handle, app_id, page_id):
+        """
+        Take a prepared entry of this page for publishing. Returns the entry,
+        or None when the handle is unknown, belongs to another page or is not
+        'prepared' any more.
+        """
+        with self._connect() as db:
+            claimed = db.execute(
+                "UPDATE prepared_containers SET status = 'committing' "
+                "WHERE handle = ? AND app_id = ? AND page_id = ? AND status = 'prepared'",
+                (handle, app_id, page_id),
+            ).rowcount
+        return self.get(handle) if claimed else None
+
+    def renew(self, handle, creation_id):
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "UPDATE prepared_containers SET creation_id = ?, prepared_at = ?, expires_at = ? WHERE handle = ?",
+                (creation_id, now, now + self.ttl, handle),
+            )
+
+    def committed(self, handle, media_id):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE prepared_containers SET status = 'committed', committed_at = ?, media_id = ?, error = NULL "
+                "WHERE handle = ?",
+                (time.time(), media_id, handle),
+            )
+
+    def release(self, handle, error):
+        """
+        Put an entry whose publish failed back to 'prepared' so the commit can be retried.
+        """
+        with self._connect() as db:
+            db.execute(
+                "UPDATE prepared_containers SET status = 'prepared', error = ? WHERE handle = ?",
+                (error if error is None or isinstance(error, str) else json.dumps(error), handle),
+            )
+
+    def stats(self):
+        with self._connect() as db:
+            counts = dict(db.execute("SELECT status, COUNT(*) FROM prepared_containers GROUP BY status").fetchall())
+            expired = db.execute(
+                "SELECT COUNT(*) FROM prepared_containers WHERE status = 'prepared' AND expires_at < ?", (time.time(),)
+            ).fetchone()[0]
+        return dict(counts, expired=expired)
+
+
+def prepare(poster, method, arguments):
+    """
+    Create the containers of an Instagram publish (waiting for reel
+    processing) and record them under a new handle for commit(). The same
+    publish cannot be prepared again until its open handle is committed;
+    that case fails with the 'open_handle'.
+    """
+    result = poster.ig_prepare(method, **arguments)
+    if not result.get('success'):
+        return result
+
+    handle, open_handle = prepared_containers.add(poster, method, arguments, result['creation_id'])
+    if handle is None:
+        result.update(success=False, open_handle=open_handle, error="This publish is already prepared under an open handle")
+        return result
+    result['handle'] = handle
+    result['expires_at'] = prepared_containers.get(handle)['expires_at']
+    return result
+
+
+def commit(poster, handle):
+    """
+    Publish a prepared container. A container that is about to expire, or
+    that Graph reports as expired or failed, is recreated from the original
+    arguments first. Returns (result, entry); entry is None when the handle
+    cannot be committed.
+    """
+    entry = prepared_containers.claim(handle, poster.app_id, poster.page_id)
+    if entry is None:
+        return None, prepared_containers.get(handle)
+
+    try:
+        result = _publish(poster, entry)
+    except Exception as e:
+        prepared_containers.release(handle, str(e))
+        raise
+
+    result['handle'] = handle
+    if result['success']:
+        poster.workflow(entry['method'], **entry['args']).finish()
+        if entry['method'] == 'ig_post_carousel':
+            poster.forget_published_items(entry['args']['posts'])
+        prepared_containers.committed(handle, result['media_id'])
+    else:
+        prepared_containers.release(handle, result.get('error'))
+    return result, entry
+
+
+def _publish(poster, entry):
+    creation_id = entry['creation_id']
+    recreated = False
+    if entry['expires_at'] - time.time() < COMMIT_MARGIN:
+        creation_id, error = _recreate(poster, entry)
+        if error:
+            return {'success': False, 'error': error}
+        recreated = True
+
+    result = poster.ig_commit(creation_id)
+    if not result['success'] and not recreated and poster.container_status(creation_id) in ('ERROR', 'EXPIRED'):
+        creation_id, error = _recreate(poster, entry)
+        if error:
+            return {'success': False, 'error': error}
+        recreated = True
+        result = poster.ig_commit(creation_id)
+    result['recreated'] = recreated
+    return result
+
+
+def _recreate(poster, entry):
+    print(f"Recreating stale container {entry['creation_id']} for {entry['handle']}")
+    poster.workflow(entry['method'], **entry['args']).finish()
+    result = poster.ig_prepare(entry['method'], **entry['args'])
+    if not result.get('success'):
+        return None, result.get('error') or "Failed to recreate the container"
+    prepared_containers.renew(entry['handle'], result['creation_id'])
+    return result['creation_id'], None
+
+
+prepared_containers = PreparedContainers(
+    os.getenv("META_PREPARED_DB") or data_path("prepared.db"),
+    ttl=int(os.getenv("META_PREPARED_TTL", 82800)),
+)
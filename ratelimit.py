@@ -0,0 +1,174 @@
+import json
+import os
+import random
+import threading
+import time
+
+# Graph error codes that mean "slow down": app, user, page and API-level throttling
+THROTTLE_CODES = {4, 17, 32, 613, 80001, 80002, 80004, 80005, 80006, 80008, 80014}
+
+
+class RateGovernor():
+    """
+    Per-app and per-page call budgets learned from Graph's usage headers.
+
+    Every Graph response reports how much of the rolling one-hour budget has
+    been used (X-App-Usage, X-Page-Usage, X-Business-Use-Case-Usage). Before a
+    call is sent, the caller is delayed in proportion to how far the busiest
+    of its budgets is above `soft_limit`. Once `hard_limit` is reached, it waits
+    for Graph's estimated time to regain access. Usage older than `stale_after`
+    seconds is ignored.
+    """
+
+    def __init__(self, soft_limit=75, hard_limit=95, max_delay=30.0, stale_after=60.0,
+                 max_retries=3, base_backoff=1.0, max_backoff=60.0):
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.max_delay = max_delay
+        self.stale_after = stale_after
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._budgets = {}
+        self._lock = threading.Lock()
+        self.delayed_calls = 0
+        self.throttled_calls = 0
+
+    def delay_for(self, app_id, page_id):
+        """
+        Seconds to wait before sending a call charged to app_id / page_id.
+        """
+        now = time.time()
+        delay = 0.0
+        with self._lock:
+            for key in (('app', app_id), ('page', page_id)):
+                budget = self._budgets.get(key)
+                if not budget or now - budget['updated_at'] > self.stale_after:
+                    continue
+                if budget['blocked_until'] > now:
+                    delay = max(delay, budget['blocked_until'] - now)
+                elif budget['usage'] >= self.soft_limit:
+                    span = max(self.hard_limit - self.soft_limit, 1)
+                    ratio = min((budget['usage'] - self.soft_limit) / span, 1.0)
+                    delay = max(delay, ratio * self.max_delay)
+            if delay:
+                self.delayed_calls += 1
+        return min(delay, self.max_backoff)
+
+    def before_request(self, app_id, page_id):
+        delay = self.delay_for(app_id, page_id)
+        if delay:
+            time.sleep(delay)
+
+    def record(self, app_id, page_id, headers):
+        """
+        Update budgets from the usage headers of a Graph response.
+        """
+        app_usage = _parse_header(headers.get('X-App-Usage'))
+        if isinstance(app_usage, dict):
+            self._update(('app', app_id), _max_usage(app_usage), 0)
+
+        page_usage = _parse_header(headers.get('X-Page-Usage'))
+        if isinstance(page_usage, dict):
+            self._update(('page', page_id), _max_usage(page_usage), page_usage.get('estimated_time_to_regain_access', 0))
+
+        business_usage = _parse_header(headers.get('X-Business-Use-Case-Usage'))
+        if isinstance(business_usage, dict):
+            for object_id, entries in business_usage.items():
+                for entry in entries or []:
+                    self._update(('page', object_id), _max_usage(entry), entry.get('estimated_time_to_regain_access', 0))
+
+    def is_throttled(self, response):
+        if response.status_code < 400:
+            return False
+        try:
+            error = response.json().get('error')
+        except (ValueError, AttributeError):
+            return response.status_code == 429
+        code = error.get('code') if isinstance(error, dict) else None
+        return code in THROTTLE_CODES or response.status_code == 429
+
+    def backoff(self, app_id, page_id, response, attempt):
+        """
+        Seconds to wait before retrying a throttled call: Retry-After when
+        Graph sends it, otherwise full-jitter exponential backoff. The budgets
+        are blocked for that long so other callers wait too.
+        """
+        retry_after = response.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            delay = float(retry_after)
+        else:
+            delay = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+        with self._lock:
+            self.throttled_calls += 1
+            now = time.time()
+            for key in (('app', app_id), ('page', page_id)):
+                budget = self._budgets.setdefault(key, {'usage': 0, 'updated_at': now, 'blocked_until': 0})
+                budget['updated_at'] = now
+                budget['blocked_until'] = max(budget['blocked_until'], now + delay)
+        return delay
+
+    def _update(self, key, usage, regain_minutes):
+        now = time.time()
+        with self._lock:
+            budget = self._budgets.setdefault(key, {'usage': 0, 'updated_at': now, 'blocked_until': 0})
+            budget['usage'] = usage
+            budget['updated_at'] = now
+            if regain_minutes:
+                budget['blocked_until'] = max(budget['blocked_until'], now + regain_minutes * 60)
+
+    def budget_state(self, app_id, page_id):
+        """
+        Current app and page budgets of one tenant.
+        """
+        now = time.time()
+        state = {}
+        with self._lock:
+            for kind, key in (('app', app_id), ('page', page_id)):
+                budget = self._budgets.get((kind, key))
+                if budget and now - budget['updated_at'] <= self.stale_after:
+                    state[kind] = {
+                        'usage': budget['usage'],
+                        'blocked_for_seconds': round(max(budget['blocked_until'] - now, 0), 1),
+                    }
+        return state
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                'delayed_calls': self.delayed_calls,
+                'throttled_calls': self.throttled_calls,
+                'budgets': {
+                    f"{kind}:{key}": {
+                        'usage': budget['usage'],
+                        'age_seconds': round(now - budget['updated_at'], 1),
+                        'blocked_for_seconds': round(max(budget['blocked_until'] - now, 0), 1),
+                    }
+                    for (kind, key), budget in self._budgets.items()
+                },
+            }
+
+
+def _parse_header(value):
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        return None
+
+
+def _max_usage(usage):
+    return max(
+        (usage.get(field) or 0 for field in ('call_count', 'total_cputime', 'total_time', 'call_volume', 'cpu_time')),
+        default=0,
+    )
+
+
+rate_governor = RateGovernor(
+    soft_limit=float(os.getenv("META_RATE_SOFT_LIMIT", 75)),
+    hard_limit=float(os.getenv("META_RATE_HARD_LIMIT", 95)),
+    max_retries=int(os.getenv("META_RATE_MAX_RETRIES", 3)),
+)
@@ -0,0 +1,149 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from cache import token_cache, ig_account_cache
+from ratelimit import rate_governor
+
+# Rough footprint of one loaded tenant besides its credential strings
+ENTRY_OVERHEAD_BYTES = 4096
+
+
+class PosterRegistry():
+    """
+    Process-wide LRU of poster objects keyed by (app_id, page_id), so the
+    posters of a page are built once and reused by every request, job and
+    bulk run for it.
+
+    A tenant's warm state (page token, Instagram account ID, rate budgets,
+    pooled connections) lives in the shared caches and is keyed the same way,
+    so reusing the poster means reusing all of it. The registry is bounded by
+    entry count and by an estimate of the memory it holds; the least recently
+    used tenants are dropped first.
+
+    App secrets and user tokens are never compared or stored in the clear
+    beyond the poster itself: each entry keeps an HMAC of them under a
+    per-process random key, and a request is only handed an existing poster
+    when its credentials produce the same digest (compared in constant time).
+    Different credentials for a known page replace the entry, which is what
+    a token or secret rotation looks like.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._key = os.urandom(32)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.replaced = 0
+        self.evictions = 0
+
+    def get(self, poster_class, app_id, app_secret, page_id, long_lived_token_file):
+        """
+        Poster of `poster_class` for the page, built on first use.
+        """
+        digest = self._digest(app_secret, long_lived_token_file)
+        key = (app_id, page_id)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not hmac.compare_digest(entry['digest'], digest):
+                self._remove(key)
+                self.replaced += 1
+                entry = None
+            if entry is None:
+                entry = {
+                    'digest': digest,
+                    'posters': {},
+                    'created_at': now,
+                    'uses': 0,
+                    'bytes': ENTRY_OVERHEAD_BYTES + sum(
+                        len(value or '') for value in (app_id, app_secret, page_id, long_lived_token_file)
+                    ),
+                }
+                self._entries[key] = entry
+                self._bytes += entry['bytes']
+
+            self._entries.move_to_end(key)
+            entry['last_used'] = now
+            entry['uses'] += 1
+            poster = entry['posters'].get(poster_class)
+            if poster is None:
+                self.misses += 1
+                poster = entry['posters'][poster_class] = poster_class(
+                    app_id, app_secret, page_id, long_lived_token_file
+                )
+            else:
+                self.hits += 1
+            self._evict()
+            return poster
+
+    def evict(self, app_id, page_id):
+        with self._lock:
+            return self._remove((app_id, page_id))
+
+    def tenants(self, offset=0, limit=100):
+        """
+        Loaded tenants, most recently used first, with the state of their
+        shared caches. Never includes secrets or tokens.
+        """
+        now = time.time()
+        with self._lock:
+            entries = list(reversed(self._entries.items()))[offset:offset + limit]
+
+        tenants = []
+        for (app_id, page_id), entry in entries:
+            poster = next(iter(entry['posters'].values()), None)
+            tenants.append({
+                'app_id': app_id,
+                'page_id': page_id,
+                'posters': sorted(cls.__name__ for cls in entry['posters']),
+                'uses': entry['uses'],
+                'age_seconds': round(now - entry['created_at'], 1),
+                'idle_seconds': round(now - entry['last_used'], 1),
+                'page_token': token_cache.describe(poster.token_key) if poster else {'cached': False},
+                'instagram_account_id': ig_account_cache.peek(page_id),
+                'rate_budgets': rate_governor.budget_state(app_id, page_id),
+            })
+        return tenants
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tenants': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'replaced': self.replaced,
+                'evictions': self.evictions,
+            }
+
+    def _digest(self, app_secret, long_lived_token_file):
+        message = f"{app_secret}\0{long_lived_token_file}".encode()
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry['bytes']
+        return entry is not None
+
+    def _evict(self):
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry['bytes']
+            self.evictions += 1
+
+
+poster_registry = PosterRegistry(
+    max_entries=int(os.getenv("META_REGISTRY_SIZE", 10000)),
+    max_bytes=int(os.getenv("META_REGISTRY_MAX_BYTES", 64 * 1024 * 1024)),
+)
@@ -0,0 +1,190 @@
+import hashlib
+import heapq
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from jobs import job_queue
+
+
+def parse_publish_at(value):
+    """
+    Unix timestamp of a publish_at field given as epoch seconds or an ISO 8601
+    string (UTC unless it carries an offset). Raises ValueError.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError("publish_at must be a timestamp or an ISO 8601 date")
+    try:
+        timestamp = float(value)
+    except OverflowError:
+        raise ValueError("publish_at is out of range")
+    except ValueError:
+        # Not a number, so it has to be an ISO 8601 string
+        timestamp = None
+    if timestamp is not None:
+        # float() also takes "nan", "inf" and "1e400", which would never (or always) be due
+        if not math.isfinite(timestamp):
+            raise ValueError("publish_at must be a finite timestamp")
+        return timestamp
+    try:
+        moment = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"Invalid publish_at: {value}")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def page_offset(page_id, jitter):
+    """
+    Stable delay in [0, jitter) seconds for a page, so publishes that many
+    pages scheduled for the same instant reach Graph spread over the window
+    while each page keeps the order of its own posts.
+    """
+    if not jitter:
+        return 0.0
+    digest = hashlib.sha256(str(page_id).encode()).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64 * jitter
+
+
+class PublishScheduler():
+    """
+    Single background thread that dispatches publishes with a publish_at time.
+
+    Scheduled jobs live in the job queue's database; the thread keeps a heap of
+    their two deadlines. `lead` seconds before a job is due it is prepared: the
+    page token and Instagram account are loaded and every step up to the
+    publish itself (child uploads, containers, the reel upload) runs and is
+    checkpointed. When the job is due it is released to the publish workers,
+    which pick the checkpoints up and only have to call media_publish (or the
+    feed post / reel finish phase).
+
+    Due times are shifted by a per-page offset of up to `jitter` seconds. The
+    database is rescanned every `rescan_interval` seconds for jobs scheduled
+    by other processes; the job queue's conditional updates make sure each job
+    is prepared and released once.
+    """
+
+    def __init__(self, queue, lead=600.0, jitter=60.0, prepare_workers=2, rescan_interval=30.0):
+        self.queue = queue
+        self.lead = lead
+        self.jitter = jitter
+        self.rescan_interval = rescan_interval
+        self._schedule = []
+        self._known = set()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=prepare_workers, thread_name_prefix="publish-prepare")
+
+    def start(self):
+        with self._condition:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="publish-scheduler", daemon=True)
+                self._thread.start()
+
+    def schedule(self, poster, method, kwargs, publish_at, callback_url=None):
+        """
+        Store a publish for `publish_at` (a Unix timestamp). Returns the job ID
+        and the time it will actually be released. A time in the past queues
+        the job right away.
+        """
+        now = time.time()
+        if publish_at <= now:
+            return self.queue.enqueue(poster, method, kwargs, publish_at=publish_at, callback_url=callback_url), now
+
+        run_at = publish_at + page_offset(poster.page_id, self.jitter)
+        prepare_at = max(now, run_at - self.lead)
+        job_id = self.queue.enqueue(
+            poster, method, kwargs, publish_at=publish_at, run_at=run_at, prepare_at=prepare_at,
+            callback_url=callback_url,
+        )
+        self.start()
+        with self._condition:
+            self._track(job_id, 'scheduled', prepare_at, run_at)
+            self._condition.notify()
+        return job_id, run_at
+
+    def pending(self):
+        with self._condition:
+            return len(self._known)
+
+    def stats(self):
+        return {'pending': self.pending(), 'lead': self.lead, 'jitter': self.jitter}
+
+    def _track(self, job_id, status, prepare_at, run_at):
+        if job_id in self._known:
+            return
+        self._known.add(job_id)
+        if status == 'scheduled':
+            heapq.heappush(self._schedule, (prepare_at or run_at, 'prepare', job_id))
+        heapq.heappush(self._schedule, (run_at, 'release', job_id))
+
+    def _rescan(self):
+        try:
+            rows = self.queue.scheduled()
+        except Exception:
+            logging.exception("Failed to load scheduled publishes")
+            return
+        with self._condition:
+            for job_id, status, prepare_at, run_at in rows:
+                self._track(job_id, status, prepare_at, run_at)
+
+    def _run(self):
+        next_rescan = 0
+        while True:
+            if time.monotonic() >= next_rescan:
+                self._rescan()
+                next_rescan = time.monotonic() + self.rescan_interval
+
+            with self._condition:
+                if not self._schedule or self._schedule[0][0] > time.time():
+                    wait = next_rescan - time.monotonic()
+                    if self._schedule:
+                        wait = min(wait, self._schedule[0][0] - time.time())
+                    self._condition.wait(max(wait, 0))
+                    continue
+                _, action, job_id = heapq.heappop(self._schedule)
+
+            if action == 'prepare':
+                self._executor.submit(self._prepare, job_id)
+            else:
+                self._release(job_id)
+
+    def _prepare(self, job_id):
+        try:
+            job = self.queue.claim_prepare(job_id)
+            if job is None:
+                return
+            steps, result, error = self.queue.call(job_id, *job, prepare_only=True)
+            if error:
+                print(f"Preparing scheduled publish {job_id} failed:", error)
+            self.queue.finish_prepare(job_id, steps, result, error)
+        except Exception:
+            logging.exception("Preparing scheduled publish %s failed", job_id)
+
+    def _release(self, job_id):
+        try:
+            state = self.queue.release(job_id)
+        except Exception:
+            logging.exception("Releasing scheduled publish %s failed", job_id)
+            state = 'busy'
+
+        with self._condition:
+            if state == 'busy':
+                # Still being prepared (or the database was busy); check again shortly
+                heapq.heappush(self._schedule, (time.time() + 1, 'release', job_id))
+            else:
+                self._known.discard(job_id)
+
+
+publish_scheduler = PublishScheduler(
+    job_queue,
+    lead=float(os.getenv("META_SCHEDULE_LEAD", 600)),
+    jitter=float(os.getenv("META_SCHEDULE_JITTER", 60)),
+    prepare_workers=int(os.getenv("META_SCHEDULE_PREPARE_WORKERS", 2)),
+    rescan_interval=float(os.getenv("META_SCHEDULE_RESCAN_INTERVAL", 30)),
+)
@@ -0,0 +1,406 @@
+import hashlib
+import os
+import re
+import shutil
+import struct
+import subprocess
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import requests
+
+import preflight
+import transport
+from cache import LRUCache
+from common import data_path
+
+MB = 1024 * 1024
+# Boxes on the way from moov to the chunk offset tables
+CONTAINER_BOXES = (b'moov', b'trak', b'mdia', b'minf', b'stbl')
+STAGED_NAME = re.compile(r'^[0-9a-f]{64}\.mp4$')
+
+
+def top_level_boxes(path):
+    """
+    (kind, offset, size) of the top-level boxes of an ISO media file.
+    """
+    boxes = []
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as source:
+        offset = 0
+        while offset + 8 <= file_size:
+            source.seek(offset)
+            header = source.read(16)
+            box_size, kind = struct.unpack('>I4s', header[:8])
+            header_len = 8
+            if box_size == 1:
+                box_size = struct.unpack('>Q', header[8:16])[0]
+                header_len = 16
+            elif box_size == 0:
+                box_size = file_size - offset
+            if box_size < header_len or offset + box_size > file_size:
+                break
+            boxes.append((kind, offset, box_size))
+            offset += box_size
+    return boxes
+
+
+def _box(kind, body):
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def _children(data):
+    offset = 0
+    while offset + 8 <= len(data):
+        box_size, kind = struct.unpack('>I4s', data[offset:offset + 8])
+        header_len = 8
+        if box_size == 1:
+            box_size = struct.unpack('>Q', data[offset + 8:offset + 16])[0]
+            header_len = 16
+        elif box_size == 0:
+            box_size = len(data) - offset
+        if box_size < header_len:
+            return
+        yield kind, data[offset + header_len:offset + box_size]
+        offset += box_size
+
+
+def _rewrite(data, shift, co64):
+    """
+    Rebuild the boxes in `data` with every chunk offset passed through
+    `shift`; with co64=True 32-bit stco tables are widened to co64.
+    Raises OverflowError when a shifted offset no longer fits an stco.
+    """
+    boxes = []
+    for kind, body in _children(data):
+        if kind in CONTAINER_BOXES:
+            boxes.append(_box(kind, _rewrite(body, shift, co64)))
+        elif kind in (b'stco', b'co64'):
+            count = struct.unpack('>I', body[4:8])[0]
+            width = 'Q' if kind == b'co64' else 'I'
+            offsets = [shift(offset) for offset in struct.unpack(f'>{count}{width}', body[8:8 + count * struct.calcsize(width)])]
+            if kind == b'stco' and not co64:
+                if offsets and max(offsets) > 0xFFFFFFFF:
+                    raise OverflowError("chunk offset does not fit in stco")
+                boxes.append(_box(b'stco', body[:8] + struct.pack(f'>{count}I', *offsets)))
+            else:
+                boxes.append(_box(b'co64', body[:8] + struct.pack(f'>{count}Q', *offsets)))
+        else:
+            boxes.append(_box(kind, body))
+    return b''.join(boxes)
+
+
+def faststart(source, destination, max_moov_bytes=64 * MB):
+    """
+    Write a copy of an MP4/MOV with its moov box in front of the media data
+    and the chunk offsets patched to match, so Graph can start processing
+    without reading to the end of the file. Returns False, writing nothing,
+    when the file is already faststart or has no moov/mdat.
+    """
+    boxes = top_level_boxes(source)
+    kinds = [kind for kind, _, _ in boxes]
+    if b'moov' not in kinds or b'mdat' not in kinds or kinds.index(b'moov') < kinds.index(b'mdat'):
+        return False
+
+    _, moov_offset, moov_size = boxes[kinds.index(b'moov')]
+    insert_at = boxes[kinds.index(b'mdat')][1]
+    if moov_size > max_moov_bytes:
+        raise ValueError(f"moov box of {moov_size} bytes is too large to remux")
+    with open(source, 'rb') as media:
+        media.seek(moov_offset)
+        moov = next(_children(media.read(moov_size)))[1]
+
+    def moved(new_size):
+        # Data between the first mdat and the old moov moves back by the new
+        # moov; data after the old moov only by the difference in size
+        def shift(offset):
+            if offset < insert_at:
+                return offset
+            if offset < moov_offset:
+                return offset + new_size
+            return offset + new_size - moov_size
+        return shift
+
+    # The rebuilt moov's size does not depend on the offsets, only on whether
+    # stco tables had to be widened
+    for co64 in (False, True):
+        size = len(_box(b'moov', _rewrite(moov, lambda offset: offset, co64)))
+        try:
+            new_moov = _box(b'moov', _rewrite(moov, moved(size), co64))
+            break
+        except OverflowError:
+            continue
+
+    with open(source, 'rb') as media, open(destination, 'wb') as output:
+        _copy(media, output, 0, insert_at)
+        output.write(new_moov)
+        for kind, offset, length in boxes:
+            if offset >= insert_at and kind != b'moov':
+                _copy(media, output, offset, length)
+    return True
+
+
+def _copy(source, output, offset, length):
+    source.seek(offset)
+    while length > 0:
+        data = source.read(min(length, MB))
+        if not data:
+            raise IOError("Unexpected end of file")
+        output.write(data)
+        length -= len(data)
+
+
+class StagingArea():
+    """
+    Bounded local disk cache of reels prepared for Graph ingestion.
+
+    A reel that is not faststart (moov behind mdat) is streamed to disk and
+    remuxed with its moov moved to the front; one whose bitrate or size is
+    above the Reels recommendations is transcoded with ffmpeg when it is
+    installed. Graph then fetches the staged copy from `public_url` (the
+    /staged route) instead of the original, while Facebook reels, which we
+    upload ourselves, are read straight from disk. Reels that are already
+    fine are not staged.
+
+    Staged files are named after the SHA-256 of the source bytes, so the
+    same video behind different URLs is stored and processed once, and
+    sources are indexed by URL and ETag to skip the download on a repeat.
+    Files are evicted least recently used first once `quota` bytes are
+    exceeded; files used within `min_age` seconds are kept for the Graph
+    fetches that may still need them. Staging is best effort: on any
+    failure the original URL is used.
+    """
+
+    def __init__(self, directory, public_url=None, quota=10 * 1024 * MB, min_age=3600, max_bitrate=25_000_000,
+                 max_dimension=1920, ffmpeg=None, transcode_timeout=900, index=None):
+        self.directory = directory
+        self.public_url = public_url.rstrip('/') if public_url else None
+        self.quota = quota
+        self.min_age = min_age
+        self.max_bitrate = max_bitrate
+        self.max_dimension = max_dimension
+        self.ffmpeg = shutil.which(ffmpeg) if ffmpeg else None
+        self.transcode_timeout = transcode_timeout
+        self.index = index
+        self._lock = threading.Lock()
+        self._sources = {}
+        self.counts = {'staged': 0, 'reused': 0, 'remuxed': 0, 'transcoded': 0, 'skipped': 0, 'failed': 0, 'evicted': 0}
+        if self.public_url:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return bool(self.public_url)
+
+    def stage(self, url, target):
+        """
+        URL Graph should fetch the reel at `url` from for `target` (a
+        preflight SPECS key): the staged copy, or `url` itself.
+        """
+        if not self.enabled:
+            return url
+        info = preflight.probe(url)
+        if not info or info.get('format') not in ('mp4', 'mov'):
+            return url
+        transcode = self.ffmpeg is not None and self._too_heavy(info, preflight.SPECS[target])
+        if info.get('faststart') and not transcode:
+            self._count('skipped')
+            return url
+
+        etag = preflight.media_version(url)
+        key = f"{url}\0{etag}"
+        with self._source_lock(key):
+            # '' records a source that processing would not change
+            name = self.index.get(key) if etag and self.index else None
+            if name == '':
+                self._count('skipped')
+                return url
+            if name and self.touch(name):
+                self._count('reused')
+                return self.url(name)
+            try:
+                name = self._stage(url, transcode)
+            except (requests.exceptions.RequestException, IOError, ValueError, struct.error,
+                    subprocess.SubprocessError) as e:
+                print("Staging the reel failed, using the original URL:", url, e)
+                self._count('failed')
+                return url
+            if etag and self.index:
+                self.index.set(key, name or '')
+        if name is None:
+            self._count('skipped')
+            return url
+        self.evict()
+        return self.url(name)
+
+    def url(self, name):
+        return f"{self.public_url}/staged/{name}"
+
+    def path(self, name):
+        """
+        Local path of a staged file, or None for names that are not ours.
+        """
+        if not STAGED_NAME.match(name or ''):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+    def local_path(self, url):
+        """
+        Local path of the staged file `url` points at, or None for any other
+        URL, so callers on this host can read it instead of fetching it back.
+        """
+        prefix = f"{self.public_url}/staged/"
+        if not self.enabled or not url.startswith(prefix):
+            return None
+        return self.path(url[len(prefix):])
+
+    def touch(self, name):
+        path = self.path(name)
+        if path is None:
+            return False
+        try:
+            os.utime(path)
+        except OSError:
+            return False
+        return True
+
+    def evict(self):
+        """
+        Delete least recently used files until the directory fits the quota.
+        """
+        files = []
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            if STAGED_NAME.match(entry.name):
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+            elif entry.name.startswith('tmp-') and stat.st_mtime < now - max(self.transcode_timeout, self.min_age):
+                # Left behind by a process that died while staging
+                os.remove(entry.path)
+        total = sum(size for _, size, _ in files)
+        cutoff = now - self.min_age
+        for mtime, size, path in sorted(files):
+            if total <= self.quota or mtime > cutoff:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self._count('evicted')
+
+    def stats(self):
+        files, total = 0, 0
+        if self.enabled:
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and STAGED_NAME.match(entry.name):
+                    files += 1
+                    total += entry.stat().st_size
+        with self._lock:
+            return dict(self.counts, enabled=self.enabled, ffmpeg=self.ffmpeg is not None,
+                        files=files, bytes=total, quota=self.quota)
+
+    def _too_heavy(self, info, spec):
+        if info.get('size') and info.get('duration') and info['size'] * 8 / info['duration'] > self.max_bitrate:
+            return True
+        if max(info.get('width') or 0, info.get('height') or 0) > self.max_dimension:
+            return True
+        return bool(info.get('size') and spec.get('max_bytes') and info['size'] > spec['max_bytes'])
+
+    def _stage(self, url, transcode):
+        """
+        Download, hash and process the source. Returns the staged file's
+        name, or None when processing would not change it.
+        """
+        download = os.path.join(self.directory, f"tmp-{uuid.uuid4().hex}")
+        processed = download + ".mp4"
+        try:
+            digest = self._download(url, download)
+            name = f"{digest}.mp4"
+            if self.touch(name):
+                self._count('reused')
+                return name
+
+            if transcode:
+                self._transcode(download, processed)
+                self._count('transcoded')
+            elif faststart(download, processed):
+                self._count('remuxed')
+            else:
+                return None
+            os.replace(processed, os.path.join(self.directory, name))
+            self._count('staged')
+            return name
+        finally:
+            for path in (download, processed):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _download(self, url, path):
+        digest = hashlib.sha256()
+        written = 0
+        with transport.get(url, stream=True) as response, open(path, 'wb') as output:
+            if response.status_code != 200:
+                raise IOError(f"Video download failed with status {response.status_code}")
+            for data in response.iter_content(chunk_size=MB):
+                written += len(data)
+                if written > self.quota:
+                    raise IOError("Video is larger than the staging quota")
+                digest.update(data)
+                output.write(data)
+        return digest.hexdigest()
+
+    def _transcode(self, source, destination):
+        limit = self.max_dimension
+        subprocess.run([
+            self.ffmpeg, '-nostdin', '-y', '-loglevel', 'error', '-i', source,
+            '-map', '0:v:0', '-map', '0:a:0?',
+            '-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'high', '-pix_fmt', 'yuv420p',
+            '-crf', '23', '-maxrate', str(self.max_bitrate), '-bufsize', str(2 * self.max_bitrate),
+            '-vf', f"scale='if(gt(iw,ih),min({limit},iw),-2)':'if(gt(iw,ih),-2,min({limit},ih))'",
+            '-c:a', 'aac', '-b:a', '128k', '-ar', '48000',
+            '-movflags', '+faststart', '-f', 'mp4', destination,
+        ], check=True, timeout=self.transcode_timeout, capture_output=True)
+
+    @contextmanager
+    def _source_lock(self, key):
+        # Concurrent publishes of one source wait for a single download
+        with self._lock:
+            lock, users = self._sources.get(key, (threading.Lock(), 0))
+            self._sources[key] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                lock, users = self._sources[key]
+                if users == 1:
+                    del self._sources[key]
+                else:
+                    self._sources[key] = (lock, users - 1)
+
+    def _count(self, field):
+        with self._lock:
+            self.counts[field] += 1
+
+
+staging_area = StagingArea(
+    os.getenv("META_STAGING_DIR") or data_path("staging"),
+    public_url=os.getenv("META_STAGING_PUBLIC_URL"),
+    quota=int(os.getenv("META_STAGING_QUOTA_BYTES", 10 * 1024 * MB)),
+    min_age=int(os.getenv("META_STAGING_MIN_AGE", 3600)),
+    max_bitrate=int(os.getenv("META_STAGING_MAX_BITRATE", 25_000_000)),
+    ffmpeg=os.getenv("META_STAGING_FFMPEG", "ffmpeg"),
+    transcode_timeout=int(os.getenv("META_STAGING_TRANSCODE_TIMEOUT", 900)),
+    index=LRUCache(
+        "staged_sources",
+        max_size=int(os.getenv("META_STAGING_INDEX_SIZE", 4096)),
+        ttl=int(os.getenv("META_STAGING_INDEX_TTL", 7 * 86400)),
+        db_path=os.getenv("META_CACHE_DB"),
+    ),
+)
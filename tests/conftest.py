@@ -0,0 +1,88 @@
+"""
+Shared fixtures. The service modules read their configuration when they are
+imported, so the environment is set up here first: every store lives in a
+scratch data directory and Graph calls go to bench/mock_graph.py. The
+directory is left behind on purpose: background threads of the service
+keep polling their stores until the interpreter exits.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import pytest
+
+from bench.run import free_port, wait_until_up
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_KEY = "tests"
+APP_ID = "100000000000001"
+PAGE_ID = "200000000000000"
+
+DATA_DIR = tempfile.mkdtemp(prefix="metamanager-tests-")
+GRAPH_URL = f"http://127.0.0.1:{free_port()}"
+os.environ.update(
+    META_DATA_DIR=DATA_DIR,
+    META_GRAPH_URL=GRAPH_URL,
+    META_CALLBACK_HOSTS="127.0.0.1",
+    META_REEL_POLL_MIN_INTERVAL="0.1",
+    FLASK_API_KEY=API_KEY,
+)
+
+
+def page_headers(page_id=PAGE_ID, app_id=APP_ID):
+    return {
+        'X-API-KEY': API_KEY,
+        'X-APP-ID': app_id,
+        'X-APP-SECRET': 'tests-secret',
+        'X-PAGE-ID': page_id,
+        'X-ACCESS-TOKEN': f"tests-user-token-{page_id}",
+    }
+
+
+def media_url(name):
+    return f"{GRAPH_URL}/__media/{name}"
+
+
+def graph_stats():
+    """
+    Calls the simulator has served so far, by method and last path segment.
+    """
+    return httpx.get(f"{GRAPH_URL}/__stats").json()
+
+
+def wait_for(predicate, timeout=10, interval=0.02):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        value = predicate()
+        if value:
+            return value
+        time.sleep(interval)
+    raise AssertionError("Timed out waiting for condition")
+
+
+@pytest.fixture(scope="session")
+def graph():
+    """
+    The Graph simulator, with no injected latency and fast reel processing.
+    """
+    port = GRAPH_URL.rsplit(':', 1)[1]
+    mock = subprocess.Popen([
+        sys.executable, os.path.join(REPO, 'bench', 'mock_graph.py'), '--port', port,
+        '--latency-ms', '0', '--jitter-ms', '0', '--upload-ms-per-mb', '0', '--processing-ms', '300',
+        '--video-bytes', str(256 * 1024),
+    ])
+    try:
+        wait_until_up(f"{GRAPH_URL}/__stats", mock)
+        yield GRAPH_URL
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+@pytest.fixture
+def poster(graph):
+    from meta import PostToFacebookPage
+    return PostToFacebookPage(APP_ID, 'tests-secret', PAGE_ID, f"tests-user-token-{PAGE_ID}")
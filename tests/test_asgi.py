@@ -0,0 +1,60 @@
+import pytest
+from starlette.testclient import TestClient
+
+import app as flask_module
+import asgi
+from conftest import media_url, page_headers
+
+PAGE_ID = '200000000000200'
+
+
+@pytest.fixture(scope="module")
+def client(graph):
+    with TestClient(asgi.app) as client:
+        yield client
+
+
+def endpoints(timings):
+    return [step['endpoint'].split(' ', 1)[0] + ' ' + step['endpoint'].rsplit('/', 1)[-1] for step in timings['graph_calls']]
+
+
+def test_native_routes_report_timings_on_request(client):
+    body = {'image_url': media_url('portrait.jpg'), 'caption': "asgi timings"}
+    response = client.post('/ig/post-image', json=body, headers={**page_headers(PAGE_ID), 'X-DEBUG-TIMINGS': '1'})
+
+    data = response.json()
+    assert response.status_code == 200 and data['success']
+    assert 'POST media_publish' in endpoints(data['timings'])
+    assert data['timings']['graph_ms'] >= 0
+
+
+def test_timings_are_only_added_when_asked_for(client):
+    body = {'image_url': media_url('portrait.jpg'), 'caption': "asgi no timings"}
+    response = client.post('/ig/post-image', json=body, headers=page_headers(PAGE_ID))
+    assert response.json()['success']
+    assert 'timings' not in response.json()
+
+
+def test_native_and_flask_timings_have_the_same_shape(client):
+    posts = [{'image_url': media_url(name), 'caption': "timings shape"} for name in ('portrait.jpg', 'square.jpg')]
+    headers = {'X-DEBUG-TIMINGS': '1'}
+
+    native = client.post('/ig/post-carousel', json={'posts': posts}, headers={**page_headers('200000000000201'), **headers})
+    flask = flask_module.app.test_client().post(
+        '/ig/post-carousel', json={'posts': posts}, headers={**page_headers('200000000000202'), **headers},
+    )
+
+    assert native.json()['success'] and flask.get_json()['success']
+    native_timings, flask_timings = native.json()['timings'], flask.get_json()['timings']
+    assert native_timings.keys() == flask_timings.keys()
+    assert native_timings['graph_calls'][0].keys() == flask_timings['graph_calls'][0].keys()
+    assert 'POST media_publish' in endpoints(native_timings)
+
+
+def test_native_reel_route_publishes_once_processed(client):
+    body = {'video_url': media_url('reel.mp4'), 'caption': "asgi reel"}
+    response = client.post('/ig/upload-reel', json=body, headers=page_headers(PAGE_ID))
+
+    data = response.json()
+    assert data['success'], data
+    assert data['media_id']
@@ -0,0 +1,111 @@
+import time
+
+import pytest
+import requests
+
+import transport
+from bench.run import free_port
+from breaker import CircuitBreaker, CircuitBreakers, CircuitOpenError
+from conftest import GRAPH_URL
+
+
+def fail(breaker, times):
+    for _ in range(times):
+        breaker.before()
+        breaker.record(False)
+
+
+def test_the_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker('publish', failures=3, cooldown=30)
+    fail(breaker, 2)
+    breaker.before()
+    breaker.record(True)
+    fail(breaker, 2)
+    assert breaker.state == 'closed'
+
+    fail(breaker, 1)
+    assert breaker.state == 'open'
+    with pytest.raises(CircuitOpenError) as rejected:
+        breaker.before()
+    assert rejected.value.endpoint_class == 'publish'
+    assert 1 <= rejected.value.retry_after <= 30
+    assert breaker.describe()['rejected'] == 1
+
+
+def test_a_half_open_breaker_lets_one_trial_through():
+    breaker = CircuitBreaker('publish', failures=1, cooldown=0)
+    fail(breaker, 1)
+
+    breaker.before()
+    assert breaker.state == 'half_open'
+    with pytest.raises(CircuitOpenError):
+        breaker.before()
+    breaker.record(True)
+    assert breaker.state == 'closed'
+    breaker.before()
+
+
+def test_a_failed_trial_opens_the_breaker_again():
+    breaker = CircuitBreaker('publish', failures=5, cooldown=0.05)
+    fail(breaker, 5)
+    time.sleep(0.06)
+
+    breaker.before()
+    breaker.record(False)
+    assert breaker.state == 'open' and breaker.describe()['opened'] == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.before()
+
+
+def test_releasing_a_trial_lets_the_next_one_through():
+    breaker = CircuitBreaker('publish', failures=1, cooldown=0)
+    fail(breaker, 1)
+    breaker.before()
+    breaker.release()
+
+    breaker.before()
+    assert breaker.state == 'half_open'
+
+
+def test_disabled_breakers_never_reject():
+    breakers = CircuitBreakers(failures=1, enabled=False)
+    for _ in range(3):
+        breakers.before('publish')
+        breakers.record('publish', False)
+    assert breakers.states() == {}
+
+
+@pytest.fixture
+def breakers(monkeypatch):
+    breakers = CircuitBreakers(failures=2, cooldown=0.05)
+    monkeypatch.setattr(transport, 'circuit_breakers', breakers)
+    return breakers
+
+
+def test_transport_stops_calling_a_failing_endpoint_class(graph, breakers):
+    # GRAPH_URL's host counts as Graph, so a closed port on it fails like Graph being down
+    down = f"http://127.0.0.1:{free_port()}/123/media_publish"
+    for _ in range(2):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            transport.post(down)
+    with pytest.raises(CircuitOpenError):
+        transport.post(down)
+
+    time.sleep(0.06)
+    assert transport.post(f"{GRAPH_URL}/123/media_publish").status_code == 400
+    assert breakers.states()['publish']['state'] == 'closed'
+
+
+def test_transport_frees_the_trial_when_a_call_fails_on_our_side(graph, breakers, monkeypatch):
+    breakers.record('publish', False)
+    breakers.record('publish', False)
+    time.sleep(0.06)
+
+    def broken_send(*args, **kwargs):
+        raise ValueError("bad request body")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(transport, '_send', broken_send)
+        with pytest.raises(ValueError):
+            transport.post(f"{GRAPH_URL}/123/media_publish")
+    assert transport.post(f"{GRAPH_URL}/123/media_publish").status_code == 400
@@ -0,0 +1,30 @@
+import json
+
+from conftest import APP_ID, graph_stats, media_url, wait_for
+from bulk import run_bulk
+
+DEFAULTS = {'app_id': APP_ID, 'app_secret': 'tests-secret', 'page_id': '200000000000100', 'access_token': 'tests-user-token'}
+
+
+def image_jobs(count, label):
+    return [{'type': 'ig_post_image', 'image_url': media_url('portrait.jpg'), 'caption': f"{label} {i}"} for i in range(count)]
+
+
+def test_every_job_gets_one_line(graph):
+    jobs = [{'type': 'unknown'}, *image_jobs(4, "lines")]
+
+    lines = sorted((json.loads(line) for line in run_bulk(jobs, DEFAULTS)), key=lambda line: line['index'])
+    assert [line['index'] for line in lines] == list(range(5))
+    assert not lines[0]['success'] and 'Unsupported job type' in lines[0]['error']
+    assert all(line['success'] and line['result']['media_id'] for line in lines[1:])
+
+
+def test_jobs_keep_running_after_the_client_disconnects(graph):
+    published = graph_stats().get('POST media_publish', 0)
+    lines = run_bulk([{'type': 'ig_post_image'}, *image_jobs(6, "disconnect")], DEFAULTS)
+
+    # The validation error goes out first; then the client goes away
+    assert json.loads(next(lines))['error'] == 'image_url is required'
+    lines.close()
+
+    wait_for(lambda: graph_stats().get('POST media_publish', 0) - published == 6)
@@ -0,0 +1,94 @@
+import hashlib
+import hmac
+import json
+import sqlite3
+
+import httpx
+import pytest
+
+import callbacks
+from bulk import run_bulk
+from callbacks import CallbackDispatcher, check_callback_url, signature
+from conftest import APP_ID, GRAPH_URL, media_url, wait_for
+
+SINK = f"{GRAPH_URL}/__callbacks"
+
+
+def received(**params):
+    return httpx.get(SINK, params=params).json()['events']
+
+
+@pytest.fixture
+def public_only(monkeypatch):
+    monkeypatch.setattr(callbacks, 'CALLBACK_HOSTS', set())
+
+
+@pytest.mark.parametrize('url', [
+    'http://127.0.0.1/hook', 'http://localhost:8000/hook', 'http://10.0.0.8/hook', 'http://192.168.1.1/hook',
+    'http://169.254.169.254/latest/meta-data/', 'http://[::1]/hook', 'http://[::ffff:127.0.0.1]/hook',
+    'http://0.0.0.0/hook', 'http://224.0.0.1/hook',
+])
+def test_private_addresses_are_refused(public_only, url):
+    with pytest.raises(ValueError, match="public address"):
+        check_callback_url(url)
+
+
+@pytest.mark.parametrize('url', ['ftp://example.com/hook', '/hook', 'http:///hook', None, 42])
+def test_only_absolute_http_urls_are_accepted(public_only, url):
+    with pytest.raises(ValueError, match="absolute http"):
+        check_callback_url(url)
+
+
+def test_unresolvable_hosts_are_refused(public_only):
+    with pytest.raises(ValueError, match="does not resolve"):
+        check_callback_url('https://callbacks.invalid/hook')
+
+
+def test_public_addresses_are_accepted(public_only):
+    assert check_callback_url('https://93.184.216.34/hook') == 'https://93.184.216.34/hook'
+
+
+def test_the_allowlist_is_exclusive(monkeypatch):
+    monkeypatch.setattr(callbacks, 'CALLBACK_HOSTS', {'127.0.0.1'})
+    assert check_callback_url('http://127.0.0.1:9000/hook')
+    with pytest.raises(ValueError, match="not allowed"):
+        check_callback_url('https://93.184.216.34/hook')
+
+
+@pytest.fixture
+def dispatcher(tmp_path):
+    return CallbackDispatcher(str(tmp_path / "callbacks.db"), secret='s', batch_window=0.05, poll_interval=0.05, max_attempts=1)
+
+
+def test_events_are_delivered_in_one_batch(graph, dispatcher):
+    ids = [dispatcher.send(SINK, {'type': 'publish.succeeded', 'job_id': 'batched'}) for _ in range(3)]
+
+    events = wait_for(lambda: len(received(job_id='batched')) == 3 and received(job_id='batched'))
+    assert sorted(event['id'] for event in events) == sorted(ids)
+    assert dispatcher.stats()['batches'] == 1
+
+
+def test_the_destination_is_checked_again_before_delivery(graph, dispatcher, monkeypatch):
+    event_id = dispatcher.send(SINK, {'type': 'publish.succeeded', 'job_id': 'rechecked'})
+    monkeypatch.setattr(callbacks, 'CALLBACK_HOSTS', {'hooks.example.com'})
+
+    wait_for(lambda: dispatcher.stats().get('failed') == 1)
+    with sqlite3.connect(dispatcher.db_path) as db:
+        assert db.execute("SELECT error FROM callbacks WHERE id = ?", (event_id,)).fetchone()[0] == \
+            "callback_url host is not allowed"
+    assert received(job_id='rechecked') == []
+
+
+def test_signatures_match_metas_scheme():
+    body = json.dumps({'events': []}).encode()
+    assert signature(body, 'secret') == 'sha256=' + hmac.new(b'secret', body, hashlib.sha256).hexdigest()
+
+
+def test_bulk_jobs_that_run_right_away_send_their_callback(graph):
+    defaults = {'app_id': APP_ID, 'app_secret': 'tests-secret', 'page_id': '200000000000600', 'access_token': 'token'}
+    job = {'type': 'ig_post_image', 'image_url': media_url('portrait.jpg'), 'caption': "bulk callback",
+           'id': 'bulk-callback', 'callback_url': SINK}
+
+    assert json.loads(next(run_bulk([job], defaults)))['success']
+    event = wait_for(lambda: [event for event in received() if event.get('bulk_id') == 'bulk-callback'])[0]
+    assert event['type'] == 'publish.succeeded' and event['result']['media_id']
@@ -0,0 +1,75 @@
+from collections import Counter
+
+from checkpoints import CheckpointStore, Workflow, workflow_key
+from conftest import graph_stats, media_url
+
+
+def calls_during(action):
+    before = Counter(graph_stats())
+    result = action()
+    return result, Counter(graph_stats()) - before
+
+
+def test_steps_are_saved_discarded_and_cleared(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoints.db"))
+    key = workflow_key('ig_post_image', 'app', 'page', {'image_url': 'a'})
+    workflow = Workflow(store, key)
+    workflow.save('container', '1')
+    workflow.save('item:0', '2')
+
+    resumed = Workflow(store, key)
+    assert resumed.get('container') == '1'
+    resumed.discard('container')
+    assert Workflow(store, key).completed == {'item:0': '2'}
+    resumed.finish()
+    assert Workflow(store, key).completed == {}
+
+
+def test_expired_steps_are_not_resumed(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoints.db"), ttl=-1)
+    Workflow(store, 'key').save('container', '1')
+    assert Workflow(store, 'key').get('container') is None
+
+
+def test_workflow_keys_follow_method_page_and_arguments():
+    key = workflow_key('ig_post_image', 'app', 'page', {'image_url': 'a', 'caption': 'b'})
+    assert key == workflow_key('ig_post_image', 'app', 'page', {'caption': 'b', 'image_url': 'a'})
+    assert key != workflow_key('ig_post_image', 'app', 'other', {'image_url': 'a', 'caption': 'b'})
+
+
+def test_a_retry_publishes_the_checkpointed_container(poster):
+    arguments = {'image_url': media_url('portrait.jpg'), 'caption': "checkpoint resume"}
+    prepared = poster.ig_post_image(**arguments, prepare_only=True)
+
+    result, calls = calls_during(lambda: poster.ig_post_image(**arguments))
+    assert result['success'] and result['creation_id'] == prepared['creation_id']
+    assert calls['POST media'] == 0 and calls['POST media_publish'] == 1
+    assert poster.workflow('ig_post_image', **arguments).completed == {}
+
+
+def test_a_retry_resumes_a_carousel_after_its_items(poster):
+    posts = [{'image_url': media_url(name), 'caption': "checkpoint carousel"} for name in ('portrait.jpg', 'square.jpg')]
+    prepared = poster.ig_post_carousel(posts, prepare_only=True)
+
+    result, calls = calls_during(lambda: poster.ig_post_carousel(posts))
+    assert result['success'] and result['creation_id'] == prepared['creation_id']
+    assert set(calls) == {'POST media_publish'}
+
+
+def test_a_dead_container_is_not_replayed(poster):
+    arguments = {'image_url': media_url('portrait.jpg'), 'caption': "checkpoint dead container"}
+    poster.workflow('ig_post_image', **arguments).save('container', '999')
+
+    failed = poster.ig_post_image(**arguments)
+    assert not failed['success'] and failed['creation_id'] == '999'
+    retried = poster.ig_post_image(**arguments)
+    assert retried['success'] and retried['creation_id'] != '999'
+
+
+def test_a_retry_finishes_an_uploaded_reel_without_uploading_again(poster):
+    arguments = {'video_url': media_url('reel.mp4'), 'caption': "checkpoint reel"}
+    prepared = poster.fb_upload_reel(**arguments, prepare_only=True)
+
+    result, calls = calls_during(lambda: poster.fb_upload_reel(**arguments))
+    assert result['success'] and result['video_id'] == prepared['video_id']
+    assert set(calls) == {'POST video_reels'}
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+import app as flask_module
+from conftest import APP_ID, graph_stats, media_url, page_headers
+from idempotency import IdempotencyStore, fingerprint, idempotency_store, scope
+
+PAGE_ID = '200000000000300'
+
+
+@pytest.fixture
+def store(tmp_path):
+    return IdempotencyStore(str(tmp_path / "idempotency.db"), stale_after=60)
+
+
+@pytest.fixture
+def client(graph):
+    return flask_module.app.test_client()
+
+
+def test_a_completed_key_replays_its_response(store):
+    assert store.begin('k', 'a') == ('new', None)
+    assert store.begin('k', 'a') == ('in_progress', None)
+    store.complete('k', '{"success": true}', 200)
+    assert store.begin('k', 'a') == ('completed', ('{"success": true}', 200))
+    assert store.begin('k', 'b') == ('mismatch', None)
+
+
+def test_an_abandoned_key_can_run_again(store):
+    store.begin('k', 'a')
+    store.abandon('k')
+    assert store.begin('k', 'a') == ('new', None)
+
+
+def test_a_stale_claim_is_taken_over(store):
+    store.begin('k', 'a')
+    store.stale_after = -1
+    assert store.begin('k', 'a') == ('new', None)
+
+
+def test_fingerprint_ignores_key_order():
+    assert fingerprint(b'{"a": 1, "b": 2}') == fingerprint(b'{"b": 2, "a": 1}')
+
+
+def test_a_duplicate_publish_is_replayed_without_graph(client):
+    body = {'image_url': media_url('portrait.jpg'), 'caption': "idempotent replay"}
+    headers = {**page_headers(PAGE_ID), 'Idempotency-Key': 'replay'}
+
+    first = client.post('/ig/post-image', json=body, headers=headers)
+    published = graph_stats().get('POST media_publish', 0)
+    second = client.post('/ig/post-image', json=body, headers=headers)
+
+    assert first.get_json()['success']
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert second.get_json() == first.get_json()
+    assert graph_stats().get('POST media_publish', 0) == published
+
+
+def test_keys_are_scoped_by_app(client):
+    body = {'image_url': media_url('portrait.jpg'), 'caption': "idempotent apps"}
+
+    first = client.post('/ig/post-image', json=body, headers={**page_headers(PAGE_ID), 'Idempotency-Key': 'apps'})
+    other_app = client.post(
+        '/ig/post-image', json=body, headers={**page_headers(PAGE_ID, app_id='100000000000002'), 'Idempotency-Key': 'apps'},
+    )
+
+    assert first.get_json()['success'] and other_app.get_json()['success']
+    assert 'Idempotent-Replayed' not in other_app.headers
+
+
+def test_a_duplicate_of_a_running_publish_gets_409(client):
+    body = {'image_url': media_url('portrait.jpg'), 'caption': "idempotent in flight"}
+    key = scope(APP_ID, PAGE_ID, '/ig/post-image', 'in-flight')
+    assert idempotency_store.begin(key, fingerprint(json.dumps(body).encode()))[0] == 'new'
+
+    response = client.post('/ig/post-image', json=body, headers={**page_headers(PAGE_ID), 'Idempotency-Key': 'in-flight'})
+    assert response.status_code == 409
+    assert response.headers['Retry-After'] == '5'
+
+
+def test_a_reused_key_with_a_different_body_is_rejected(client):
+    headers = {**page_headers(PAGE_ID), 'Idempotency-Key': 'mismatch'}
+    client.post('/ig/post-image', json={'image_url': media_url('portrait.jpg'), 'caption': "one"}, headers=headers)
+    response = client.post('/ig/post-image', json={'image_url': media_url('portrait.jpg'), 'caption': "two"}, headers=headers)
+    assert response.status_code == 422
@@ -0,0 +1,123 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import APP_ID, PAGE_ID, media_url, wait_for
+from jobs import JobQueue
+
+POSTER = SimpleNamespace(app_id=APP_ID, app_secret='tests-secret', page_id=PAGE_ID, long_lived_token_file='token')
+
+
+class RecordingQueue(JobQueue):
+    """
+    JobQueue whose jobs only record that they ran.
+    """
+
+    def __init__(self, db_path, calls, run=None, **options):
+        super().__init__(db_path, poll_interval=0.05, **options)
+        self.calls = calls
+        self.run = run
+
+    def call(self, job_id, method, args, credentials, **options):
+        self.calls.append(job_id)
+        if self.run:
+            self.run(job_id)
+        return [], {'success': True}, None
+
+
+def column(db_path, job_id, name):
+    with sqlite3.connect(db_path) as db:
+        return db.execute(f"SELECT {name} FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+
+def test_every_job_runs_exactly_once_across_queues(db_path):
+    calls = []
+    first = RecordingQueue(db_path, calls, workers=3)
+    second = RecordingQueue(db_path, calls, workers=3)
+    second.start()
+    job_ids = [first.enqueue(POSTER, 'ig_post_image', {'image_url': f"https://example.com/{i}.jpg"}) for i in range(30)]
+
+    wait_for(lambda: first.counts().get('succeeded') == 30)
+    assert Counter(calls) == Counter(job_ids)
+
+
+def test_credentials_are_erased_when_a_job_finishes(db_path):
+    queue = RecordingQueue(db_path, [])
+    done = queue.enqueue(POSTER, 'ig_post_image', {'image_url': 'https://example.com/a.jpg'})
+    scheduled = queue.enqueue(POSTER, 'ig_post_image', {'image_url': 'https://example.com/b.jpg'}, run_at=time.time() + 3600)
+    cancelled = queue.enqueue(POSTER, 'ig_post_image', {'image_url': 'https://example.com/c.jpg'}, run_at=time.time() + 3600)
+
+    wait_for(lambda: queue.get(done)['status'] == 'succeeded')
+    assert queue.cancel(cancelled)
+    assert column(db_path, done, 'credentials') is None
+    assert column(db_path, cancelled, 'credentials') is None
+    assert json.loads(column(db_path, scheduled, 'credentials'))['app_secret'] == 'tests-secret'
+    assert 'credentials' not in queue.get(scheduled)
+
+
+def test_a_crashing_job_is_marked_failed_and_the_worker_keeps_going(db_path):
+    def run(job_id):
+        if job_id == crashing:
+            raise RuntimeError("boom")
+
+    queue = RecordingQueue(db_path, [], run=run, workers=1)
+    crashing = queue.enqueue(POSTER, 'ig_post_image', {'image_url': 'https://example.com/a.jpg'})
+    after = queue.enqueue(POSTER, 'ig_post_image', {'image_url': 'https://example.com/b.jpg'})
+
+    wait_for(lambda: queue.get(after)['status'] == 'succeeded')
+    job = queue.get(crashing)
+    assert job['status'] == 'failed'
+    assert job['error'] == "boom"
+    assert column(db_path, crashing, 'credentials') is None
+
+
+def test_only_jobs_whose_lease_expired_are_requeued(db_path):
+    queue = RecordingQueue(db_path, [], lease=30)
+    leased = queue.enqueue(POSTER, 'ig_post_image', {'image_url': 'https://example.com/a.jpg'}, run_at=0)
+    expired = queue.enqueue(POSTER, 'ig_post_image', {'image_url': 'https://example.com/b.jpg'}, run_at=0)
+    legacy = queue.enqueue(POSTER, 'ig_post_image', {'image_url': 'https://example.com/c.jpg'}, run_at=0)
+    now = time.time()
+    # Claimed by other processes: one still alive, one dead, one from before leases existed
+    with sqlite3.connect(db_path) as db:
+        db.execute("UPDATE jobs SET status = 'running', started_at = ?, lease_until = ? WHERE id = ?", (now, now + 30, leased))
+        db.execute("UPDATE jobs SET status = 'running', started_at = ?, lease_until = ? WHERE id = ?", (now - 60, now - 1, expired))
+        db.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (now - 3600, legacy))
+
+    assert queue._requeue_expired() == 2
+    assert queue.get(leased)['status'] == 'running'
+    assert queue.get(expired)['status'] == 'queued'
+    assert queue.get(legacy)['status'] == 'queued'
+
+
+def test_running_jobs_keep_their_lease(db_path):
+    release = threading.Event()
+    queue = RecordingQueue(db_path, [], run=lambda job_id: release.wait(5), workers=1, lease=0.3)
+    job_id = queue.enqueue(POSTER, 'ig_post_image', {'image_url': 'https://example.com/a.jpg'})
+    wait_for(lambda: column(db_path, job_id, 'lease_until'))
+    first_lease = column(db_path, job_id, 'lease_until')
+
+    wait_for(lambda: column(db_path, job_id, 'lease_until') > first_lease)
+    assert queue.get(job_id)['status'] == 'running'
+    release.set()
+    wait_for(lambda: queue.get(job_id)['status'] == 'succeeded')
+    assert queue.calls == [job_id]
+
+
+def test_a_job_publishes_through_graph(graph, poster, db_path):
+    queue = JobQueue(db_path, poll_interval=0.05)
+    job_id = queue.enqueue(poster, 'ig_post_image', {'image_url': media_url('portrait.jpg'), 'caption': "job"})
+
+    job = wait_for(lambda: queue.get(job_id)['status'] in ('succeeded', 'failed') and queue.get(job_id))
+    assert job['status'] == 'succeeded', job['error']
+    assert job['result']['media_id']
+    assert job['steps']
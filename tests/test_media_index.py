@@ -0,0 +1,69 @@
+import pytest
+
+import preflight
+from cache import LRUCache
+from conftest import APP_ID, media_url
+from media_index import MediaIndex, media_index
+from meta import PostToFacebookPage
+
+POSTS = [{'image_url': 'https://example.com/a.jpg'}, {'image_url': 'https://example.com/b.jpg'}]
+
+
+@pytest.fixture
+def index(monkeypatch):
+    monkeypatch.setattr(preflight, 'media_version', lambda url: 'etag')
+    return MediaIndex(LRUCache("uploaded_media_tests"), lease=60)
+
+
+def carousel(page_id, caption):
+    poster = PostToFacebookPage(APP_ID, 'tests-secret', page_id, f"tests-user-token-{page_id}")
+    posts = [{'image_url': media_url(name), 'caption': caption} for name in ('portrait.jpg', 'square.jpg')]
+    return poster.ig_post_carousel(posts, prepare_only=True)
+
+
+def test_media_held_by_another_workflow_is_not_claimed(index):
+    index.remember('ig:1', POSTS[0]['image_url'], 'c1', 'first')
+
+    assert index.claim('ig:1', POSTS, [None, None], 'second') == {}
+    assert index.claim('ig:1', POSTS, [None, None], 'first') == {0: 'c1'}
+
+
+def test_released_or_expired_media_can_be_claimed(index):
+    index.remember('ig:1', POSTS[0]['image_url'], 'c1', 'first')
+    index.release('ig:1', POSTS, {0: 'c1'})
+    assert index.claim('ig:1', POSTS, [None, None], 'second') == {0: 'c1'}
+
+    index.lease = -1
+    index.remember('ig:1', POSTS[1]['image_url'], 'c2', 'first')
+    assert index.claim('ig:1', POSTS, [None, None], 'third') == {1: 'c2'}
+
+
+def test_published_and_forgotten_media_is_dropped(index):
+    index.remember('ig:1', POSTS[0]['image_url'], 'c1', 'first')
+    index.remember('ig:1', POSTS[1]['image_url'], 'c2', 'first')
+    index.published('ig:1', [POSTS[0]['image_url']])
+    index.forget('ig:1', POSTS[1]['image_url'])
+    assert index.claim('ig:1', POSTS, [None, None], 'first') == {}
+
+
+def test_media_is_only_claimed_for_posts_without_an_outcome(index):
+    index.remember('ig:1', POSTS[0]['image_url'], 'c1', 'first')
+    assert index.claim('ig:1', POSTS, [{'creation_id': 'c0'}, None], 'first') == {}
+
+
+def test_concurrent_carousels_upload_their_own_items(graph):
+    first = carousel('200000000000500', "index held one")
+    second = carousel('200000000000500', "index held two")
+
+    assert first['success'] and second['success']
+    assert not any(item.get('reused') for item in second['items'])
+    assert {item['creation_id'] for item in first['items']}.isdisjoint(item['creation_id'] for item in second['items'])
+
+
+def test_items_are_reused_once_their_lease_ran_out(graph, monkeypatch):
+    monkeypatch.setattr(media_index, 'lease', -1)
+    first = carousel('200000000000501', "index reused one")
+    second = carousel('200000000000501', "index reused two")
+
+    assert all(item.get('reused') for item in second['items'])
+    assert [item['creation_id'] for item in second['items']] == [item['creation_id'] for item in first['items']]
@@ -0,0 +1,90 @@
+import threading
+
+import httpx
+import pytest
+
+from conftest import GRAPH_URL
+from poller import ReelPoller
+
+
+def reel_container():
+    return httpx.post(f"{GRAPH_URL}/17841400000001/media", data={'media_type': 'REELS'}).json()['id']
+
+
+class Publisher():
+    """
+    on_finished callback that records its calls and answers like media_publish.
+    """
+
+    def __init__(self, media_id='m1'):
+        self.media_id = media_id
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, creation_id):
+        with self._lock:
+            self.calls.append(creation_id)
+        return {'success': True, 'creation_id': creation_id, 'media_id': self.media_id}
+
+
+@pytest.fixture
+def poller(graph):
+    return ReelPoller(min_interval=0.05, max_interval=0.2, timeout=10)
+
+
+def test_containers_are_published_once_processed(poller):
+    publish = Publisher()
+    creation_ids = [reel_container() for _ in range(3)]
+
+    results = [poller.submit(creation_id, 'token', publish).result(timeout=10) for creation_id in creation_ids]
+    assert [result['creation_id'] for result in results] == creation_ids
+    assert all(result['media_id'] == 'm1' for result in results)
+    assert sorted(publish.calls) == sorted(creation_ids)
+    assert poller.pending() == 0
+
+
+def test_every_waiter_gets_its_own_callback(poller):
+    creation_id = reel_container()
+    prepare = lambda creation_id: {'success': True, 'creation_id': creation_id}
+    publish, late_publish = Publisher('m1'), Publisher('m2')
+
+    prepared = poller.submit(creation_id, 'token', prepare)
+    published = poller.submit(creation_id, 'token', publish)
+    again = poller.submit(creation_id, 'token', late_publish)
+
+    assert prepared.result(timeout=10) == {'success': True, 'creation_id': creation_id}
+    assert published.result(timeout=10)['media_id'] == 'm1'
+    # Already published by the waiter before it
+    assert again.result(timeout=10)['media_id'] == 'm1'
+    assert publish.calls == [creation_id] and late_publish.calls == []
+
+
+def test_an_unknown_container_fails(poller):
+    result = poller.submit('999', 'token', Publisher()).result(timeout=10)
+    assert not result['success'] and result['status_code'] == 'ERROR'
+
+
+def test_failed_lookups_leave_containers_pending(poller):
+    failures = []
+    check = poller._check
+
+    def flaky_check(creation_ids, access_token):
+        if len(failures) < 3:
+            failures.append(creation_ids)
+            poller._retry(creation_ids, "connection reset")
+        else:
+            check(creation_ids, access_token)
+
+    poller._check = flaky_check
+    result = poller.submit(reel_container(), 'token', Publisher()).result(timeout=10)
+    assert len(failures) == 3
+    assert result['success']
+
+
+def test_lookups_that_keep_failing_time_out(poller):
+    poller.timeout = 0.3
+    poller._check = lambda creation_ids, access_token: poller._retry(creation_ids, "connection reset")
+
+    result = poller.submit(reel_container(), 'token', Publisher()).result(timeout=10)
+    assert not result['success']
+    assert result['error'] == "Media processing timed out, last status lookup failed: connection reset"
@@ -0,0 +1,44 @@
+import pytest
+
+import app as flask_module
+from conftest import media_url, page_headers
+
+HEADERS = page_headers('200000000000400')
+
+
+@pytest.fixture
+def client(graph):
+    return flask_module.app.test_client()
+
+
+def test_a_prepared_reel_commits_once(client):
+    body = {'type': 'ig_upload_reel', 'video_url': media_url('reel.mp4'), 'caption': "prepare reel"}
+    prepared = client.post('/ig/prepare', json=body, headers=HEADERS).get_json()
+    assert prepared['success'] and prepared['handle']
+
+    committed = client.post('/ig/commit', json={'handle': prepared['handle']}, headers=HEADERS)
+    assert committed.get_json()['success'] and committed.get_json()['media_id']
+    again = client.post('/ig/commit', json={'handle': prepared['handle']}, headers=HEADERS)
+    assert again.status_code == 409
+    assert again.get_json()['media_id'] == committed.get_json()['media_id']
+
+
+def test_the_same_publish_is_not_prepared_under_two_open_handles(client):
+    body = {'type': 'ig_post_image', 'image_url': media_url('portrait.jpg'), 'caption': "prepare twice"}
+    first = client.post('/ig/prepare', json=body, headers=HEADERS).get_json()
+
+    second = client.post('/ig/prepare', json=body, headers=HEADERS)
+    assert second.status_code == 409
+    assert second.get_json()['open_handle'] == first['handle']
+
+    assert client.post('/ig/commit', json={'handle': first['handle']}, headers=HEADERS).get_json()['success']
+    third = client.post('/ig/prepare', json=body, headers=HEADERS).get_json()
+    assert third['success'] and third['creation_id'] != first['creation_id']
+
+
+def test_a_handle_is_only_committed_by_its_page(client):
+    body = {'type': 'ig_post_image', 'image_url': media_url('portrait.jpg'), 'caption': "prepare other page"}
+    handle = client.post('/ig/prepare', json=body, headers=HEADERS).get_json()['handle']
+
+    response = client.post('/ig/commit', json={'handle': handle}, headers=page_headers('200000000000401'))
+    assert response.status_code == 404
@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+from conftest import media_url, wait_for
+from jobs import JobQueue
+from scheduler import PublishScheduler, page_offset, parse_publish_at
+
+
+@pytest.mark.parametrize('value, expected', [
+    (1767225600, 1767225600.0),
+    ("1767225600.5", 1767225600.5),
+    ("2026-01-01T00:00:00Z", 1767225600.0),
+    ("2026-01-01T00:00:00", 1767225600.0),
+    ("2026-01-01T02:00:00+02:00", 1767225600.0),
+])
+def test_publish_at_accepts_timestamps_and_iso_dates(value, expected):
+    assert parse_publish_at(value) == expected
+
+
+@pytest.mark.parametrize('value', ["nan", "inf", "-inf", "1e400", 10 ** 400, True, None, [], "tomorrow", ""])
+def test_publish_at_rejects_everything_else(value):
+    with pytest.raises(ValueError):
+        parse_publish_at(value)
+
+
+def test_page_offsets_are_stable_and_spread_over_the_window():
+    offsets = [page_offset(str(page_id), 60) for page_id in range(200)]
+    assert all(0 <= offset < 60 for offset in offsets)
+    assert offsets == [page_offset(str(page_id), 60) for page_id in range(200)]
+    assert len(set(offsets)) == 200
+    assert min(offsets) < 15 and max(offsets) > 45
+    assert page_offset('1', 0) == 0.0
+
+
+def test_a_scheduled_job_runs_at_its_page_offset(tmp_path, poster):
+    scheduler = PublishScheduler(JobQueue(str(tmp_path / "jobs.db")), lead=600, jitter=60)
+    publish_at = time.time() + 3600
+
+    job_id, run_at = scheduler.schedule(poster, 'ig_post_image', {'image_url': media_url('portrait.jpg')}, publish_at)
+    assert run_at == publish_at + page_offset(poster.page_id, 60)
+    job = scheduler.queue.get(job_id)
+    assert job['status'] == 'scheduled' and job['run_at'] == run_at
+
+
+def test_a_publish_time_in_the_past_is_queued_right_away(tmp_path, poster):
+    scheduler = PublishScheduler(JobQueue(str(tmp_path / "jobs.db"), poll_interval=0.05), jitter=60)
+    job_id, _ = scheduler.schedule(
+        poster, 'ig_post_image', {'image_url': media_url('portrait.jpg'), 'caption': "scheduler past"}, time.time() - 1,
+    )
+    assert wait_for(lambda: scheduler.queue.get(job_id)['status'] == 'succeeded')
+
+
+def test_a_scheduled_job_is_prepared_then_published(tmp_path, poster):
+    scheduler = PublishScheduler(JobQueue(str(tmp_path / "jobs.db"), poll_interval=0.05), lead=600, jitter=0)
+    arguments = {'image_url': media_url('portrait.jpg'), 'caption': "scheduler prepared"}
+    job_id, run_at = scheduler.schedule(poster, 'ig_post_image', arguments, time.time() + 1)
+
+    wait_for(lambda: scheduler.queue.get(job_id)['status'] == 'prepared')
+    job = wait_for(lambda: scheduler.queue.get(job_id)['status'] in ('succeeded', 'failed') and scheduler.queue.get(job_id))
+    assert job['status'] == 'succeeded', job['error']
+    assert job['started_at'] >= run_at
+    assert [step['endpoint'].rsplit('/', 1)[-1] for step in job['steps']] == ['media_publish']
@@ -0,0 +1,156 @@
+import asyncio
+import os
+import struct
+
+import pytest
+
+import meta
+import meta_async
+import staging
+from conftest import APP_ID, PAGE_ID, media_url
+from meta_async import AsyncPostToFacebookPage, close_client
+from staging import StagingArea, faststart, top_level_boxes
+
+
+def box(kind, body):
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def chunk_table(kind, offsets):
+    width = 'Q' if kind == b'co64' else 'I'
+    return box(kind, struct.pack('>II', 0, len(offsets)) + struct.pack(f'>{len(offsets)}{width}', *offsets))
+
+
+def moov_last_mp4(path):
+    """
+    ftyp, mdat, free, moov, udta: a video track with an stco and an audio
+    track with a co64 table, each chunk pointing at distinct mdat bytes.
+    """
+    ftyp = box(b'ftyp', b'isom\x00\x00\x02\x00isomiso2avc1mp41')
+    payload = bytes(range(256)) * 64
+    data_start = len(ftyp) + 8
+    video = [data_start + i * 1024 for i in range(8)]
+    audio = [data_start + 512 + i * 1024 for i in range(8)]
+
+    def trak(table):
+        return box(b'trak', box(b'mdia', box(b'minf', box(b'stbl', table))))
+
+    moov = box(b'moov', box(b'mvhd', b'\x00' * 100) + trak(chunk_table(b'stco', video)) + trak(chunk_table(b'co64', audio)))
+    with open(path, 'wb') as output:
+        output.write(ftyp + box(b'mdat', payload) + box(b'free', b'\x00' * 32) + moov + box(b'udta', b'tail'))
+    return video + audio
+
+
+def chunk_offsets(path):
+    """
+    Every chunk offset in the moov of `path`, video track first.
+    """
+    kind, offset, size = next(entry for entry in top_level_boxes(path) if entry[0] == b'moov')
+    with open(path, 'rb') as media:
+        media.seek(offset + 8)
+        data = media.read(size - 8)
+
+    offsets = []
+
+    def walk(data):
+        position = 0
+        while position + 8 <= len(data):
+            length, kind = struct.unpack('>I4s', data[position:position + 8])
+            body = data[position + 8:position + length]
+            if kind in staging.CONTAINER_BOXES:
+                walk(body)
+            elif kind in (b'stco', b'co64'):
+                count = struct.unpack('>I', body[4:8])[0]
+                width = 'Q' if kind == b'co64' else 'I'
+                offsets.extend(struct.unpack(f'>{count}{width}', body[8:8 + count * struct.calcsize(width)]))
+            position += length
+
+    walk(data)
+    return offsets
+
+
+def read_at(path, offset, length=16):
+    with open(path, 'rb') as media:
+        media.seek(offset)
+        return media.read(length)
+
+
+def test_faststart_moves_moov_in_front_and_patches_chunk_offsets(tmp_path):
+    source, destination = str(tmp_path / "source.mp4"), str(tmp_path / "faststart.mp4")
+    original = moov_last_mp4(source)
+
+    assert faststart(source, destination)
+    assert [kind for kind, _, _ in top_level_boxes(destination)] == [b'ftyp', b'moov', b'mdat', b'free', b'udta']
+    assert os.path.getsize(destination) == os.path.getsize(source)
+    moved = chunk_offsets(destination)
+    assert len(moved) == len(original)
+    assert [read_at(destination, offset) for offset in moved] == [read_at(source, offset) for offset in original]
+
+
+def test_faststart_leaves_files_that_are_already_faststart(tmp_path):
+    source, remuxed, again = str(tmp_path / "source.mp4"), str(tmp_path / "remuxed.mp4"), str(tmp_path / "again.mp4")
+    moov_last_mp4(source)
+    faststart(source, remuxed)
+
+    assert not faststart(remuxed, again)
+    assert not os.path.exists(again)
+
+
+def test_faststart_refuses_an_oversized_moov(tmp_path):
+    source = str(tmp_path / "source.mp4")
+    moov_last_mp4(source)
+    with pytest.raises(ValueError):
+        faststart(source, str(tmp_path / "out.mp4"), max_moov_bytes=64)
+
+
+def test_only_too_heavy_reels_are_transcoded(tmp_path):
+    area = StagingArea(str(tmp_path), max_bitrate=25_000_000, max_dimension=1920)
+    assert not area._too_heavy({'size': 20_000_000, 'duration': 15, 'width': 1080, 'height': 1920}, staging.preflight.SPECS['ig_reel'])
+    assert area._too_heavy({'size': 200_000_000, 'duration': 15}, staging.preflight.SPECS['fb_reel'])
+    assert area._too_heavy({'width': 2160, 'height': 3840}, staging.preflight.SPECS['fb_reel'])
+    assert area._too_heavy({'size': 2048 * 1024 * 1024}, staging.preflight.SPECS['ig_reel'])
+
+
+@pytest.fixture
+def area(tmp_path, graph):
+    return StagingArea(str(tmp_path / "staged"), public_url='http://staging.invalid/', index=None)
+
+
+def test_a_moov_last_reel_is_staged_and_served_from_disk(area):
+    staged = area.stage(media_url('reel-moov-last.mp4'), 'ig_reel')
+
+    assert staged.startswith('http://staging.invalid/staged/')
+    path = area.local_path(staged)
+    assert [kind for kind, _, _ in top_level_boxes(path)][:2] == [b'ftyp', b'moov']
+    assert area.local_path('http://staging.invalid/staged/../jobs.db') is None
+    assert area.local_path(media_url('reel.mp4')) is None
+    assert area.stats()['remuxed'] == 1
+
+
+def test_a_faststart_reel_is_not_staged(area):
+    url = media_url('reel.mp4')
+    assert area.stage(url, 'ig_reel') == url
+    assert area.stats()['files'] == 0
+
+
+def test_a_staged_facebook_reel_is_uploaded_from_disk(area, poster, monkeypatch):
+    monkeypatch.setattr(meta, 'staging_area', area)
+
+    # The public URL does not resolve, so this only works if the relay reads the file
+    result = poster.fb_upload_reel(media_url('reel-moov-last.mp4'), "staged from disk")
+    assert result['success'], result
+    assert area.stats()['files'] == 1
+
+
+def test_the_async_poster_also_uploads_staged_reels_from_disk(area, monkeypatch):
+    monkeypatch.setattr(meta_async, 'staging_area', area)
+    poster = AsyncPostToFacebookPage(APP_ID, 'tests-secret', PAGE_ID, f"tests-user-token-{PAGE_ID}")
+
+    async def upload():
+        try:
+            return await poster.fb_upload_reel(media_url('reel-moov-last.mp4'), "async staged from disk")
+        finally:
+            await close_client()
+
+    result = asyncio.run(upload())
+    assert result['success'], result
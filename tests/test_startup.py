@@ -0,0 +1,30 @@
+import json
+import os
+import subprocess
+import sys
+
+from conftest import REPO
+
+IMPORT_APP = """
+import json, threading
+import app
+before = sorted(thread.name for thread in threading.enumerate())
+app.start_background()
+after = sorted(thread.name for thread in threading.enumerate())
+print(json.dumps([before, after]))
+"""
+
+
+def test_importing_the_app_starts_nothing_and_writes_only_to_the_data_dir(tmp_path):
+    data_dir, cwd = tmp_path / "data", tmp_path / "cwd"
+    cwd.mkdir()
+    env = {key: value for key, value in os.environ.items() if not key.startswith('META_')}
+    env.update(META_DATA_DIR=str(data_dir), PYTHONPATH=REPO)
+
+    output = subprocess.run([sys.executable, '-c', IMPORT_APP], cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    before, after = json.loads(output.stdout.splitlines()[-1])
+
+    assert before == ['MainThread']
+    assert {'publish-scheduler', 'callback-dispatcher', 'publish-leases', 'publish-worker-0'} <= set(after)
+    assert os.listdir(cwd) == []
+    assert {'jobs.db', 'checkpoints.db', 'idempotency.db', 'callbacks.db', 'prepared.db'} <= set(os.listdir(data_dir))
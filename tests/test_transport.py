@@ -0,0 +1,38 @@
+import pytest
+
+import transport
+from transport import endpoint_class, endpoint_template, is_graph_host
+
+
+@pytest.mark.parametrize('host', ['facebook.com', 'graph.facebook.com', 'rupload.facebook.com', transport.GRAPH_HOST])
+def test_meta_hosts_are_graph_hosts(host):
+    assert is_graph_host(host)
+
+
+@pytest.mark.parametrize('host', ['evilfacebook.com', 'facebook.com.example.org', 'example.com', ''])
+def test_lookalike_hosts_are_not_graph_hosts(host):
+    assert not is_graph_host(host)
+
+
+def test_non_meta_hosts_get_no_breaker_or_graph_template():
+    assert endpoint_class('POST', 'https://evilfacebook.com/123/media') is None
+    assert endpoint_template('https://evilfacebook.com/123/media?access_token=secret') == 'evilfacebook.com'
+
+
+@pytest.mark.parametrize('method, url, kwargs, expected', [
+    ('POST', 'https://graph.facebook.com/v20.0/123/media_publish', {}, 'publish'),
+    ('POST', 'https://graph.facebook.com/123/media', {}, 'media_create'),
+    ('POST', 'https://graph.facebook.com/v22.0/123/video_reels', {'json': {'upload_phase': 'finish'}}, 'publish'),
+    ('POST', 'https://rupload.facebook.com/video-upload/v22.0/456', {}, 'rupload'),
+    ('GET', 'https://graph.facebook.com/123', {'params': {'fields': 'access_token'}}, 'page_token'),
+    ('GET', 'https://graph.facebook.com/123', {'params': {'fields': 'status_code'}}, 'status'),
+    ('POST', 'https://graph.facebook.com/', {}, 'batch'),
+    ('GET', 'https://graph.facebook.com/oauth/access_token', {}, 'oauth'),
+])
+def test_endpoint_class(method, url, kwargs, expected):
+    assert endpoint_class(method, url, **kwargs) == expected
+
+
+def test_endpoint_template_drops_ids_and_tokens():
+    assert endpoint_template('https://graph.facebook.com/v20.0/17841400000000001/media?access_token=secret') == \
+        'graph.facebook.com/v20.0/{id}/media'
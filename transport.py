@@ -0,0 +1,340 @@
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from breaker import circuit_breakers
+from ratelimit import rate_governor
+
+# Default pool size per host; individual hosts can be overridden with
+# META_HTTP_POOL_SIZES="rupload.facebook.com=4,graph.facebook.com=32"
+POOL_SIZE = int(os.getenv("META_HTTP_POOL_SIZE", 20))
+CONNECT_TIMEOUT = float(os.getenv("META_HTTP_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.getenv("META_HTTP_READ_TIMEOUT", 60))
+# Point at a local simulator (bench/mock_graph.py) to run without Meta
+GRAPH_URL = os.getenv("META_GRAPH_URL", "https://graph.facebook.com").rstrip("/")
+GRAPH_HOST = urlsplit(GRAPH_URL).hostname
+# Idempotent GETs sent with hedge=True get a second, identical request when
+# the first has not answered after this many seconds; 0 disables hedging
+HEDGE_DELAY = float(os.getenv("META_HEDGE_DELAY", 0))
+HEDGE_WORKERS = int(os.getenv("META_HEDGE_WORKERS", 32))
+
+
+def _parse_pool_sizes(value):
+    sizes = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            host, size = item.split("=", 1)
+            sizes[host.strip()] = int(size)
+    return sizes
+
+
+HOST_POOL_SIZES = _parse_pool_sizes(os.getenv("META_HTTP_POOL_SIZES"))
+
+# Adapters own the urllib3 connection pools and are shared by every thread;
+# each thread gets its own Session on top so cookie/header state never races.
+_default_adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+_host_adapters = {
+    host: HTTPAdapter(pool_connections=1, pool_maxsize=size)
+    for host, size in HOST_POOL_SIZES.items()
+}
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_host_stats = {}
+_hedge_stats = {"hedged": 0, "hedge_won": 0}
+_hedge_executor = None
+
+# Steps recorded for the current publish, see trace()
+_trace = contextvars.ContextVar("graph_trace", default=None)
+
+
+def get_session():
+    """
+    Return the calling thread's keep-alive session, backed by the shared pools.
+    """
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.mount("https://", _default_adapter)
+        session.mount("http://", _default_adapter)
+        for host, adapter in _host_adapters.items():
+            session.mount(f"https://{host}/", adapter)
+        _local.session = session
+    return session
+
+
+def request(method, url, timeout=None, budget=None, hedge=False, **kwargs):
+    """
+    Send a request through the shared session with default connect/read timeouts.
+
+    When `budget` is an (app_id, page_id) pair, calls to Meta hosts are paced
+    by the rate governor and throttled responses are retried with backoff.
+    Calls to Meta hosts go through the circuit breaker of their endpoint
+    class, which raises CircuitOpenError while that class is failing. With
+    hedge=True (idempotent GETs only) a slow call is raced by a second one.
+    """
+    host = urlsplit(url).hostname or ""
+    governed = budget is not None and is_graph_host(host)
+    breaker = endpoint_class(method, url, kwargs.get('params'), kwargs.get('json'))
+    send = _send_hedged if hedge and HEDGE_DELAY > 0 and method == 'GET' else _send
+    attempt = 0
+    while True:
+        if governed:
+            rate_governor.before_request(*budget)
+        circuit_breakers.before(breaker)
+        try:
+            response = send(method, url, host, timeout, **kwargs)
+        except requests.exceptions.RequestException:
+            circuit_breakers.record(breaker, False)
+            raise
+        except BaseException:
+            # Failed on our side, which says nothing about the endpoint
+            circuit_breakers.release(breaker)
+            raise
+        circuit_breakers.record(breaker, response.status_code < 500)
+        if not governed:
+            return response
+
+        rate_governor.record(*budget, response.headers)
+        if attempt >= rate_governor.max_retries or not rate_governor.is_throttled(response):
+            return response
+        delay = rate_governor.backoff(*budget, response, attempt)
+        response.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+def _send(method, url, host, timeout, **kwargs):
+    started = time.monotonic()
+    response = None
+    try:
+        response = get_session().request(
+            method, url, timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs
+        )
+        return response
+    finally:
+        if response is None:
+            observe(method, url, None, started)
+        else:
+            body = response.request.body
+            streamed = kwargs.get('stream', False)
+            observe(
+                method, url, response.status_code, started,
+                # Streamed bodies are left unread for the caller
+                error_code=None if streamed else graph_error_code(response),
+                bytes_sent=len(body) if isinstance(body, (bytes, str)) else 0,
+                bytes_received=int(response.headers.get('Content-Length') or 0) if streamed else len(response.content),
+            )
+
+
+def _send_hedged(method, url, host, timeout, **kwargs):
+    """
+    _send, plus a second identical request if the first has not answered
+    within HEDGE_DELAY. The first successful response wins; the other one is
+    closed when it arrives.
+    """
+    executor = _get_hedge_executor()
+    context = contextvars.copy_context()
+    first = executor.submit(context.copy().run, _send, method, url, host, timeout, **kwargs)
+    try:
+        return first.result(timeout=HEDGE_DELAY)
+    except FutureTimeout:
+        pass
+
+    second = executor.submit(context.copy().run, _send, method, url, host, timeout, **kwargs)
+    count_hedge()
+    done, _ = wait([first, second], return_when=FIRST_COMPLETED)
+    if all(future.exception() is not None for future in done):
+        # The other attempt may still succeed
+        wait([first, second])
+    winner = next((future for future in (first, second) if future.done() and future.exception() is None), first)
+    loser = second if winner is first else first
+    loser.add_done_callback(_close_unused)
+    if winner is second:
+        count_hedge(won=True)
+    return winner.result()
+
+
+def _close_unused(future):
+    if future.exception() is None:
+        future.result().close()
+
+
+def _get_hedge_executor():
+    global _hedge_executor
+    with _stats_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="graph-hedge")
+        return _hedge_executor
+
+
+def count_hedge(won=False):
+    with _stats_lock:
+        _hedge_stats["hedge_won" if won else "hedged"] += 1
+
+
+def hedge_stats():
+    with _stats_lock:
+        return dict(_hedge_stats, delay=HEDGE_DELAY)
+
+
+def observe(method, url, status, started, error_code=None, bytes_sent=0, bytes_received=0):
+    """
+    Record one outbound call (status None means it raised) in the per-host
+    counters, the Prometheus metrics and the active trace. Shared by the sync
+    and asyncio clients.
+    """
+    duration = time.monotonic() - started
+    host = urlsplit(url).hostname or ""
+    endpoint = endpoint_template(url)
+    _count(host, "requests")
+    if status is None:
+        _count(host, "errors")
+    metrics.observe_call(method, endpoint, status, duration, error_code, bytes_sent, bytes_received)
+
+    steps = _trace.get()
+    if steps is not None:
+        steps.append({
+            "endpoint": f"{method} {endpoint}",
+            "status": status,
+            "graph_error_code": error_code,
+            "bytes_sent": bytes_sent,
+            "bytes_received": bytes_received,
+            "duration_ms": round(duration * 1000, 1),
+        })
+
+
+def graph_error_code(response):
+    """
+    The Graph `error.code` of a failed response, or None.
+    """
+    if response.status_code < 400:
+        return None
+    try:
+        error = response.json().get('error')
+    except (ValueError, AttributeError):
+        return None
+    return error.get('code') if isinstance(error, dict) else None
+
+
+def is_graph_host(host):
+    """
+    True for Meta API hosts (Graph, rupload) and the configured GRAPH_URL.
+    """
+    return host == "facebook.com" or host.endswith(".facebook.com") or host == GRAPH_HOST
+
+
+def endpoint_class(method, url, params=None, json=None):
+    """
+    Circuit breaker class of a call: oauth, page_token, media_create,
+    publish, rupload, status, batch or graph. None for non-Meta hosts.
+    """
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    if not is_graph_host(host):
+        return None
+    segments = [segment for segment in parts.path.split("/") if segment]
+    if host.startswith("rupload") or segments[:1] == ["rupload"]:
+        return "rupload"
+    if segments and segments[0][:1] == "v" and segments[0][1:].replace(".", "").isdigit():
+        segments = segments[1:]
+
+    edge = segments[1] if len(segments) > 1 else None
+    if segments == ["oauth", "access_token"]:
+        return "oauth"
+    if edge in ("media_publish", "feed") or (edge == "video_reels" and (json or {}).get("upload_phase") == "finish"):
+        return "publish"
+    if edge in ("media", "photos", "video_reels") and method == "POST":
+        return "media_create"
+    if not segments:
+        return "batch" if method == "POST" else "status"
+    if edge is None and method == "GET":
+        fields = str((params or {}).get("fields", "")) + ",".join(parse_qs(parts.query).get("fields", []))
+        if "access_token" in fields or "instagram_business_account" in fields:
+            return "page_token"
+        return "status"
+    return "graph"
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def endpoint_template(url):
+    """
+    Reduce a URL to a low-cardinality template: query strings (and the access
+    tokens in them) are dropped and numeric Graph object IDs become {id}.
+    Non-Meta hosts such as S3 collapse to just the host name.
+    """
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    if not is_graph_host(host):
+        return host
+    segments = ["{id}" if segment.isdigit() else segment for segment in parts.path.split("/") if segment]
+    return "/".join([host, *segments])
+
+
+@contextmanager
+def trace():
+    """
+    Record every request made in this context (including from threads that
+    run a copy of it) as a list of {endpoint, status, duration_ms, ...} steps.
+    """
+    steps, token = start_trace()
+    try:
+        yield steps
+    finally:
+        end_trace(token)
+
+
+def start_trace():
+    """
+    Begin recording in the current context; returns (steps, token) for end_trace().
+    """
+    steps = []
+    return steps, _trace.set(steps)
+
+
+def end_trace(token):
+    _trace.reset(token)
+
+
+def _count(host, field):
+    with _stats_lock:
+        stats = _host_stats.setdefault(host, {"requests": 0, "errors": 0})
+        stats[field] += 1
+
+
+def pool_stats():
+    """
+    Per-host request counters plus the state of each urllib3 connection pool.
+    """
+    with _stats_lock:
+        stats = {host: dict(values) for host, values in _host_stats.items()}
+
+    for adapter in [_default_adapter, *_host_adapters.values()]:
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            entry = stats.setdefault(pool.host, {"requests": 0, "errors": 0})
+            # The pool queue is pre-filled with None placeholders; only real
+            # connections are idle keep-alive sockets
+            idle = [conn for conn in list(pool.pool.queue) if conn is not None] if pool.pool else []
+            entry["pool_maxsize"] = pool.pool.maxsize if pool.pool else 0
+            entry["idle_connections"] = len(idle)
+            entry["connections_opened"] = pool.num_connections
+    return stats
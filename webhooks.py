@@ -0,0 +1,105 @@
+import hmac
+import os
+import threading
+
+from callbacks import signature
+from poller import reel_poller
+
+# Reel processing states as reported by Page `videos` webhooks
+VIDEO_STATUS_CODES = {'ready': 'FINISHED', 'error': 'ERROR', 'processing': 'IN_PROGRESS'}
+
+
+def status_updates(payload):
+    """
+    (object_id, status_code) of every media or video status change in a
+    webhook payload: Page `videos` changes carry status.video_status, media
+    changes a status_code like the container lookup returns.
+    """
+    entries = payload.get('entry') if isinstance(payload, dict) else None
+    for entry in entries if isinstance(entries, list) else []:
+        changes = entry.get('changes') if isinstance(entry, dict) else None
+        for change in changes if isinstance(changes, list) else []:
+            value = change.get('value') if isinstance(change, dict) else None
+            if not isinstance(value, dict):
+                continue
+            object_id = value.get('media_id') or value.get('video_id') or value.get('id')
+            status_code = value.get('status_code')
+            if status_code is None and isinstance(value.get('status'), dict):
+                video_status = value['status'].get('video_status')
+                status_code = VIDEO_STATUS_CODES.get(video_status, video_status)
+            if object_id and status_code:
+                yield str(object_id), str(status_code).upper()
+
+
+class WebhookReceiver():
+    """
+    Receiver for Meta webhook subscriptions.
+
+    Handles the GET verification handshake, checks the X-Hub-Signature-256
+    of each delivery against the configured app secrets (one per Meta app
+    this service publishes for) and turns media/video status changes into
+    reel_poller.wake() calls, so a reel is published as soon as Instagram
+    finishes processing it instead of at the poller's next backoff step. The
+    poller keeps polling as the fallback for missed deliveries; with webhooks
+    subscribed its intervals (META_REEL_POLL_*) can be raised.
+
+    Only containers tracked by this process are woken; the others are
+    counted as ignored.
+    """
+
+    def __init__(self, poller, verify_token=None, app_secrets=()):
+        self.poller = poller
+        self.verify_token = verify_token
+        self.app_secrets = [secret for secret in app_secrets if secret]
+        self._lock = threading.Lock()
+        self.counts = {'deliveries': 0, 'rejected': 0, 'status_events': 0, 'woken': 0, 'ignored': 0}
+
+    def verify(self, args):
+        """
+        The hub.challenge to echo for a subscription handshake, or None when
+        the verify token does not match.
+        """
+        if not self.verify_token or args.get('hub.mode') != 'subscribe':
+            return None
+        if not hmac.compare_digest(args.get('hub.verify_token') or '', self.verify_token):
+            return None
+        return args.get('hub.challenge')
+
+    def authentic(self, body, header):
+        """
+        True when `header` is a valid sha256 signature of the raw body for
+        one of the app secrets. Without secrets nothing is accepted.
+        """
+        ok = bool(header) and any(hmac.compare_digest(signature(body, secret), header) for secret in self.app_secrets)
+        if not ok:
+            self._count('rejected')
+        return ok
+
+    def consume(self, payload):
+        """
+        Wake the poller for the status changes in a verified delivery.
+        Returns the counts for this delivery.
+        """
+        updates = list(status_updates(payload))
+        # Terminal or not, the poller's own lookup decides what happens next
+        woken = self.poller.wake([object_id for object_id, status_code in updates if status_code != 'IN_PROGRESS'])
+        self._count('deliveries')
+        self._count('status_events', len(updates))
+        self._count('woken', woken)
+        self._count('ignored', len(updates) - woken)
+        return {'status_events': len(updates), 'woken': woken}
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, configured=bool(self.verify_token and self.app_secrets))
+
+    def _count(self, field, n=1):
+        with self._lock:
+            self.counts[field] += n
+
+
+webhook_receiver = WebhookReceiver(
+    reel_poller,
+    verify_token=os.getenv("META_WEBHOOK_VERIFY_TOKEN"),
+    app_secrets=os.getenv("META_WEBHOOK_APP_SECRETS", "").split(","),
+)